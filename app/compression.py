@@ -0,0 +1,256 @@
+# app/compression.py
+"""
+Compression des réponses (gzip / brotli).
+
+- CompressionMiddleware : middleware ASGI pur, négocie Accept-Encoding
+  (br si le module brotli est installé, sinon gzip). Corps complet sous
+  COMPRESS_MIN_BYTES → envoyé tel quel ; réponses en streaming (exports CSV)
+  compressées au fil de l'eau. L'ETag forte de l'application reste forte,
+  suffixée par codage ("v" → "v-br") : une ETag par représentation.
+- StaticPage : page HTML constante compressée une seule fois à l'import,
+  servie avec ETag (304) et Cache-Control longue durée.
+"""
+import gzip
+import hashlib
+import os
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:     # gzip seul
+    brotli = None
+
+COMPRESS_ENABLED    = os.getenv("COMPRESS_ENABLED", "1") == "1"
+COMPRESS_MIN_BYTES  = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BR_QUALITY = int(os.getenv("COMPRESS_BR_QUALITY", "4"))   # dynamique : rapide
+STATIC_PAGE_MAX_AGE = int(os.getenv("STATIC_PAGE_MAX_AGE", "86400"))
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/geo+json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+    "application/vnd.mapbox-vector-tile",
+)
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """ETag forte de la représentation compressée : "v" → "v-br" (faible : inchangée)."""
+    if etag.startswith("W/") or not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def base_etag(tag: str) -> str:
+    """Inverse de encoded_etag (+ W/ retiré) : ETag de l'application, pour If-None-Match."""
+    tag = tag.strip().removeprefix("W/")
+    for enc in ("br", "gzip"):
+        suffix = f'-{enc}"'
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)] + '"'
+    return tag
+
+
+def negotiate(accept_encoding: Optional[str], available=None) -> Optional[str]:
+    """Meilleur codage accepté par le client parmi `available` (br > gzip), ou None."""
+    if not accept_encoding:
+        return None
+    if available is None:
+        available = ("br", "gzip") if brotli is not None else ("gzip",)
+    q = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        q[name.strip()] = weight
+    best, best_q = None, 0.0
+    for enc in available:
+        w = q.get(enc, q.get("*", 0.0))
+        if w > best_q:
+            best, best_q = enc, w
+    return best
+
+
+class _Gzip:
+    def __init__(self, level: int):
+        self._z = zlib.compressobj(level, zlib.DEFLATED, 31)    # 31 = en-tête gzip
+
+    def compress(self, data: bytes) -> bytes:
+        return self._z.compress(data)
+
+    def flush(self) -> bytes:
+        return self._z.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._z.flush()
+
+
+class _Brotli:
+    def __init__(self, quality: int):
+        self._c = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.process(data)
+
+    def flush(self) -> bytes:
+        return self._c.flush()
+
+    def finish(self) -> bytes:
+        return self._c.finish()
+
+
+def _compressor(encoding: str):
+    if encoding == "br":
+        return _Brotli(COMPRESS_BR_QUALITY)
+    return _Gzip(COMPRESS_GZIP_LEVEL)
+
+
+def _compressible(headers: Headers) -> bool:
+    if "content-encoding" in headers:
+        return False
+    if "no-transform" in headers.get("cache-control", ""):
+        return False
+    ctype = headers.get("content-type", "")
+    return ctype.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not COMPRESS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _Responder(self.app, encoding, self.minimum_size)(scope, receive, send)
+
+
+class _Responder:
+    def __init__(self, app, encoding: str, minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send = None
+        self.start_message = None
+        self.passthrough = False
+        self.compressor = None
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        self.if_none_match = Headers(scope=scope).get("if-none-match") or ""
+        await self.app(scope, receive, self.send_wrapper)
+
+    def _not_modified_etag(self, headers: MutableHeaders):
+        # 304 : même ETag que la représentation validée par le client
+        etag = headers.get("etag")
+        if etag:
+            encoded = encoded_etag(etag, self.encoding)
+            if encoded in (t.strip().removeprefix("W/") for t in self.if_none_match.split(",")):
+                headers["ETag"] = encoded
+
+    def _set_headers(self, headers: MutableHeaders):
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        # autre représentation → autre ETag forte (suffixe du codage)
+        etag = headers.get("etag")
+        if etag:
+            headers["ETag"] = encoded_etag(etag, self.encoding)
+
+    async def send_wrapper(self, message):
+        mtype = message["type"]
+        if mtype == "http.response.start":
+            self.start_message = message
+            return
+        if mtype != "http.response.body" or self.passthrough:
+            if self.start_message is not None:
+                await self.send(self.start_message)
+                self.start_message = None
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.start_message is not None:
+            start = self.start_message
+            self.start_message = None
+            headers = MutableHeaders(raw=start["headers"])
+            small = not more_body and len(body) < self.minimum_size
+            if small or start["status"] < 200 or not _compressible(headers):
+                if start["status"] == 304:
+                    self._not_modified_etag(headers)
+                self.passthrough = True
+                await self.send(start)
+                await self.send(message)
+                return
+            self.compressor = _compressor(self.encoding)
+            self._set_headers(headers)
+            if not more_body:
+                data = self.compressor.compress(body) + self.compressor.finish()
+                headers["Content-Length"] = str(len(data))
+                await self.send(start)
+                await self.send({"type": "http.response.body", "body": data})
+                return
+            # streaming : taille finale inconnue
+            if "content-length" in headers:
+                del headers["Content-Length"]
+            await self.send(start)
+
+        data = self.compressor.compress(body)
+        data += self.compressor.flush() if more_body else self.compressor.finish()
+        await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+
+class StaticPage:
+    """Page constante : encodée / compressée une fois, servie avec ETag + 304."""
+
+    def __init__(self, content: str, media_type: str = "text/html; charset=utf-8",
+                 max_age: int = STATIC_PAGE_MAX_AGE):
+        raw = content.encode("utf-8")
+        digest = hashlib.sha1(raw).hexdigest()[:16]
+        self.media_type = media_type
+        self.cache_control = f"public, max-age={max_age}"
+        self.bodies = {"identity": raw, "gzip": gzip.compress(raw, 9, mtime=0)}
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(raw, quality=11)
+        # une ETag forte par représentation, même contenu derrière
+        self.etags = {enc: f'"{digest}"' if enc == "identity" else f'"{digest}-{enc}"'
+                      for enc in self.bodies}
+
+    def _not_modified(self, if_none_match: Optional[str]) -> bool:
+        if not if_none_match:
+            return False
+        tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+        return "*" in tags or not tags.isdisjoint(self.etags.values())
+
+    def response(self, request: Request) -> Response:
+        available = tuple(enc for enc in ("br", "gzip") if enc in self.bodies)
+        encoding = negotiate(request.headers.get("accept-encoding"), available) or "identity"
+        headers = {
+            "ETag": self.etags[encoding],
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if self._not_modified(request.headers.get("if-none-match")):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(self.bodies[encoding], media_type=self.media_type, headers=headers)
@@ -9,6 +9,10 @@ from sqlalchemy.types import Float
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.dialects.postgresql import UUID
 
+from app.services import known_users
+from app.services import schema_registry
+from app.services.integrity import SIG_VERSION
+
 # -----------------------------------------------------------------------------
 # Config / Logs
 # -----------------------------------------------------------------------------
@@ -28,33 +32,6 @@ TTL_ACCIDENT_H   = int(os.getenv("TTL_ACCIDENT_H",   "3"))
 TTL_FIRE_H       = int(os.getenv("TTL_FIRE_H",       "4"))
 TTL_FLOOD_H      = int(os.getenv("TTL_FLOOD_H",     "24"))
 
-# -----------------------------------------------------------------------------
-# Introspection des types (pour gérer enums ou text dynamiquement)
-# -----------------------------------------------------------------------------
-async def get_column_typename(db: AsyncSession, table: str, column: str) -> str:
-    q = text("""
-        SELECT t.typname
-        FROM pg_attribute a
-        JOIN pg_class c ON a.attrelid = c.oid
-        JOIN pg_type  t ON a.atttypid = t.oid
-        JOIN pg_namespace n ON c.relnamespace = n.oid
-        WHERE n.nspname = 'public' AND c.relname = :table AND a.attname = :col
-    """)
-    r = await db.execute(q, {"table": table, "col": column})
-    return r.scalar_one()
-
-async def is_enum_typename(db: AsyncSession, typname: str) -> bool:
-    q = text("""
-        SELECT EXISTS (
-          SELECT 1
-          FROM pg_type t
-          JOIN pg_enum e ON e.enumtypid = t.oid
-          WHERE t.typname = :t
-        )
-    """)
-    r = await db.execute(q, {"t": typname})
-    return bool(r.scalar_one())
-
 # -----------------------------------------------------------------------------
 # Constantes
 # -----------------------------------------------------------------------------
@@ -75,55 +52,81 @@ async def insert_report(
     note: Optional[str] = None,
     photo_url: Optional[str] = None,
     user_id: Optional[str] = None,
+    device_id: Optional[str] = None,
+    idempotency_key: Optional[str] = None,
+    report_id: Optional[str] = None,
+    signature: Optional[str] = None,
+    log_event: Optional[str] = None,
 ) -> str:
     """
     Insère un report et déclenche les actions auto indispensables :
       - power/water + restored -> ferme la zone la plus proche (si dans le cône)
       - traffic/accident/fire/flood + cut -> upsert incident (fusion à 300 m)
       - traffic/accident/fire/flood + restored -> clear incident le plus proche (≤ 800 m)
-    """
 
-    # 0) S’assurer que la FK user existe si user_id fourni
-    if user_id:
-        try:
-            await db.execute(
-                text("INSERT INTO app_users (id) VALUES (CAST(:uid AS uuid)) ON CONFLICT (id) DO NOTHING"),
-                {"uid": user_id},
-            )
-            await db.commit()
-        except Exception:
-            await db.rollback()
-
-    # 1) Introspection (enum/text) pour kind/signal
-    kind_typ = await get_column_typename(db, "reports", "kind")
-    sig_typ  = await get_column_typename(db, "reports", "signal")
-    kind_is_enum = await is_enum_typename(db, kind_typ)
-    sig_is_enum  = await is_enum_typename(db, sig_typ)
-
-    kind_cast = kind_typ if kind_is_enum else "text"
-    sig_cast  = sig_typ  if sig_is_enum  else "text"
-
-    # 2) Insert
+    report_id (uuid pré-généré) + signature (report_hooks.report_signature) +
+    log_event ('created' → ligne report_events) : report signé et journalisé
+    dans la même requête que l'insert, un seul commit.
+    """
+    uid = str(user_id) if user_id else None
+
+    # 1) Types enum/text de kind/signal et colonnes optionnelles
+    #    (services/schema_registry.py, sans requête catalogue)
+    reg = await schema_registry.get(db)
+    kind_cast = reg.cast_type("reports", "kind")
+    sig_cast  = reg.cast_type("reports", "signal")
+    extra_cols = [c for c in ("device_id", "idempotency_key", "signature", "sig_version")
+                  if reg.has_column("reports", c)]
+    cols_sql = "".join(f", {c}" for c in extra_cols)
+    vals_sql = "".join(f", :{c}" for c in extra_cols)
+
+    # 2) Insert : user (si inconnu, services/known_users.py) + report + évènement, une requête
     insert_sql = text(f"""
-        INSERT INTO reports (kind, signal, geom, accuracy_m, note, photo_url, user_id)
-        VALUES (
-            CAST(:kind AS {kind_cast}),
-            CAST(:signal AS {sig_cast}),
-            ST_SetSRID(ST_MakePoint(:lng, :lat), 4326)::geography,
-            :accuracy_m, :note, :photo_url,
-            CAST(:user_id AS uuid)
+        WITH u AS (
+          INSERT INTO app_users (id)
+          SELECT CAST(:uid_new AS uuid) WHERE CAST(:uid_new AS uuid) IS NOT NULL
+          ON CONFLICT (id) DO NOTHING
+        ),
+        ins AS (
+          INSERT INTO reports (id, kind, signal, geom, accuracy_m, note, photo_url, user_id{cols_sql})
+          VALUES (
+              COALESCE(CAST(:report_id AS uuid), gen_random_uuid()),
+              CAST(:kind AS {kind_cast}),
+              CAST(:signal AS {sig_cast}),
+              ST_SetSRID(ST_MakePoint(:lng, :lat), 4326)::geography,
+              :accuracy_m, :note, :photo_url,
+              CAST(:user_id AS uuid){vals_sql}
+          )
+          RETURNING id
+        ),
+        ev AS (
+          INSERT INTO report_events (report_id, event)
+          SELECT id, CAST(:log_event AS text) FROM ins WHERE CAST(:log_event AS text) IS NOT NULL
         )
-        RETURNING id
+        SELECT id FROM ins
     """).bindparams(bindparam("user_id", type_=UUID(as_uuid=False)))
 
+    params = {
+        "kind": kind, "signal": signal, "lat": lat, "lng": lng,
+        "accuracy_m": accuracy_m, "note": note, "photo_url": photo_url,
+        "user_id": uid, "uid_new": None if known_users.is_known(uid) else uid,
+        "device_id": device_id, "idempotency_key": idempotency_key, "signature": signature,
+        "sig_version": SIG_VERSION if signature else None,
+        "report_id": report_id, "log_event": log_event,
+    }
     try:
-        res = await db.execute(insert_sql, {
-            "kind": kind, "signal": signal, "lat": lat, "lng": lng,
-            "accuracy_m": accuracy_m, "note": note, "photo_url": photo_url,
-            "user_id": user_id
-        })
+        try:
+            res = await db.execute(insert_sql, params)
+        except Exception as e:
+            if params["uid_new"] is not None or not known_users.is_missing_user(e):
+                raise
+            # id « connu » absent d'app_users (supprimé hors appli) : upsert cette fois
+            await db.rollback()
+            known_users.forget(uid)
+            res = await db.execute(insert_sql, {**params, "uid_new": uid})
         report_id = res.scalar_one()
         await db.commit()
+        known_users.add(uid)
         if LOG_AGG:
             print(f"[report] inserted id={report_id} kind={kind} signal={signal} lat={lat} lng={lng}")
     except Exception:
@@ -1,5 +1,8 @@
 # app/db.py
+import asyncio
 import os
+import time
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 
 DATABASE_URL = os.getenv("DATABASE_URL")  # ex: postgresql+psycopg://...:6543/postgres
@@ -22,3 +25,121 @@ SessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSe
 async def get_db():
     async with SessionLocal() as session:
         yield session
+
+
+# -----------------------------------------------------------------------------
+# Réplica en lecture (optionnel) : DATABASE_READ_URL
+#   - get_read_db : pour les routes en lecture seule (/map, exports, metrics…)
+#   - retard mesuré (mis en cache REPLICA_LAG_CHECK_S) ; au-delà de
+#     REPLICA_MAX_LAG_S, ou si le réplica ne répond pas → primaire
+#   - curseurs de /map?since= pris sur le réplica : son retard réel (au plus
+#     REPLICA_MAX_LAG_S + REPLICA_LAG_CHECK_S entre deux mesures) doit rester
+#     ≤ MAP_SYNC_OVERLAP_S, sinon la synchro delta perd des lignes → imposé
+#     ci-dessous (REPLICA_MAX_LAG_S réduit, ou erreur si impossible)
+# -----------------------------------------------------------------------------
+DATABASE_READ_URL   = (os.getenv("DATABASE_READ_URL") or "").strip() or None
+REPLICA_MAX_LAG_S   = float(os.getenv("REPLICA_MAX_LAG_S", "10"))
+REPLICA_LAG_CHECK_S = float(os.getenv("REPLICA_LAG_CHECK_S", "5"))
+
+from app.services.map_sync import MAP_SYNC_OVERLAP_S  # noqa: E402
+
+_replica_lag_budget = MAP_SYNC_OVERLAP_S - REPLICA_LAG_CHECK_S
+if DATABASE_READ_URL and _replica_lag_budget <= 0:
+    raise RuntimeError(
+        f"REPLICA_LAG_CHECK_S ({REPLICA_LAG_CHECK_S}) must be < MAP_SYNC_OVERLAP_S ({MAP_SYNC_OVERLAP_S})"
+    )
+if REPLICA_MAX_LAG_S > _replica_lag_budget:
+    if DATABASE_READ_URL:
+        print(f"[db] REPLICA_MAX_LAG_S {REPLICA_MAX_LAG_S} > MAP_SYNC_OVERLAP_S - REPLICA_LAG_CHECK_S "
+              f"→ clamped to {_replica_lag_budget}")
+    REPLICA_MAX_LAG_S = max(0.0, _replica_lag_budget)
+
+read_engine = (
+    create_async_engine(
+        DATABASE_READ_URL,
+        pool_size=5,
+        max_overflow=2,
+        pool_recycle=300,
+        pool_pre_ping=True,
+    )
+    if DATABASE_READ_URL else None
+)
+
+ReadSessionLocal = (
+    async_sessionmaker(read_engine, expire_on_commit=False, class_=AsyncSession)
+    if read_engine is not None else SessionLocal
+)
+
+_replica = {
+    "lag_s": None,          # dernier retard mesuré (s)
+    "checked_at": 0.0,      # time.monotonic() de la dernière mesure
+    "use_replica": False,
+    "error": None,
+    "reads_replica": 0,
+    "reads_primary": 0,
+    "fallbacks": 0,         # lectures renvoyées au primaire alors qu'un réplica est configuré
+}
+_replica_lock = asyncio.Lock()
+
+# retard = 0 si tout le WAL reçu est rejoué (un primaire sans écriture ne fait pas
+# « vieillir » pg_last_xact_replay_timestamp), sinon âge de la dernière transaction rejouée
+_LAG_SQL = text("""
+    SELECT CASE
+             WHEN NOT pg_is_in_recovery() THEN 0
+             WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+             ELSE COALESCE(EXTRACT(EPOCH FROM (now() - pg_last_xact_replay_timestamp())), 0)
+           END::float8
+""")
+
+
+async def _measure_replica_lag() -> None:
+    try:
+        async with read_engine.connect() as conn:
+            lag = float((await conn.execute(_LAG_SQL)).scalar() or 0.0)
+        _replica["lag_s"] = round(lag, 3)
+        _replica["error"] = None
+        _replica["use_replica"] = lag <= REPLICA_MAX_LAG_S
+    except Exception as e:
+        _replica["lag_s"] = None
+        _replica["error"] = f"{type(e).__name__}: {e}"
+        _replica["use_replica"] = False
+        print(f"[db] replica check failed → primary: {e}")
+    _replica["checked_at"] = time.monotonic()
+
+
+async def replica_usable() -> bool:
+    if read_engine is None:
+        return False
+    if time.monotonic() - _replica["checked_at"] >= REPLICA_LAG_CHECK_S:
+        async with _replica_lock:
+            if time.monotonic() - _replica["checked_at"] >= REPLICA_LAG_CHECK_S:
+                await _measure_replica_lag()
+    return _replica["use_replica"]
+
+
+async def read_sessionmaker():
+    """Fabrique de sessions à utiliser pour une lecture (réplica si à jour, sinon primaire)."""
+    if await replica_usable():
+        _replica["reads_replica"] += 1
+        return ReadSessionLocal
+    _replica["reads_primary"] += 1
+    if read_engine is not None:
+        _replica["fallbacks"] += 1
+    return SessionLocal
+
+
+async def get_read_db():
+    maker = await read_sessionmaker()
+    async with maker() as session:
+        yield session
+
+
+def replica_status() -> dict:
+    age = time.monotonic() - _replica["checked_at"] if _replica["checked_at"] else None
+    return {
+        "configured": read_engine is not None,
+        "max_lag_s": REPLICA_MAX_LAG_S,
+        "check_every_s": REPLICA_LAG_CHECK_S,
+        "checked_s_ago": round(age, 1) if age is not None else None,
+        **{k: v for k, v in _replica.items() if k != "checked_at"},
+    }
@@ -2,6 +2,7 @@
 import os
 import pathlib
 import hashlib
+from datetime import datetime
 from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
@@ -16,7 +17,18 @@ from apscheduler.triggers.interval import IntervalTrigger
 # Config & services internes
 from app.config import STATIC_DIR, STATIC_URL_PATH
 from app.db import get_db
-from app.services.aggregation import run_aggregation
+from app.migrate import MIGRATE_ON_STARTUP, run_migrations
+from app.services import spatial_index
+from app.services import report_queue
+from app.services import schema_registry
+from app.services import idempotency
+from app.services import known_users
+from app.services import verify
+from app.responses import FastJSONResponse
+from app.compression import CompressionMiddleware
+from app.services.aggregation import (
+    run_aggregation, run_auto_expire, auto_expire_enabled, AUTO_EXPIRE_INTERVAL_S,
+)
 
 # -----------------------------------------------------------------------------
 # Chargement .env en local (pas sur Render/Prod)
@@ -29,12 +41,45 @@ if os.getenv("RENDER") is None and os.getenv("ENV", "dev") == "dev":
 # -----------------------------------------------------------------------------
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Schéma : migrations versionnées avant tout (verrou advisory → 1 seul worker les applique)
+    if MIGRATE_ON_STARTUP:
+        try:
+            await run_migrations()
+        except Exception as e:
+            print(f"[migrate] startup migration failed: {e}")
+
+    # Types / colonnes du schéma, lus une fois (services/schema_registry.py)
+    try:
+        await schema_registry.start()
+    except Exception as e:
+        print(f"[schema] registry load failed: {e}")
+
+    # user_id déjà présents dans app_users → upsert sauté (services/known_users.py)
+    try:
+        await known_users.start()
+    except Exception as e:
+        print(f"[known-users] warm-up failed: {e}")
+
+    # Index spatial mémoire des évènements actifs (opt-in : SPATIAL_INDEX_ENABLED=1)
+    try:
+        await spatial_index.start()
+    except Exception as e:
+        print(f"[spatial-index] start failed: {e}")
+
+    # Workers de la file d'ingestion (REPORT_INGEST_MODE=queue)
+    try:
+        await report_queue.start()
+    except Exception as e:
+        print(f"[report-queue] start failed: {e}")
+
     enable = os.getenv("SCHEDULER_ENABLED", "1") != "0"
     scheduler = None
 
+    if enable or auto_expire_enabled():
+        scheduler = AsyncIOScheduler()
+
     if enable:
         interval = int(os.getenv("AGG_INTERVAL_MIN", "2"))
-        scheduler = AsyncIOScheduler()
 
         async def job():
             agen = get_db()
@@ -55,10 +100,64 @@ async def lifespan(app: FastAPI):
             id="ayii_agg",
             replace_existing=True,
         )
-        scheduler.start()
-        print(f"[scheduler] started (every {interval} min)")
+        print(f"[scheduler] aggregation every {interval} min")
     else:
-        print("[scheduler] disabled via SCHEDULER_ENABLED=0")
+        print("[scheduler] aggregation disabled via SCHEDULER_ENABLED=0")
+
+    # Auto-clôture (ex-/map) : job dédié, indépendant de SCHEDULER_ENABLED
+    if auto_expire_enabled():
+        async def expire_job():
+            agen = get_db()
+            db = await agen.__anext__()
+            try:
+                await run_auto_expire(db)
+            except Exception as e:
+                print(f"[scheduler] auto-expire error: {e}")
+            finally:
+                try:
+                    await agen.aclose()
+                except Exception:
+                    pass
+
+        scheduler.add_job(
+            expire_job,
+            trigger=IntervalTrigger(seconds=AUTO_EXPIRE_INTERVAL_S),
+            id="ayii_expire",
+            replace_existing=True,
+            next_run_time=datetime.now(),   # 1er passage dès le démarrage
+            coalesce=True,
+            max_instances=1,
+        )
+        print(f"[scheduler] auto-expire every {AUTO_EXPIRE_INTERVAL_S}s")
+
+    # Purge des clés d'idempotence expirées (IDEMPOTENCY_TTL_H)
+    if scheduler:
+        async def idem_purge_job():
+            agen = get_db()
+            db = await agen.__anext__()
+            try:
+                n = await idempotency.purge_expired(db)
+                if n:
+                    print(f"[idempotency] purged {n} keys")
+            except Exception as e:
+                print(f"[scheduler] idempotency purge error: {e}")
+            finally:
+                try:
+                    await agen.aclose()
+                except Exception:
+                    pass
+
+        scheduler.add_job(
+            idem_purge_job,
+            trigger=IntervalTrigger(seconds=idempotency.IDEMPOTENCY_PURGE_INTERVAL_S),
+            id="ayii_idem_purge",
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1,
+        )
+
+    if scheduler:
+        scheduler.start()
 
     app.state.scheduler = scheduler
     yield
@@ -66,11 +165,15 @@ async def lifespan(app: FastAPI):
     if scheduler and scheduler.running:
         scheduler.shutdown(wait=False)
         print("[scheduler] stopped")
+    await report_queue.stop()
+    await spatial_index.stop()
+    await verify.stop()
 
 # -----------------------------------------------------------------------------
 # App
 # -----------------------------------------------------------------------------
-app = FastAPI(title="Ayii API", lifespan=lifespan)
+# orjson pour toutes les réponses JSON (app/responses.py)
+app = FastAPI(title="Ayii API", lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # Debug token admin (masqué)
 tok = (os.getenv("ADMIN_TOKEN") or os.getenv("NEXT_PUBLIC_ADMIN_TOKEN") or "").strip()
@@ -99,10 +202,13 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Disposition"],
+    expose_headers=["Content-Disposition", "Server-Timing", "X-Map-Cache", "X-Map-Mode", "X-Tile-Cache", "ETag", "X-Map-Snapshot-At"],
     max_age=86400,
 )
 
+# gzip / brotli selon Accept-Encoding (JSON /map, exports CSV/GeoJSON, HTML…)
+app.add_middleware(CompressionMiddleware)
+
 from fastapi import Request, Response
 
 # Répondre aux préflights sur TOUTES les routes (parachute)
@@ -176,12 +282,13 @@ if os.getenv("ENV", "dev") == "dev":
         }
 
 # -----------------------------------------------------------------------------
-# no-store pour /map
+# no-store pour /map (sauf si la route pose elle-même son Cache-Control :
+# /map renvoie "no-cache" + ETag pour permettre les 304)
 # -----------------------------------------------------------------------------
 @app.middleware("http")
 async def no_store_cache(request: Request, call_next):
     response: Response = await call_next(request)
-    if request.url.path == "/map":
+    if request.url.path == "/map" and "cache-control" not in response.headers:
         response.headers["Cache-Control"] = "no-store"
     return response
 
@@ -221,6 +328,13 @@ from app.routes.help import router as help_router
 app.include_router(help_router)
 
 
+# Tuiles vectorielles /tiles/{z}/{x}/{y}.mvt (PostGIS ST_AsMVT)
+try:
+    from app.routes.tiles import router as tiles_router     # noqa: E402
+    app.include_router(tiles_router)
+except Exception as e:
+    print(f"[routes] tiles NOT mounted: {e}")
+
 # Metrics API
 try:
     from app.routes.metrics import router as metrics_router     # noqa: E402
@@ -228,6 +342,13 @@ try:
 except Exception as e:
     print(f"[routes] metrics NOT mounted: {e}")
 
+# Vérification des signatures (admin, services/verify.py)
+try:
+    from app.routes.integrity import router as integrity_router     # noqa: E402
+    app.include_router(integrity_router)
+except Exception as e:
+    print(f"[routes] integrity NOT mounted: {e}")
+
 # Dashboard Pro (metrics + tableau)
 try:
     from app.routes.dashboard_pro import router as dashboard_pro_router  # noqa: E402
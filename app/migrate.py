@@ -0,0 +1,189 @@
+# app/migrate.py
+"""
+Migrations SQL versionnées : db/migrations/NNNN_nom.sql
+
+- appliquées dans l'ordre, une transaction par fichier
+- suivi dans schema_migrations (version, nom, checksum, date)
+- verrou advisory de transaction (pg_advisory_xact_lock) pris dans la
+  transaction de chaque fichier : plusieurs workers / instances qui démarrent
+  en même temps n'appliquent chaque fichier qu'une fois. Libéré par le
+  COMMIT / ROLLBACK → sans fuite derrière pgBouncer en mode transaction
+  (un verrou de session pris puis relâché dans une autre transaction peut
+  l'être sur une autre connexion serveur et bloquer tous les démarrages)
+- MIGRATE_DATABASE_URL (optionnel) : URL directe, hors pooler, pour les
+  migrations ; sinon DATABASE_URL
+- driver psycopg obligatoire : un fichier = plusieurs instructions envoyées
+  sans paramètres (protocole simple) ; asyncpg (prepared statements) refuse
+- un fichier déjà appliqué ne doit plus être modifié (checksum → warning) :
+  on ajoute un nouveau fichier à la place
+
+Seul endroit où le schéma évolue : plus aucune DDL dans les routes
+ni dans le scheduler.
+
+Usage :
+    python -m app.migrate            # applique ce qui manque
+    python -m app.migrate --status   # liste appliquées / en attente
+Au démarrage de l'API si MIGRATE_ON_STARTUP=1 (défaut).
+"""
+import asyncio
+import hashlib
+import os
+import pathlib
+import re
+import sys
+from typing import List, Tuple
+
+from sqlalchemy import text
+
+MIGRATIONS_DIR = pathlib.Path(
+    os.getenv("MIGRATIONS_DIR")
+    or pathlib.Path(__file__).resolve().parent.parent / "db" / "migrations"
+)
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "1") != "0"
+MIGRATE_DATABASE_URL = (os.getenv("MIGRATE_DATABASE_URL") or "").strip() or None
+
+_LOCK_KEY = 0x41594949   # "AYII"
+_FILE_RE = re.compile(r"^(\d{4})_([a-z0-9_]+)\.sql$")
+
+
+def discover() -> List[Tuple[str, str, pathlib.Path]]:
+    """[(version, nom, chemin)] triés par version."""
+    out = []
+    for p in sorted(MIGRATIONS_DIR.glob("*.sql")):
+        m = _FILE_RE.match(p.name)
+        if not m:
+            print(f"[migrate] ignored (bad name): {p.name}")
+            continue
+        out.append((m.group(1), m.group(2), p))
+    versions = [v for v, _, _ in out]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"duplicate migration version in {MIGRATIONS_DIR}")
+    return out
+
+
+def _checksum(sql: str) -> str:
+    return hashlib.sha256(sql.encode("utf-8")).hexdigest()
+
+
+async def _ensure_table(conn) -> None:
+    await conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+          version    text PRIMARY KEY,
+          name       text NOT NULL,
+          checksum   text NOT NULL,
+          applied_at timestamptz NOT NULL DEFAULT now()
+        )
+    """))
+
+
+async def _applied(conn) -> dict:
+    rs = await conn.execute(text("SELECT version, checksum FROM schema_migrations"))
+    return {r.version: r.checksum for r in rs.fetchall()}
+
+
+def _check_driver(engine) -> None:
+    if engine.dialect.driver != "psycopg":
+        raise RuntimeError(
+            f"migrations need the psycopg driver (postgresql+psycopg://), got {engine.dialect.driver!r}: "
+            "multi-statement files are sent without parameters (simple protocol)"
+        )
+
+
+async def _lock(conn) -> None:
+    """Verrou de migration, relâché en fin de transaction."""
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": _LOCK_KEY})
+
+
+async def _with_engine(engine, fn):
+    """Appelle fn(engine) ; sans engine fourni : MIGRATE_DATABASE_URL, sinon app.db.engine."""
+    if engine is not None:
+        return await fn(engine)
+    if MIGRATE_DATABASE_URL:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        own = create_async_engine(MIGRATE_DATABASE_URL, pool_size=1, max_overflow=0)
+        try:
+            return await fn(own)
+        finally:
+            await own.dispose()
+    from app.db import engine as app_engine
+    return await fn(app_engine)
+
+
+async def run_migrations(engine=None) -> List[str]:
+    """Applique les migrations manquantes ; retourne les fichiers appliqués."""
+    return await _with_engine(engine, _run_migrations)
+
+
+async def _run_migrations(engine) -> List[str]:
+    _check_driver(engine)
+    done: List[str] = []
+    async with engine.connect() as conn:
+        async with conn.begin():
+            await _lock(conn)
+            await _ensure_table(conn)
+            applied = await _applied(conn)
+
+        for version, name, path in discover():
+            sql = path.read_text(encoding="utf-8")
+            cs = _checksum(sql)
+            if version in applied:
+                if applied[version] != cs:
+                    print(f"[migrate] ⚠️ {path.name} changed after being applied (checksum mismatch)")
+                continue
+            async with conn.begin():
+                await _lock(conn)
+                # relu sous verrou : un autre worker a pu l'appliquer entre-temps
+                if (await conn.execute(text("SELECT 1 FROM schema_migrations WHERE version = :v"),
+                                       {"v": version})).first():
+                    continue
+                # pas de paramètres → protocole simple, plusieurs instructions par fichier
+                await conn.exec_driver_sql(sql)
+                await conn.execute(
+                    text("INSERT INTO schema_migrations(version, name, checksum) VALUES (:v, :n, :c)"),
+                    {"v": version, "n": name, "c": cs},
+                )
+            print(f"[migrate] applied {path.name}")
+            done.append(path.name)
+    if not done:
+        print("[migrate] schema up to date")
+    return done
+
+
+async def migration_status(engine=None) -> List[dict]:
+    return await _with_engine(engine, _migration_status)
+
+
+async def _migration_status(engine) -> List[dict]:
+    async with engine.connect() as conn:
+        async with conn.begin():
+            await _lock(conn)
+            await _ensure_table(conn)
+            applied = await _applied(conn)
+    out = []
+    for version, name, path in discover():
+        cs = _checksum(path.read_text(encoding="utf-8"))
+        state = "pending"
+        if version in applied:
+            state = "applied" if applied[version] == cs else "changed"
+        out.append({"version": version, "name": name, "state": state})
+    return out
+
+
+async def _main(argv: List[str]) -> int:
+    from app.db import engine
+    try:
+        if "--status" in argv:
+            for m in await migration_status():
+                print(f"{m['version']}  {m['state']:<8} {m['name']}")
+        else:
+            await run_migrations()
+        return 0
+    except Exception as e:
+        print(f"[migrate] failed: {e}")
+        return 1
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
@@ -0,0 +1,67 @@
+# app/responses.py
+"""
+Sérialisation JSON rapide pour toute l'API.
+
+- FastJSONResponse : default_response_class de l'app (orjson s'il est
+  installé, sinon json stdlib) — datetime / date / UUID / Decimal gérés nativement
+- dumps() : même sortie en octets, pour les corps assemblés à la main
+  (snapshot /map, geojson_feature / geojson_collection des exports)
+
+Une route qui renvoie un dict passe toujours par jsonable_encoder (copie
+champ par champ) avant le rendu ; les routes chaudes renvoient donc
+directement FastJSONResponse(payload) pour l'éviter.
+
+Sortie identique à celle de Starlette (compacte, UTF-8 non échappé,
+datetime.isoformat()) : seul le coût change.
+"""
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any
+from uuid import UUID
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:     # repli : même format, plus lent
+    orjson = None
+
+
+def _default(o: Any):
+    # comme jsonable_encoder : Decimal entier → int, sinon float
+    if isinstance(o, Decimal):
+        return int(o) if o.as_tuple().exponent >= 0 else float(o)
+    if isinstance(o, (datetime, date, time)):
+        return o.isoformat()
+    if isinstance(o, UUID):
+        return str(o)
+    if isinstance(o, (set, frozenset)):
+        return list(o)
+    if hasattr(o, "model_dump"):
+        return o.model_dump(mode="json")
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+else:
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, default=_default, ensure_ascii=False,
+                          separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+# ---------- GeoJSON ----------
+def geojson_feature(geom_json: str, props: dict) -> bytes:
+    """Feature dont la géométrie est déjà sérialisée (ST_AsGeoJSON) : collée telle quelle."""
+    return b'{"type":"Feature","geometry":' + geom_json.encode("utf-8") + b',"properties":' + dumps(props) + b"}"
+
+
+def geojson_collection(features: list) -> bytes:
+    return b'{"type":"FeatureCollection","features":[' + b",".join(features) + b"]}"
@@ -11,6 +11,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 
 from app.db import get_db
+from app.services import schema_registry
 
 router = APIRouter(prefix="/cta", tags=["CTA"])
 
@@ -102,8 +103,10 @@ async def _supabase_sign_url_if_possible(url: Optional[str], expires_sec: int =
 # -------------------------
 DEFAULT_LIMIT = 50
 
-def _sql_incidents(filter_by_status: bool) -> str:
-    where_status = "AND r.status = :status" if filter_by_status else ""
+def _sql_incidents(filter_by_status: bool, has_status: bool = True) -> str:
+    # has_status : colonne reports.status présente (services/schema_registry.py)
+    where_status = "AND r.status = :status" if (filter_by_status and has_status) else ""
+    status_expr = "COALESCE(r.status,'new')" if has_status else "'new'"
     # NOTE: on cible uniquement les reports 'cut' comme événements d'ouverture
     #       Le statut (new/confirmed/resolved) vit dans reports.status
     return f"""
@@ -115,7 +118,7 @@ def _sql_incidents(filter_by_status: bool) -> str:
             ST_Y((r.geom::geometry)) AS lat,
             ST_X((r.geom::geometry)) AS lng,
             r.created_at,
-            COALESCE(r.status,'new') AS status
+            {status_expr} AS status
           FROM reports r
           WHERE LOWER(TRIM(r.signal::text)) = 'cut'
             {where_status}
@@ -150,21 +153,15 @@ async def list_incidents(
     limit: int = Query(DEFAULT_LIMIT, ge=1, le=500),
 ):
     params: Dict[str, Any] = {"limit": int(limit)}
-    rows = []
     try:
-        if status:
+        # sans colonne status : filtre ignoré (comme l'ancien repli), sans requête ratée
+        has_status = (await schema_registry.get(db)).has_column("reports", "status")
+        if status and has_status:
             params["status"] = status.strip().lower()
-            q = text(_sql_incidents(filter_by_status=True))
-        else:
-            q = text(_sql_incidents(filter_by_status=False))
+        q = text(_sql_incidents(filter_by_status=bool(status), has_status=has_status))
         rows = (await db.execute(q, params)).mappings().all()
     except Exception as e:
-        # fallback sans status si colonne absente
-        try:
-            q = text(_sql_incidents(filter_by_status=False))
-            rows = (await db.execute(q, {"limit": int(limit)})).mappings().all()
-        except Exception as e2:
-            raise HTTPException(status_code=500, detail=f"incidents query failed: {e2}")
+        raise HTTPException(status_code=500, detail=f"incidents query failed: {e}")
 
     now = datetime.now(timezone.utc)
     out: List[Dict[str, Any]] = []
@@ -199,13 +196,9 @@ async def mark_status(
     if new_status not in {"new", "confirmed", "resolved"}:
         raise HTTPException(status_code=400, detail="invalid status")
 
-    # S’assure que la colonne status existe
-    try:
-        await db.execute(text("ALTER TABLE reports ADD COLUMN IF NOT EXISTS status text"))
-        await db.commit()
-    except Exception:
-        await db.rollback()
-
+    # colonne reports.status : migration 0001_baseline
+    if not (await schema_registry.get(db)).has_column("reports", "status"):
+        raise HTTPException(status_code=409, detail="reports.status missing: run migrations")
     try:
         q = text("""
             UPDATE reports
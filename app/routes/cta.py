@@ -3,11 +3,16 @@ from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 import os
-from app.db import get_db
+from app.db import get_read_db
+from app.responses import FastJSONResponse
+from app.services import schema_registry
+from app.services import singleflight
 
 # Router CTA (prefix = /cta)
 router = APIRouter(prefix="/cta", tags=["CTA"])
 
+_sf_incidents = singleflight.group("cta_incidents")
+
 def _auth_admin(request: Request):
     admin_tok = (os.getenv("ADMIN_TOKEN") or "").strip()
     req_tok   = (request.headers.get("x-admin-token") or "").strip()
@@ -22,12 +27,16 @@ async def cta_incidents_v2(
     request: Request,
     status: str = Query("", description="new|confirmed|resolved"),
     limit: int = Query(20, ge=1, le=200),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     _auth_admin(request)
 
+    # colonnes optionnelles lues dans le registre (services/schema_registry.py)
+    reg = await schema_registry.get(db)
+    status_expr = "COALESCE(r.status,'new')" if reg.has_column("reports", "status") else "'new'"
+    phone_expr = "r.phone" if reg.has_column("reports", "phone") else "NULL::text"
     where_status = (
-        "AND COALESCE(r.status,'new') = :status"
+        f"AND {status_expr} = :status"
         if (status or "").strip().lower() in {"new", "confirmed", "resolved"}
         else ""
     )
@@ -40,8 +49,8 @@ async def cta_incidents_v2(
       ST_Y(r.geom::geometry) AS lat,
       ST_X(r.geom::geometry) AS lng,
       r.created_at,
-      COALESCE(r.status,'new') AS status,
-      r.phone,                       -- téléphone
+      {status_expr} AS status,
+      {phone_expr} AS phone,         -- téléphone
       (
         SELECT a.url
         FROM attachments a
@@ -61,25 +70,23 @@ async def cta_incidents_v2(
     if "status" in where_status:
         params["status"] = status.strip().lower()
 
-    res = await db.execute(text(sql), params)
-    rows = res.fetchall()
+    async def run():
+        res = await db.execute(text(sql), params)
+        # photo_url : URL Supabase (image/vidéo) ou null ; age_min : int (cast SQL)
+        return [
+            {
+                "id": m["id"], "kind": m["kind"], "signal": m["signal"],
+                "lat": m["lat"], "lng": m["lng"],
+                "created_at": m["created_at"], "status": m["status"],
+                "photo_url": m["photo_url"], "age_min": m["age_min"], "phone": m["phone"],
+            }
+            for m in res.mappings()
+        ]
 
-    items = []
-    for r in rows:
-        m = r._mapping
-        items.append({
-            "id": m["id"],
-            "kind": m["kind"],
-            "signal": m["signal"],
-            "lat": float(m["lat"]),
-            "lng": float(m["lng"]),
-            "created_at": m["created_at"],
-            "status": m["status"],
-            "photo_url": m["photo_url"],   # URL Supabase (image/vidéo) ou null
-            "age_min": int(m["age_min"]) if m["age_min"] is not None else None,
-            "phone": m.get("phone"),
-        })
-    return {"api_version": "v2-min", "items": items, "count": len(items)}
+    # tableau CTA rafraîchi par tous les opérateurs en même temps → une seule requête
+    items = await _sf_incidents.do((params.get("status"), params["lim"]), run)
+    # rendu direct (orjson) : pas de passage par jsonable_encoder
+    return FastJSONResponse({"api_version": "v2-min", "items": items, "count": len(items)})
 
 # -----------------------------
 # ALIAS /cta/incidents → même réponse que V2
@@ -89,7 +96,7 @@ async def cta_incidents(
     request: Request,
     status: str = Query("", description="new|confirmed|resolved"),
     limit: int = Query(20, ge=1, le=200),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     # On réutilise EXACTEMENT la V2
     return await cta_incidents_v2(request, status, limit, db)
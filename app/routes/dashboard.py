@@ -1,12 +1,12 @@
 # app/routes/dashboard.py
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from fastapi.responses import HTMLResponse
 
+from app.compression import StaticPage
+
 router = APIRouter()
 
-@router.get("/dashboard", response_class=HTMLResponse)
-async def dashboard_page():
-    return """
+DASHBOARD_HTML = """
 <!DOCTYPE html>
 <html lang="fr">
 <head>
@@ -347,3 +347,10 @@ async def dashboard_page():
 </body>
 </html>
 """
+
+_page = StaticPage(DASHBOARD_HTML)
+
+
+@router.get("/dashboard", response_class=HTMLResponse)
+async def dashboard_page(request: Request):
+    return _page.response(request)
@@ -1,13 +1,13 @@
 # app/routes/dashboard_pro.py
 from __future__ import annotations
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from fastapi.responses import HTMLResponse
 
+from app.compression import StaticPage
+
 router = APIRouter(tags=["DashboardPro"])
 
-@router.get("/dashboard/pro", response_class=HTMLResponse)
-async def dashboard_pro():
-    return """
+DASHBOARD_PRO_HTML = """
 <!doctype html>
 <html lang="fr">
 <head>
@@ -293,3 +293,10 @@ async def dashboard_pro():
 </body>
 </html>
 """
+
+_page = StaticPage(DASHBOARD_PRO_HTML)
+
+
+@router.get("/dashboard/pro", response_class=HTMLResponse)
+async def dashboard_pro(request: Request):
+    return _page.response(request)
@@ -1,12 +1,12 @@
 # app/routes/help.py
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from fastapi.responses import HTMLResponse
 
+from app.compression import StaticPage
+
 router = APIRouter(tags=["Help"])
 
-@router.get("/aide", response_class=HTMLResponse)
-async def aide():
-    return """
+AIDE_HTML = """
 <!doctype html>
 <html lang="fr">
 <head>
@@ -98,3 +98,10 @@ async def aide():
 </body>
 </html>
 """
+
+_page = StaticPage(AIDE_HTML)
+
+
+@router.get("/aide", response_class=HTMLResponse)
+async def aide(request: Request):
+    return _page.response(request)
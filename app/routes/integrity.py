@@ -0,0 +1,88 @@
+# app/routes/integrity.py
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import get_db
+from app.services import verify
+
+router = APIRouter(prefix="/admin/integrity", tags=["admin"])
+
+# --- auth admin simple (x-admin-token) ---
+def _admin_token() -> str:
+    return (os.getenv("ADMIN_TOKEN") or os.getenv("NEXT_PUBLIC_ADMIN_TOKEN") or "").strip()
+
+async def require_admin(request: Request) -> bool:
+    tok = _admin_token()
+    if not tok:
+        raise HTTPException(status_code=401, detail="admin token not configured")
+    hdr = (request.headers.get("x-admin-token") or "").strip()
+    if hdr != tok:
+        raise HTTPException(status_code=401, detail="invalid admin token")
+    return True
+
+
+class VerifyIn(BaseModel):
+    from_ts: Optional[datetime] = None
+    to_ts: Optional[datetime] = None
+    days: int = Field(default=30, ge=1, le=3650)   # plage si from_ts absent
+
+
+def _utc(ts: datetime) -> datetime:
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+@router.post("/runs", status_code=202)
+async def start_run(
+    p: VerifyIn,
+    ok: bool = Depends(require_admin),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Lance une vérification des signatures (services/verify.py) en tâche de fond.
+    Répond tout de suite avec l'id du passage ; suivi via GET /admin/integrity/runs/{id}.
+    """
+    to_ts = _utc(p.to_ts) if p.to_ts else datetime.now(timezone.utc)
+    from_ts = _utc(p.from_ts) if p.from_ts else to_ts - timedelta(days=p.days)
+    if from_ts >= to_ts:
+        raise HTTPException(status_code=400, detail="from_ts must be before to_ts")
+    run_id = await verify.start_job(db, from_ts, to_ts)
+    if run_id is None:
+        raise HTTPException(status_code=409, detail=f"verification already running: {verify.running_jobs()}")
+    return {"ok": True, "run_id": run_id, "from_ts": from_ts, "to_ts": to_ts}
+
+
+@router.get("/runs")
+async def list_runs(
+    ok: bool = Depends(require_admin),
+    db: AsyncSession = Depends(get_db),
+    limit: int = Query(20, ge=1, le=200),
+):
+    """Derniers passages (tous workers / CLI) + état du pool de ce worker."""
+    return {"runs": await verify.list_runs(db, limit), "pool": verify.verify_status()}
+
+
+@router.get("/runs/{run_id}")
+async def get_run(
+    run_id: int,
+    ok: bool = Depends(require_admin),
+    db: AsyncSession = Depends(get_db),
+    limit: int = Query(100, ge=0, le=5000),
+):
+    """Progression, débit (rows_per_s) et premiers écarts d'un passage."""
+    run = await verify.get_run(db, run_id, limit)
+    if run is None:
+        raise HTTPException(status_code=404, detail="run not found")
+    return run
+
+
+@router.post("/runs/{run_id}/cancel")
+async def cancel_run(run_id: int, ok: bool = Depends(require_admin)):
+    """Annule un passage lancé par ce worker (les autres workers ne le connaissent pas)."""
+    if not verify.cancel_job(run_id):
+        raise HTTPException(status_code=404, detail="run not running on this worker")
+    return {"ok": True, "run_id": run_id}
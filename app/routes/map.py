@@ -13,13 +13,44 @@ from sqlalchemy import text
 from typing import Optional, Any, List
 from uuid import UUID
 from datetime import datetime, timezone
-import os, uuid, mimetypes, io, csv, json, time
+import os, uuid, mimetypes, io, csv, json, time, asyncio
 
-from app.db import get_db
+from app.db import get_db, get_read_db, read_sessionmaker
 from app.config import BASE_PUBLIC_URL, STATIC_DIR, STATIC_URL_PATH  # constants only (no circular import)
+from app.migrate import run_migrations
+from app.services.event_counters import (
+    COUNTERS_MATCH_M, event_table, bump_attachments_count,
+)
+from app.services.map_sync import (
+    MAP_SYNC_OVERLAP_S, new_cursor, parse_cursor,
+    needs_full_sync, fetch_tombstones,
+)
+from app.services.area_versions import (
+    MAP_ETAG_ENABLED, map_etag, etag_matches,
+)
+from app.services.map_snapshot import MAP_SNAPSHOT_ENABLED, get_snapshot
+from app.services import spatial_index
+from app.services import singleflight
+from app.services.ingest import INGEST_BATCH_MAX, ingest_reports
+from app.services import report_queue
+from app.services import schema_registry
+from app.services import idempotency
+from app.services import known_users
+from app.services.integrity import SIG_VERSION
+from app.services.report_hooks import report_signature
+from app.responses import FastJSONResponse, geojson_collection, geojson_feature
+from app.services.map_cache import (
+    haversine_m,
+    MAP_CACHE_ENABLED, map_cache, map_cell, invalidate_point as map_cache_invalidate_point,
+    invalidate_all as map_cache_invalidate_all,
+)
 
 router = APIRouter()
 
+# requêtes identiques simultanées → une seule exécution (app/services/singleflight.py)
+_sf_map = singleflight.group("map")
+_sf_alert_zones = singleflight.group("alert_zones")
+
 # Si Python < 3.10, dé-commente la ligne suivante et remplace l’annotation de _signed_cache plus bas
 # from typing import Dict, Tuple
 
@@ -108,11 +139,11 @@ RESTORE_RADIUS_M     = int(os.getenv("RESTORE_RADIUS_M", "200"))
 CLEANUP_RADIUS_M     = int(os.getenv("CLEANUP_RADIUS_M", "80"))
 OWNERSHIP_RADIUS_M   = int(os.getenv("OWNERSHIP_RADIUS_M", "150"))
 OWNERSHIP_WINDOW_MIN = int(os.getenv("OWNERSHIP_WINDOW_MIN", "1440"))  # 24h
+REPORT_STATEMENT_TIMEOUT_MS = int(os.getenv("REPORT_STATEMENT_TIMEOUT_MS", "8000"))  # POST /report
 ADMIN_TOKEN          = (os.getenv("ADMIN_TOKEN") or os.getenv("NEXT_PUBLIC_ADMIN_TOKEN") or "").strip()
 
-# Pièces jointes + auto-expire
+# Pièces jointes (l'auto-expire vit dans app/services/aggregation.py)
 ATTACH_WINDOW_H      = int(os.getenv("ATTACH_WINDOW_H", "48"))  # photos visibles près d’un incident sur 48h
-AUTO_EXPIRE_H        = int(os.getenv("AUTO_EXPIRE_H", "6"))     # auto-clôture à 6h
 
 SUPABASE_URL         = (os.getenv("SUPABASE_URL") or "").rstrip("/")
 SUPABASE_KEY         = os.getenv("SUPABASE_SERVICE_ROLE", "")
@@ -123,6 +154,20 @@ ALERT_WINDOW_H   = int(os.getenv("ALERT_WINDOW_H", "3"))     # fenêtre de temps
 ALERT_THRESHOLD  = int(os.getenv("ALERT_THRESHOLD", "3"))    # nb min de signalements pour une zone
 RESPONDER_TOKEN  = (os.getenv("RESPONDER_TOKEN") or "").strip()  # jeton simple pour “pompiers”
 
+# /map "fast path" : 1 seule requête SQL qui construit tout le JSON
+MAP_FAST_PATH    = os.getenv("MAP_FAST_PATH", "0") != "0"
+# /map en parallèle : les 4 sous-requêtes sur des connexions séparées du pool
+# (pool_size=5 + max_overflow=2 → on plafonne à MAP_PARALLEL_MAX_CONN par requête,
+#  session de la requête comprise : elle rend sa connexion avant l'éventail)
+MAP_PARALLEL          = os.getenv("MAP_PARALLEL", "0") != "0"
+MAP_PARALLEL_MAX_CONN = max(1, int(os.getenv("MAP_PARALLEL_MAX_CONN", "2")))
+
+# /map/viewport : bbox + zoom, agrégation côté serveur par cellule de grille
+VIEWPORT_CLUSTER_PX   = int(os.getenv("VIEWPORT_CLUSTER_PX", "60"))     # taille d'une cellule à l'écran
+VIEWPORT_POINTS_ZOOM  = int(os.getenv("VIEWPORT_POINTS_ZOOM", "15"))    # ≥ ce zoom : points bruts
+VIEWPORT_MAX_ITEMS    = int(os.getenv("VIEWPORT_MAX_ITEMS", "2000"))    # cap par liste
+VIEWPORT_ZONES_MAX_KM = float(os.getenv("VIEWPORT_ZONES_MAX_KM", "50")) # zones d'alerte si bbox ≤ ce rayon
+
 ALLOWED_KINDS = {
     "traffic","accident","fire","flood","power","water",
     "assault","weapon","medical"  # nouveaux types incidents
@@ -142,6 +187,18 @@ def _check_admin_token(request: Request):
         if tok != ADMIN_TOKEN:
             raise HTTPException(status_code=401, detail="Invalid admin token")
 
+def _idem_replay(prev):
+    """Rejoue la réponse d'origine d'une clé d'idempotence (services/idempotency.py)."""
+    code, body = prev
+    if code is None:
+        raise HTTPException(status_code=409, detail="idempotency_key in progress",
+                            headers={"Retry-After": "2"})
+    if code >= 400:
+        raise HTTPException(status_code=code, detail=(body or {}).get("detail"))
+    if code != 200:
+        return FastJSONResponse(body, status_code=code)  # 202 d'une clé prise en mode file
+    return body
+
 def _now_isoz():
     return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
 
@@ -210,139 +267,145 @@ async def upload_video(
 
 
 
-    # idem key
+    # idem key : prise atomique, ou réponse d'origine (services/idempotency.py)
     idem = (idempotency_key or "").strip() or None
-    if idem:
-        rs = await db.execute(text("SELECT id, url FROM attachments WHERE idempotency_key = :k LIMIT 1"), {"k": idem})
-        row = rs.first()
-        if row:
-            return {
-                "ok": True,
-                "id": str(row.id),
-                "url": row.url,
-                "idempotency_key": idem,
-            }
+    prev = await idempotency.claim(db, idempotency.SCOPE_ATTACHMENT, idem)
+    if prev is not None:
+        return _idem_replay(prev)
 
-    # si pas admin → vérifier qu'il a bien déclaré à cet endroit récemment
-    if not is_admin:
-        if not user_id:
-            raise HTTPException(status_code=403, detail="not_owner")
-        chk = await db.execute(
-            text("""
-                WITH me AS (
-                    SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g
-                )
-                SELECT 1
-                  FROM reports
-                 WHERE user_id = :uid
-                   AND LOWER(TRIM(kind::text)) = :k
-                   AND LOWER(TRIM(signal::text)) = 'cut'
-                   AND created_at > NOW() - INTERVAL '48 hour'
-                   AND ST_DWithin(geom::geography, (SELECT g FROM me), 150)
-                 LIMIT 1
-            """),
-            {
-                "uid": str(user_id),
-                "k": K,
-                "lat": float(lat),
-                "lng": float(lng),
-            },
-        )
-        if chk.first() is None:
-            raise HTTPException(status_code=403, detail="not_owner")
-
-    # déterminer l'extension à partir du content-type
-    ctype = (file.content_type or "").lower().strip()
-    if ctype.startswith("video/webm"):
-        ext = ".webm"
-    elif ctype.startswith("video/3gpp") or ctype.startswith("video/3gp"):
-        ext = ".3gp"
-    else:
-        ext = ".mp4"  # défaut
+    try:
+        # si pas admin → vérifier qu'il a bien déclaré à cet endroit récemment
+        if not is_admin:
+            if not user_id:
+                raise HTTPException(status_code=403, detail="not_owner")
+            chk = await db.execute(
+                text("""
+                    WITH me AS (
+                        SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g
+                    )
+                    SELECT 1
+                      FROM reports
+                     WHERE user_id = :uid
+                       AND LOWER(TRIM(kind::text)) = :k
+                       AND LOWER(TRIM(signal::text)) = 'cut'
+                       AND created_at > NOW() - INTERVAL '48 hour'
+                       AND ST_DWithin(geom::geography, (SELECT g FROM me), 150)
+                     LIMIT 1
+                """),
+                {
+                    "uid": str(user_id),
+                    "k": K,
+                    "lat": float(lat),
+                    "lng": float(lng),
+                },
+            )
+            if chk.first() is None:
+                raise HTTPException(status_code=403, detail="not_owner")
 
-    filename_orig = file.filename or f"{K}_{uuid.uuid4().hex}{ext}"
-    if "." not in filename_orig:
-        filename_orig = filename_orig + ext
+        # déterminer l'extension à partir du content-type
+        ctype = (file.content_type or "").lower().strip()
+        if ctype.startswith("video/webm"):
+            ext = ".webm"
+        elif ctype.startswith("video/3gpp") or ctype.startswith("video/3gp"):
+            ext = ".3gp"
+        else:
+            ext = ".mp4"  # défaut
 
-    # chemin dans le bucket → IMPORTANT : on utilise K ici
-    path = f"{K}/{int(_time.time())}-{uuid.uuid4().hex}-{os.path.basename(filename_orig)}"
+        filename_orig = file.filename or f"{K}_{uuid.uuid4().hex}{ext}"
+        if "." not in filename_orig:
+            filename_orig = filename_orig + ext
 
-    # upload
-    url_public: Optional[str] = None
-    try:
-        bucket   = os.getenv("SUPABASE_BUCKET", "attachments")
-        supa_url = (os.getenv("SUPABASE_URL") or "").rstrip("/")
-        supa_key = os.getenv("SUPABASE_SERVICE_ROLE") or os.getenv("SUPABASE_SERVICE_KEY")
+        # chemin dans le bucket → IMPORTANT : on utilise K ici
+        path = f"{K}/{int(_time.time())}-{uuid.uuid4().hex}-{os.path.basename(filename_orig)}"
 
-        if supa_url and supa_key:
-            import httpx
-            upload_url = f"{supa_url}/storage/v1/object/{bucket}/{path}"
-            headers = {
-                "Authorization": f"Bearer {supa_key}",
-                "Content-Type": ctype or "video/mp4",
-                "x-upsert": "false",
-            }
-            async with httpx.AsyncClient(timeout=60) as client:
-                r = await client.post(upload_url, headers=headers, content=data)
-            if r.status_code not in (200, 201):
-                raise RuntimeError(f"supabase upload failed [{r.status_code}]: {r.text}")
-            url_public = f"{supa_url}/storage/v1/object/public/{bucket}/{path}"
-        else:
-            raise RuntimeError("supabase credentials missing")
-    except Exception:
-        # fallback disque
-        os.makedirs(STATIC_DIR, exist_ok=True)
-        disk_name = os.path.basename(path)
-        disk_path = os.path.join(STATIC_DIR, disk_name)
-        with open(disk_path, "wb") as fp:
-            fp.write(data)
-        base = (BASE_PUBLIC_URL or "").rstrip("/")
-        if base:
-            url_public = f"{base}{STATIC_URL_PATH}/{disk_name}"
-        else:
-            url_public = f"{STATIC_URL_PATH}/{disk_name}"
+        # upload
+        url_public: Optional[str] = None
+        try:
+            bucket   = os.getenv("SUPABASE_BUCKET", "attachments")
+            supa_url = (os.getenv("SUPABASE_URL") or "").rstrip("/")
+            supa_key = os.getenv("SUPABASE_SERVICE_ROLE") or os.getenv("SUPABASE_SERVICE_KEY")
+
+            if supa_url and supa_key:
+                import httpx
+                upload_url = f"{supa_url}/storage/v1/object/{bucket}/{path}"
+                headers = {
+                    "Authorization": f"Bearer {supa_key}",
+                    "Content-Type": ctype or "video/mp4",
+                    "x-upsert": "false",
+                }
+                async with httpx.AsyncClient(timeout=60) as client:
+                    r = await client.post(upload_url, headers=headers, content=data)
+                if r.status_code not in (200, 201):
+                    raise RuntimeError(f"supabase upload failed [{r.status_code}]: {r.text}")
+                url_public = f"{supa_url}/storage/v1/object/public/{bucket}/{path}"
+            else:
+                raise RuntimeError("supabase credentials missing")
+        except Exception:
+            # fallback disque
+            os.makedirs(STATIC_DIR, exist_ok=True)
+            disk_name = os.path.basename(path)
+            disk_path = os.path.join(STATIC_DIR, disk_name)
+            with open(disk_path, "wb") as fp:
+                fp.write(data)
+            base = (BASE_PUBLIC_URL or "").rstrip("/")
+            if base:
+                url_public = f"{base}{STATIC_URL_PATH}/{disk_name}"
+            else:
+                url_public = f"{STATIC_URL_PATH}/{disk_name}"
 
-    if not url_public:
-        raise HTTPException(status_code=500, detail="no_public_url")
+        if not url_public:
+            raise HTTPException(status_code=500, detail="no_public_url")
 
-    # insérer dans attachments
-    ins = text("""
-        INSERT INTO attachments (
-            kind, geom, user_id, url, idempotency_key, created_at, is_sensitive, uploader_id
-        )
-        VALUES (
-            :k,
-            ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography,
-            :uid,
-            :url,
-            :idem,
-            NOW(),
-            TRUE,
-            :uploader
+        # insérer dans attachments
+        ins = text("""
+            INSERT INTO attachments (
+                kind, geom, user_id, url, idempotency_key, created_at, is_sensitive, uploader_id
+            )
+            VALUES (
+                :k,
+                ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography,
+                :uid,
+                :url,
+                :idem,
+                NOW(),
+                TRUE,
+                :uploader
+            )
+            RETURNING id
+        """)
+        rs = await db.execute(
+            ins,
+            {
+                "k": K,
+                "lng": float(lng),
+                "lat": float(lat),
+                "uid": str(user_id) if user_id else None,
+                "url": url_public,
+                "idem": idem,
+                "uploader": str(user_id) if user_id else None,
+            },
         )
-        RETURNING id
-    """)
-    rs = await db.execute(
-        ins,
-        {
-            "k": K,
-            "lng": float(lng),
-            "lat": float(lat),
-            "uid": str(user_id) if user_id else None,
+        row = rs.first()
+        body = {
+            "ok": True,
+            "id": str(row.id),
             "url": url_public,
-            "idem": idem,
-            "uploader": str(user_id) if user_id else None,
-        },
-    )
-    row = rs.first()
-    await db.commit()
-
-    return {
-        "ok": True,
-        "id": str(row.id),
-        "url": url_public,
-        "idempotency_key": idem,
-    }
+            "idempotency_key": idem,
+        }
+        await idempotency.complete(db, idempotency.SCOPE_ATTACHMENT, idem, 200, body)   # commit
+        try:
+            await bump_attachments_count(db, K, float(lat), float(lng))
+            await db.commit()
+        except Exception as e:
+            await db.rollback()   # rattrapé au prochain tick d'agrégation
+            print(f"[upload] counters bump failed: {e}")
+        map_cache_invalidate_point(lat, lng)
+
+        return body
+    except BaseException:
+        # 403, stockage ou insert en échec : la clé redevient libre pour un retry
+        await idempotency.release(db, idempotency.SCOPE_ATTACHMENT, idem)
+        raise
 
 @router.post("/maintenance/purge_old_attachments")
 async def purge_old_attachments(
@@ -376,6 +439,7 @@ async def purge_old_attachments(
         text("DELETE FROM attachments WHERE created_at < NOW() - INTERVAL '49 days'")
     )
     await db.commit()
+    map_cache_invalidate_all()
 
     return {"ok": True, "deleted": len(rows)}
 
@@ -415,7 +479,16 @@ async def _upload_to_supabase(file_bytes: bytes, filename: str, content_type: st
     return f"{SUPA_URL}/storage/v1/object/public/{BUCKET}/{path}"
 
 # ---------- LECTURES (outages/incidents) ----------
+def _rows_as_dicts(res) -> list:
+    # les alias SQL sont déjà les clés du JSON, dans le même ordre :
+    # un dict par ligne, sans getattr/float champ par champ
+    return [dict(m) for m in res.mappings()]
+
+
 async def fetch_outages(db: AsyncSession, lat: float, lng: float, r_m: float):
+    # actifs depuis l'index mémoire s'il est à jour → SQL limité aux évènements clos
+    active = spatial_index.query_events("outages", lat, lng, r_m)
+    restored_sql = "AND o.restored_at IS NOT NULL" if active is not None else ""
     q_full = text(f"""
         WITH me AS (
           SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g
@@ -427,25 +500,11 @@ async def fetch_outages(db: AsyncSession, lat: float, lng: float, r_m: float):
                ST_X((o.center::geometry)) AS lng,
                o.started_at,
                o.restored_at,
-               COALESCE(att.cnt, 0)::int AS attachments_count,
-               COALESCE(rep.cnt, 0)::int AS reports_count
+               COALESCE(o.attachments_count, 0)::int AS attachments_count,
+               COALESCE(o.reports_count, 0)::int AS reports_count
         FROM outages o
-        LEFT JOIN LATERAL (
-          SELECT COUNT(*)::int AS cnt
-            FROM attachments a
-           WHERE a.kind::text = o.kind::text
-             AND a.created_at > NOW() - INTERVAL '48 hours'
-             AND ST_DWithin((a.geom::geography), (o.center::geography), 120)
-        ) att ON TRUE
-        LEFT JOIN LATERAL (
-          SELECT COUNT(*)::int AS cnt
-            FROM reports r
-           WHERE LOWER(TRIM(r.signal::text))='cut'
-             AND r.created_at > NOW() - INTERVAL '{POINTS_WINDOW_MIN} minutes'
-             AND r.kind::text = o.kind::text
-             AND ST_DWithin((r.geom::geography), (o.center::geography), 120)
-        ) rep ON TRUE
         WHERE ST_DWithin((o.center::geography), (SELECT g FROM me), :r)
+          {restored_sql}
         ORDER BY o.started_at DESC NULLS LAST, o.id DESC
     """)
     q_min = text(f"""
@@ -463,6 +522,7 @@ async def fetch_outages(db: AsyncSession, lat: float, lng: float, r_m: float):
                0::int AS reports_count
         FROM outages o
         WHERE ST_DWithin((o.center::geography), (SELECT g FROM me), :r)
+          {restored_sql}
         ORDER BY o.started_at DESC NULLS LAST, o.id DESC
     """)
     try:
@@ -470,19 +530,13 @@ async def fetch_outages(db: AsyncSession, lat: float, lng: float, r_m: float):
     except Exception:
         await db.rollback()
         res = await db.execute(q_min, {"lng": lng, "lat": lat, "r": r_m})
-    rows = res.fetchall()
-    return [
-        {
-            "id": r.id, "kind": r.kind, "status": r.status,
-            "lat": float(r.lat), "lng": float(r.lng),
-            "started_at": getattr(r, "started_at", None),
-            "restored_at": getattr(r, "restored_at", None),
-            "attachments_count": getattr(r, "attachments_count", 0),
-            "reports_count": getattr(r, "reports_count", 0),
-        } for r in rows
-    ]
+    out = _rows_as_dicts(res)
+    return out if active is None else spatial_index.merge_events(active, out)
 
 async def fetch_incidents(db: AsyncSession, lat: float, lng: float, r_m: float):
+    # actifs depuis l'index mémoire s'il est à jour → SQL limité aux évènements clos
+    active = spatial_index.query_events("incidents", lat, lng, r_m)
+    restored_sql = "AND i.restored_at IS NOT NULL" if active is not None else ""
     q_full = text(f"""
         WITH me AS (
           SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g
@@ -494,28 +548,14 @@ async def fetch_incidents(db: AsyncSession, lat: float, lng: float, r_m: float):
                ST_X((i.center::geometry)) AS lng,
                i.started_at,
                i.restored_at,
-               COALESCE(att.cnt, 0)::int AS attachments_count,
-               COALESCE(rep.cnt, 0)::int AS reports_count
+               COALESCE(i.attachments_count, 0)::int AS attachments_count,
+               COALESCE(i.reports_count, 0)::int AS reports_count
         FROM incidents i
-        LEFT JOIN LATERAL (
-          SELECT COUNT(*)::int AS cnt
-            FROM attachments a
-           WHERE a.kind::text = i.kind::text
-             AND a.created_at > NOW() - INTERVAL '48 hours'
-             AND ST_DWithin((a.geom::geography), (i.center::geography), 120)
-        ) att ON TRUE
-        LEFT JOIN LATERAL (
-          SELECT COUNT(*)::int AS cnt
-            FROM reports r
-           WHERE LOWER(TRIM(r.signal::text))='cut'
-             AND r.created_at > NOW() - INTERVAL '{POINTS_WINDOW_MIN} minutes'
-             AND r.kind::text = i.kind::text
-             AND ST_DWithin((r.geom::geography), (i.center::geography), 120)
-        ) rep ON TRUE
         WHERE ST_DWithin((i.center::geography), (SELECT g FROM me), :r)
+          {restored_sql}
         ORDER BY i.started_at DESC NULLS LAST, i.id DESC
     """)
-    q_min = text("""
+    q_min = text(f"""
         WITH me AS (
           SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g
         )
@@ -530,6 +570,7 @@ async def fetch_incidents(db: AsyncSession, lat: float, lng: float, r_m: float):
                0::int AS reports_count
         FROM incidents i
         WHERE ST_DWithin((i.center::geography), (SELECT g FROM me), :r)
+          {restored_sql}
         ORDER BY i.started_at DESC NULLS LAST, i.id DESC
     """)
     try:
@@ -537,21 +578,15 @@ async def fetch_incidents(db: AsyncSession, lat: float, lng: float, r_m: float):
     except Exception:
         await db.rollback()
         res = await db.execute(q_min, {"lng": lng, "lat": lat, "r": r_m})
-    rows = res.fetchall()
-    return [
-        {
-            "id": r.id, "kind": r.kind, "status": r.status,
-            "lat": float(r.lat), "lng": float(r.lng),
-            "started_at": getattr(r, "started_at", None),
-            "restored_at": getattr(r, "restored_at", None),
-            "attachments_count": getattr(r, "attachments_count", 0),
-            "reports_count": getattr(r, "reports_count", 0),
-        } for r in rows
-    ]
+    out = _rows_as_dicts(res)
+    return out if active is None else spatial_index.merge_events(active, out)
 
 # ---------- LECTURES GLOBAL (show_all) ----------
 async def fetch_outages_all(db: AsyncSession, limit: int = 2000):
-    q = text(f"""
+    items = spatial_index.active_events("outages", limit)
+    if items is not None:
+        return items
+    q = text("""
         SELECT o.id,
                o.kind::text AS kind,
                CASE WHEN o.restored_at IS NULL THEN 'active' ELSE 'restored' END AS status,
@@ -559,43 +594,21 @@ async def fetch_outages_all(db: AsyncSession, limit: int = 2000):
                ST_X((o.center::geometry)) AS lng,
                o.started_at,
                o.restored_at,
-               COALESCE(att.cnt, 0)::int AS attachments_count,
-               COALESCE(rep.cnt, 0)::int AS reports_count
+               COALESCE(o.attachments_count, 0)::int AS attachments_count,
+               COALESCE(o.reports_count, 0)::int AS reports_count
         FROM outages o
-        LEFT JOIN LATERAL (
-          SELECT COUNT(*)::int AS cnt
-            FROM attachments a
-           WHERE a.kind::text = o.kind::text
-             AND a.created_at > NOW() - INTERVAL '48 hours'
-             AND ST_DWithin((a.geom::geography), (o.center::geography), 120)
-        ) att ON TRUE
-        LEFT JOIN LATERAL (
-          SELECT COUNT(*)::int AS cnt
-            FROM reports r
-           WHERE LOWER(TRIM(r.signal::text))='cut'
-             AND r.created_at > NOW() - INTERVAL '{POINTS_WINDOW_MIN} minutes'
-             AND r.kind::text = o.kind::text
-             AND ST_DWithin((r.geom::geography), (o.center::geography), 120)
-        ) rep ON TRUE
         WHERE o.restored_at IS NULL
         ORDER BY o.started_at DESC NULLS LAST, o.id DESC
         LIMIT :lim
     """)
     res = await db.execute(q, {"lim": limit})
-    rows = res.fetchall()
-    return [
-        {
-            "id": r.id, "kind": r.kind, "status": r.status,
-            "lat": float(r.lat), "lng": float(r.lng),
-            "started_at": getattr(r, "started_at", None),
-            "restored_at": getattr(r, "restored_at", None),
-            "attachments_count": getattr(r, "attachments_count", 0),
-            "reports_count": getattr(r, "reports_count", 0),
-        } for r in rows
-    ]
+    return _rows_as_dicts(res)
 
 async def fetch_incidents_all(db: AsyncSession, limit: int = 2000):
-    q = text(f"""
+    items = spatial_index.active_events("incidents", limit)
+    if items is not None:
+        return items
+    q = text("""
         SELECT i.id,
                i.kind::text AS kind,
                CASE WHEN i.restored_at IS NULL THEN 'active' ELSE 'restored' END AS status,
@@ -603,40 +616,15 @@ async def fetch_incidents_all(db: AsyncSession, limit: int = 2000):
                ST_X((i.center::geometry)) AS lng,
                i.started_at,
                i.restored_at,
-               COALESCE(att.cnt, 0)::int AS attachments_count,
-               COALESCE(rep.cnt, 0)::int AS reports_count
+               COALESCE(i.attachments_count, 0)::int AS attachments_count,
+               COALESCE(i.reports_count, 0)::int AS reports_count
         FROM incidents i
-        LEFT JOIN LATERAL (
-          SELECT COUNT(*)::int AS cnt
-            FROM attachments a
-           WHERE a.kind::text = i.kind::text
-             AND a.created_at > NOW() - INTERVAL '48 hours'
-             AND ST_DWithin((a.geom::geography), (i.center::geography), 120)
-        ) att ON TRUE
-        LEFT JOIN LATERAL (
-          SELECT COUNT(*)::int AS cnt
-            FROM reports r
-           WHERE LOWER(TRIM(r.signal::text))='cut'
-             AND r.created_at > NOW() - INTERVAL '{POINTS_WINDOW_MIN} minutes'
-             AND r.kind::text = i.kind::text
-             AND ST_DWithin((r.geom::geography), (i.center::geography), 120)
-        ) rep ON TRUE
         WHERE i.restored_at IS NULL
         ORDER BY i.started_at DESC NULLS LAST, i.id DESC
         LIMIT :lim
     """)
     res = await db.execute(q, {"lim": limit})
-    rows = res.fetchall()
-    return [
-        {
-            "id": r.id, "kind": r.kind, "status": r.status,
-            "lat": float(r.lat), "lng": float(r.lng),
-            "started_at": getattr(r, "started_at", None),
-            "restored_at": getattr(r, "restored_at", None),
-            "attachments_count": getattr(r, "attachments_count", 0),
-            "reports_count": getattr(r, "reports_count", 0),
-        } for r in rows
-    ]
+    return _rows_as_dicts(res)
 
 # --- Helper pour /map : zones d’alerte via cluster DBSCAN ---
 
@@ -651,6 +639,20 @@ async def fetch_alert_zones(db: AsyncSession, lat: float, lng: float, r_m: float
     group_radius_m = float(ALERT_RADIUS_M)
     threshold = int(ALERT_THRESHOLD)
 
+    # acks : filtrés en mémoire si l'index spatial est à jour, sinon NOT EXISTS en SQL
+    acks_in_memory = spatial_index.usable()
+    ack_sql = "" if acks_in_memory else """
+        WHERE NOT EXISTS (
+          SELECT 1
+          FROM acks ak
+          WHERE ak.kind = z.kind
+            AND ST_DWithin(
+              (ST_SetSRID(ST_MakePoint(z.lng, z.lat),4326)::geography),
+              ak.geom,
+              :ack_r
+            )
+        )"""
+
     sql = text(f"""
         WITH me AS (
           SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g
@@ -694,17 +696,7 @@ async def fetch_alert_zones(db: AsyncSession, lat: float, lng: float, r_m: float
           WHERE a.n >= :threshold
         )
         SELECT z.kind, z.n, z.lat, z.lng
-        FROM zones z
-        WHERE NOT EXISTS (
-          SELECT 1
-          FROM acks ak
-          WHERE ak.kind = z.kind
-            AND ST_DWithin(
-              (ST_SetSRID(ST_MakePoint(z.lng, z.lat),4326)::geography),
-              ak.geom,
-              :ack_r
-            )
-        )
+        FROM zones z{ack_sql}
         ORDER BY z.kind, z.n DESC
     """)
 
@@ -725,6 +717,10 @@ async def fetch_alert_zones(db: AsyncSession, lat: float, lng: float, r_m: float
         print(f"⚠️ fetch_alert_zones SQL error: {e}")
         return []
 
+    if acks_in_memory:
+        rows = [r for r in rows
+                if not spatial_index.acked_near(r.kind, float(r.lat), float(r.lng), group_radius_m)]
+
     return [
         {"kind": r.kind, "count": int(r.n), "lat": float(r.lat), "lng": float(r.lng)}
         for r in rows
@@ -732,117 +728,727 @@ async def fetch_alert_zones(db: AsyncSession, lat: float, lng: float, r_m: float
 
 
 
+# ---------- /map fast path : JSON construit par Postgres ----------
+# Postgres produit directement les octets JSON, au format exact de FastAPI
+# (json.dumps compact, ensure_ascii=False, datetime.isoformat()) :
+# on concatène des to_json() plutôt que json_build_object/json_agg,
+# qui insèrent des espaces (" : ", ", ").
+def _sql_j(expr: str, typ: str = "val") -> str:
+    """Valeur JSON (texte) d'une expression SQL ; NULL → null."""
+    if typ == "ts":
+        # Postgres tronque les zéros de fin des microsecondes ('.58703'), Python non ('.587030')
+        j = f"(to_json({expr}) #>> '{{}}')"
+        iso = (f"(CASE WHEN {j} ~ '\\.[0-9]' "
+               f"THEN regexp_replace({j}, '\\.[0-9]+', '.' || rpad(substring({j} from '\\.([0-9]+)'), 6, '0')) "
+               f"ELSE {j} END)")
+        return f"COALESCE(to_json({iso})::text, 'null')"
+    if typ == "float":
+        # float Python : 6.0 et non 6
+        t = f"(to_json(({expr})::float8)::text)"
+        return f"COALESCE(CASE WHEN {t} ~ '^-?[0-9]+$' THEN {t} || '.0' ELSE {t} END, 'null')"
+    return f"COALESCE(to_json({expr})::text, 'null')"
+
+
+def _sql_obj(fields) -> str:
+    """fields = [(clé, expr, typ)] → expression SQL texte '{"clé":valeur,...}' (ordre conservé)."""
+    parts = []
+    for n, (key, expr, typ) in enumerate(fields):
+        sep = "{" if n == 0 else ","
+        parts.append(f"'{sep}\"{key}\":' || {_sql_j(expr, typ)}")
+    return " || ".join(parts) + " || '}'"
+
+
+def _sql_arr(obj_sql: str, from_sql: str, order_sql: str) -> str:
+    return f"(SELECT '[' || COALESCE(string_agg({obj_sql}, ',' ORDER BY {order_sql}), '') || ']' FROM {from_sql})"
+
+
+_EVENT_FIELDS = [
+    ("id", "e.id", "val"), ("kind", "e.kind", "val"), ("status", "e.status", "val"),
+    ("lat", "e.lat", "float"), ("lng", "e.lng", "float"),
+    ("started_at", "e.started_at", "ts"), ("restored_at", "e.restored_at", "ts"),
+    ("attachments_count", "e.attachments_count", "val"), ("reports_count", "e.reports_count", "val"),
+]
+_ZONE_FIELDS = [
+    ("kind", "z.kind", "val"), ("count", "z.n", "val"), ("lat", "z.lat", "float"), ("lng", "z.lng", "float"),
+]
+_LAST_REPORT_FIELDS = [
+    ("id", "lr.id", "val"), ("kind", "lr.kind", "val"), ("signal", "lr.signal", "val"),
+    ("lat", "lr.lat", "float"), ("lng", "lr.lng", "float"), ("user_id", "lr.user_id", "val"),
+    ("created_at", "lr.created_at", "ts"), ("phone", "lr.phone", "val"),
+]
+
+
+def _sql_events_json(table: str, alias: str, where: str, limit_sql: str = "") -> str:
+    """
+    Tableau JSON d'événements (outages|incidents) : mêmes colonnes / même tri
+    que fetch_outages & co.
+    """
+    a = alias
+    sub = f"""(
+              SELECT {a}.id,
+                     {a}.kind::text AS kind,
+                     CASE WHEN {a}.restored_at IS NULL THEN 'active' ELSE 'restored' END AS status,
+                     ST_Y(({a}.center::geometry)) AS lat,
+                     ST_X(({a}.center::geometry)) AS lng,
+                     {a}.started_at,
+                     {a}.restored_at,
+                     COALESCE({a}.attachments_count, 0)::int AS attachments_count,
+                     COALESCE({a}.reports_count, 0)::int AS reports_count
+                FROM {table} {a}
+               WHERE {where}
+               ORDER BY {a}.started_at DESC NULLS LAST, {a}.id DESC
+               {limit_sql}
+            ) e"""
+    return _sql_arr(_sql_obj(_EVENT_FIELDS), sub, "e.started_at DESC NULLS LAST, e.id DESC")
+
+
+async def fetch_map_payload_json(
+    db: AsyncSession, lat: float, lng: float, r_m: float, show_all: bool = False
+) -> bytes:
+    """
+    Un seul aller-retour : Postgres renvoie le JSON complet de /map
+    (outages, incidents, alert_zones, last_reports), renvoyé tel quel au client.
+    server_now est ajouté côté Python (cf. _with_server_now) pour rester frais
+    même quand la réponse sort du cache.
+    """
+    if show_all:
+        sql = text(f"""
+            SELECT '{{"outages":'    || {_sql_events_json("outages", "o", "o.restored_at IS NULL", "LIMIT 2000")}
+                || ',"incidents":'   || {_sql_events_json("incidents", "i", "i.restored_at IS NULL", "LIMIT 2000")}
+                || ',"alert_zones":[],"last_reports":[]}}' AS payload
+        """)
+        params = {}
+    else:
+        window_min = int(ALERT_WINDOW_H) * 60
+        sql = text(f"""
+            WITH me AS (
+              SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g
+            ),
+            pts AS (
+              SELECT kind::text AS kind,
+                     ST_SnapToGrid(ST_Transform((geom::geometry),3857), 1.0) AS g3857,
+                     (geom::geometry) AS g4326
+                FROM reports
+               WHERE created_at > NOW() - INTERVAL '{window_min} minutes'
+                 AND LOWER(TRIM(signal::text))='cut'
+                 AND ST_DWithin((geom::geography), (SELECT g FROM me), :r)
+                 AND kind IN ('traffic','accident','fire','flood','power','water','assault','weapon','medical')
+            ),
+            clus AS (
+              SELECT kind, ST_ClusterDBSCAN(g3857, eps := :eps, minpoints := 2) OVER () AS cid, g4326
+                FROM pts
+            ),
+            agg AS (
+              SELECT kind, cid, COUNT(*)::int AS n,
+                     ST_Transform(ST_Centroid(ST_Collect(g4326)), 4326) AS center4326
+                FROM clus
+               WHERE cid IS NOT NULL
+               GROUP BY kind, cid
+            ),
+            zones AS (
+              SELECT a.kind, a.n, ST_Y(a.center4326) AS lat, ST_X(a.center4326) AS lng
+                FROM agg a
+               WHERE a.n >= :threshold
+            ),
+            z AS (
+              SELECT z.kind, z.n, z.lat, z.lng
+                FROM zones z
+               WHERE NOT EXISTS (
+                 SELECT 1 FROM acks ak
+                  WHERE ak.kind = z.kind
+                    AND ST_DWithin((ST_SetSRID(ST_MakePoint(z.lng, z.lat),4326)::geography), ak.geom, :ack_r)
+               )
+            ),
+            lr AS (
+              SELECT id, kind::text AS kind, signal::text AS signal,
+                     ST_Y((geom::geometry)) AS lat, ST_X((geom::geometry)) AS lng,
+                     user_id, created_at, phone
+                FROM reports
+               WHERE ST_DWithin((geom::geography), (SELECT g FROM me), :r)
+                 AND LOWER(TRIM(signal::text)) = 'cut'
+                 AND created_at > NOW() - INTERVAL '{POINTS_WINDOW_MIN} minutes'
+               ORDER BY created_at DESC
+               LIMIT :max
+            )
+            SELECT '{{"outages":'     || {_sql_events_json("outages", "o", "ST_DWithin((o.center::geography), (SELECT g FROM me), :r)")}
+                || ',"incidents":'    || {_sql_events_json("incidents", "i", "ST_DWithin((i.center::geography), (SELECT g FROM me), :r)")}
+                || ',"alert_zones":'  || {_sql_arr(_sql_obj(_ZONE_FIELDS), "z", "z.kind, z.n DESC")}
+                || ',"last_reports":' || {_sql_arr(_sql_obj(_LAST_REPORT_FIELDS), "lr", "lr.created_at DESC")}
+                || '}}' AS payload
+        """)
+        params = {
+            "lat": float(lat), "lng": float(lng), "r": float(r_m), "max": MAX_REPORTS,
+            "eps": float(ALERT_RADIUS_M), "threshold": int(ALERT_THRESHOLD),
+            "ack_r": float(ALERT_RADIUS_M),
+        }
+
+    res = await db.execute(sql, params)
+    return res.scalar_one().encode("utf-8")
+
+
+def _with_server_now(body: bytes, now_iso: str) -> bytes:
+    """Ajoute "server_now" en dernière clé de l'objet JSON produit par Postgres."""
+    return body[:-1] + b',"server_now":' + json.dumps(now_iso).encode("utf-8") + b"}"
+
+
 # ---------- ENDPOINT /map ----------
+async def _begin_read_only(db: AsyncSession):
+    """Ouvre la transaction en READ ONLY (compatible réplica / hot standby)."""
+    try:
+        await db.execute(text("SET TRANSACTION READ ONLY"))
+    except Exception:
+        await db.rollback()
+
+
+async def fetch_last_reports(db: AsyncSession, lat: float, lng: float, r_m: float):
+    """Derniers reports 'cut' (badges / pins)."""
+    q_rep = text(f"""
+        WITH me AS (
+          SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g
+        )
+        SELECT id,
+               kind::text   AS kind,
+               signal::text AS signal,
+               ST_Y((geom::geometry)) AS lat,
+               ST_X((geom::geometry)) AS lng,
+               user_id,
+               created_at,
+               phone                    -- 👈 on l’ajoute ici
+          FROM reports
+         WHERE ST_DWithin((geom::geography), (SELECT g FROM me), :r)
+           AND LOWER(TRIM(signal::text)) = 'cut'
+           AND created_at > NOW() - INTERVAL '{POINTS_WINDOW_MIN} minutes'
+         ORDER BY created_at DESC
+         LIMIT :max
+    """)
+    res_rep = await db.execute(q_rep, {"lng": lng, "lat": lat, "r": r_m, "max": MAX_REPORTS})
+    return _rows_as_dicts(res_rep)
+
+
+async def _timed(timings: dict, name: str, fn, *args):
+    t0 = time.perf_counter()
+    try:
+        return await fn(*args)
+    finally:
+        timings[name] = (time.perf_counter() - t0) * 1000.0
+
+
+async def _fetch_local_parallel(lat: float, lng: float, r_m: float, timings: dict):
+    """
+    Les 4 lectures de /map en même temps, chacune sur sa propre session/connexion
+    (réplica ou primaire), au plus MAP_PARALLEL_MAX_CONN connexions pour cette requête.
+    L'appelant doit avoir rendu la connexion de sa propre session (voir _build_map_payload).
+    """
+    sem = asyncio.Semaphore(MAP_PARALLEL_MAX_CONN)
+    maker = await read_sessionmaker()   # réplica si à jour (app/db.py)
+
+    async def run(name, fn):
+        async with sem:
+            async with maker() as s:
+                await _begin_read_only(s)
+                return await _timed(timings, name, fn, s, lat, lng, r_m)
+
+    return await asyncio.gather(
+        run("outages", fetch_outages),
+        run("incidents", fetch_incidents),
+        run("alert_zones", fetch_alert_zones),
+        run("last_reports", fetch_last_reports),
+    )
+
+
+async def _build_map_payload(
+    db: AsyncSession, lat: float, lng: float, radius_km: float, show_all: bool,
+    timings: Optional[dict] = None, read_only_started: bool = False,
+):
+    def nowz():
+        return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+    timings = {} if timings is None else timings
+
+    # 👉 Mode GLOBAL: on peut alléger (pas de last_reports ni alert_zones)
+    if show_all:
+        if not read_only_started:
+            await _begin_read_only(db)
+        outages   = await _timed(timings, "outages", fetch_outages_all, db, 2000)
+        incidents = await _timed(timings, "incidents", fetch_incidents_all, db, 2000)
+        return {
+            "outages": outages,
+            "incidents": incidents,
+            "alert_zones": [],     # allégé en global
+            "last_reports": [],
+            "server_now": nowz(),
+        }
+
+    # --- mode LOCAL (comportement historique) ---
+    r_m = float(radius_km * 1000.0)
+
+    if MAP_PARALLEL:
+        # ETag / curseur déjà lus : la session de la requête rend sa connexion au
+        # pool, sinon elle s'ajoute aux MAP_PARALLEL_MAX_CONN de l'éventail
+        await db.rollback()
+        outages, incidents, alert_zones, last_reports = await _fetch_local_parallel(lat, lng, r_m, timings)
+    else:
+        if not read_only_started:
+            await _begin_read_only(db)
+        outages      = await _timed(timings, "outages", fetch_outages, db, lat, lng, r_m)
+        incidents    = await _timed(timings, "incidents", fetch_incidents, db, lat, lng, r_m)
+        alert_zones  = await _timed(timings, "alert_zones", fetch_alert_zones, db, lat, lng, r_m)
+        last_reports = await _timed(timings, "last_reports", fetch_last_reports, db, lat, lng, r_m)
+
+    return {
+        "outages": outages,
+        "incidents": incidents,
+        "alert_zones": alert_zones,   # 👈 nouveau
+        "last_reports": last_reports,
+        "server_now": nowz(),
+    }
+
+
+# ---------- /map?since=<cursor> : synchro incrémentale (voir app/services/map_sync.py) ----------
+async def fetch_events_since(
+    db: AsyncSession, table: str, since_us: int,
+    lat: float, lng: float, r_m: float, show_all: bool,
+):
+    """Outages / incidents créés, modifiés ou clos depuis le curseur (même format que /map)."""
+    where_geo = "TRUE" if show_all else "ST_DWithin((e.center::geography), ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography, :r)"
+    res = await db.execute(text(f"""
+        SELECT e.id,
+               e.kind::text AS kind,
+               CASE WHEN e.restored_at IS NULL THEN 'active' ELSE 'restored' END AS status,
+               ST_Y((e.center::geometry)) AS lat,
+               ST_X((e.center::geometry)) AS lng,
+               e.started_at,
+               e.restored_at,
+               COALESCE(e.attachments_count, 0)::int AS attachments_count,
+               COALESCE(e.reports_count, 0)::int AS reports_count
+          FROM {table} e
+         WHERE e.updated_at > to_timestamp(:since / 1000000.0) - make_interval(secs => :overlap)
+           AND {where_geo}
+         ORDER BY e.started_at DESC NULLS LAST, e.id DESC
+         LIMIT 2000
+    """), {"since": since_us, "overlap": MAP_SYNC_OVERLAP_S, "lat": lat, "lng": lng, "r": r_m})
+    return _rows_as_dicts(res)
+
+
+async def fetch_reports_since(db: AsyncSession, since_us: int, lat: float, lng: float, r_m: float):
+    """Reports 'cut' de la fenêtre, modifiés depuis le curseur (même format que last_reports)."""
+    res = await db.execute(text(f"""
+        SELECT id,
+               kind::text   AS kind,
+               signal::text AS signal,
+               ST_Y((geom::geometry)) AS lat,
+               ST_X((geom::geometry)) AS lng,
+               user_id,
+               created_at,
+               phone
+          FROM reports
+         WHERE updated_at > to_timestamp(:since / 1000000.0) - make_interval(secs => :overlap)
+           AND ST_DWithin((geom::geography), ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography, :r)
+           AND LOWER(TRIM(signal::text)) = 'cut'
+           AND created_at > NOW() - INTERVAL '{POINTS_WINDOW_MIN} minutes'
+         ORDER BY created_at DESC
+         LIMIT :max
+    """), {"since": since_us, "overlap": MAP_SYNC_OVERLAP_S, "lat": lat, "lng": lng, "r": r_m, "max": MAX_REPORTS})
+    return _rows_as_dicts(res)
+
+
+async def _build_map_delta(
+    db: AsyncSession, since: Optional[str], lat: float, lng: float, radius_km: float,
+    show_all: bool, timings: dict,
+):
+    """
+    Réponse de /map?since=… :
+      - curseur absent / invalide / trop vieux / TRUNCATE depuis → payload complet + "full": true
+      - sinon uniquement ce qui a changé + "deleted" (tombstones par table)
+    Toujours avec le nouveau "cursor" à renvoyer au prochain appel.
+    last_reports : le client retire lui-même les pins antérieurs à "reports_since"
+    (sortie de fenêtre = pas de modification de ligne).
+    """
+    def window_start():
+        return (datetime.now(timezone.utc).timestamp() - POINTS_WINDOW_MIN * 60)
+
+    await _begin_read_only(db)
+    cursor = await new_cursor(db)     # pris AVANT les lectures : rien ne passe entre deux appels
+    since_us = parse_cursor(since)
+    if since_us is None or await needs_full_sync(db, since_us):
+        payload = await _build_map_payload(db, lat, lng, radius_km, show_all, timings,
+                                           read_only_started=True)
+        payload.update({"full": True, "cursor": cursor, "deleted": {}})
+        return payload
+
+    r_m = float(radius_km * 1000.0)
+    outages   = await _timed(timings, "outages", fetch_events_since, db, "outages", since_us, lat, lng, r_m, show_all)
+    incidents = await _timed(timings, "incidents", fetch_events_since, db, "incidents", since_us, lat, lng, r_m, show_all)
+    if show_all:
+        alert_zones, last_reports = [], []
+    else:
+        alert_zones  = await _timed(timings, "alert_zones", fetch_alert_zones, db, lat, lng, r_m)
+        last_reports = await _timed(timings, "last_reports", fetch_reports_since, db, since_us, lat, lng, r_m)
+    deleted = await _timed(timings, "deleted", fetch_tombstones, db, since_us)
+
+    return {
+        "full": False,
+        "cursor": cursor,
+        "outages": outages,
+        "incidents": incidents,
+        "alert_zones": alert_zones,     # calculées : toujours complètes
+        "last_reports": last_reports,
+        "deleted": deleted,
+        "reports_since": datetime.fromtimestamp(window_start(), timezone.utc).isoformat().replace("+00:00", "Z"),
+        "server_now": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+    }
+
+
+def _server_timing(timings: dict) -> str:
+    return ", ".join(f"{k};dur={v:.1f}" for k, v in timings.items())
+
+
 @router.get("/map")
 async def map_endpoint(
     lat: float = Query(..., ge=-90, le=90),
     lng: float = Query(..., ge=-180, le=180),
     radius_km: float = Query(5.0, gt=0, le=50),
     show_all: bool = Query(False, description="Si true: renvoie tous les événements actifs (cap)."),
-    response: Response = None,
-    db: AsyncSession = Depends(get_db),
+    since: Optional[str] = Query(None, description="Curseur renvoyé par l'appel précédent : seulement les changements."),
+    if_none_match: Optional[str] = Header(default=None),
+    db: AsyncSession = Depends(get_read_db),
 ):
     def nowz():
         return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
 
-    try:
-        # 0) Auto-clôture incidents/outages anciens (si activé)
+    # Synchro incrémentale : hors cache (réponse propre à chaque curseur)
+    if since is not None:
+        timings: dict = {}
         try:
-            if os.getenv("AUTO_EXPIRE_ENABLED", "1") != "0":
-                await db.execute(text(f"""
-                    UPDATE incidents
-                       SET restored_at = COALESCE(restored_at, NOW())
-                     WHERE restored_at IS NULL
-                       AND started_at  < NOW() - INTERVAL '{AUTO_EXPIRE_H} hours'
-                """))
-                await db.execute(text(f"""
-                    UPDATE outages
-                       SET restored_at = COALESCE(restored_at, NOW())
-                     WHERE restored_at IS NULL
-                       AND started_at  < NOW() - INTERVAL '{AUTO_EXPIRE_H} hours'
-                """))
-                await db.commit()
-        except Exception:
-            await db.rollback()
+            payload = await _build_map_delta(db, since, lat, lng, radius_km, show_all, timings)
+        except Exception as e:
+            try:
+                await db.rollback()
+            except Exception:
+                pass
+            # surtout pas un 200 "full" vide : le client remplacerait tout son
+            # état par rien. 503 → il rejoue avec le même curseur.
+            print(f"⚠️ /map since failed: {e}")
+            raise HTTPException(503, f"map delta failed: {type(e).__name__}: {e}",
+                                headers={"Retry-After": "2", "Cache-Control": "no-store"})
+        return FastJSONResponse(payload, headers={
+            "Cache-Control": "no-store, no-cache, must-revalidate",
+            "X-Map-Mode": "delta" if not payload.get("full") else "full",
+            "Server-Timing": _server_timing(timings),
+        })
 
-        # 👉 Mode GLOBAL: on peut alléger (pas de last_reports ni alert_zones)
-        if show_all:
-            outages   = await fetch_outages_all(db, limit=2000)
-            incidents = await fetch_incidents_all(db, limit=2000)
-            payload = {
-                "outages": outages,
-                "incidents": incidents,
-                "alert_zones": [],     # allégé en global
-                "last_reports": [],
-                "server_now": nowz(),
+    # show_all : snapshot mémoire pré-sérialisé (app/services/map_snapshot.py), sans DB
+    if show_all and MAP_SNAPSHOT_ENABLED:
+        snap = await get_snapshot()
+        if snap is not None:
+            body, etag, generated_at = snap
+            headers = {
+                "Cache-Control": "private, no-cache",
+                "Pragma": "no-cache",
+                "ETag": etag,
+                "X-Map-Mode": "snapshot",
+                "X-Map-Snapshot-At": generated_at,
             }
-            if response is not None:
-                response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate"
-                response.headers["Pragma"] = "no-cache"
-            return payload
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers=headers)
+            return Response(
+                content=_with_server_now(body, nowz()),
+                media_type="application/json",
+                headers=headers,
+            )
 
-        # --- mode LOCAL (comportement historique) ---
-        r_m = float(radius_km * 1000.0)
+    # NB: l'auto-clôture (AUTO_EXPIRE_*) tourne désormais dans le job
+    # run_auto_expire (app/services/aggregation.py) → /map est en lecture seule.
+    try:
+        # 1) Cellule geohash du cache (voir app/services/map_cache.py)
+        cache_key = None
+        cache_state = "BYPASS"
+        if MAP_CACHE_ENABLED:
+            cache_key, lat, lng, radius_km = map_cell(lat, lng, radius_km, show_all)
+
+        timings: dict = {}
+        t0 = time.perf_counter()
+
+        # 2) Cache mémoire d'abord : une entrée encore dans le TTL n'a pas été
+        #    invalidée par une écriture de ce worker → son ETag est servi tel quel,
+        #    sans aller-retour en base (écriture reçue par un autre worker : au pire
+        #    TTL de retard, même contrat que map_cache.py)
+        payload = None
+        etag = None
+        if cache_key is not None:
+            entry = map_cache.get(cache_key)
+            if entry is not None:
+                etag, payload = entry
+            cache_state = "MISS" if payload is None else "HIT"
+
+        # 3) Sinon ETag = versions des cellules couvertes (voir app/services/area_versions.py)
+        #    → 304 sans requête lourde si rien n'a bougé
+        read_only = False
+        if payload is None and MAP_ETAG_ENABLED:
+            await _begin_read_only(db)
+            read_only = True
+            try:
+                etag = await _timed(timings, "etag", map_etag, db, lat, lng, radius_km * 1000.0, show_all)
+            except Exception as e:
+                await db.rollback()
+                read_only = False
+                print(f"⚠️ /map etag failed: {e}")
+        if etag and etag_matches(if_none_match, etag):
+            timings["total"] = (time.perf_counter() - t0) * 1000.0
+            return Response(status_code=304, headers={
+                "ETag": etag,
+                "Cache-Control": "private, no-cache",
+                "X-Map-Cache": cache_state,
+                "Server-Timing": _server_timing(timings),
+            })
 
-        outages   = await fetch_outages(db, lat, lng, r_m)
-        incidents = await fetch_incidents(db, lat, lng, r_m)
-        alert_zones = await fetch_alert_zones(db, lat, lng, r_m)
+        async def compute():
+            nonlocal read_only, ran
+            ran = True
+            if MAP_FAST_PATH:
+                try:
+                    if not read_only:
+                        await _begin_read_only(db)
+                        read_only = True
+                    return (await _timed(timings, "fast", fetch_map_payload_json,
+                                         db, lat, lng, radius_km * 1000.0, show_all)), "fast"
+                except Exception as e:
+                    await db.rollback()
+                    read_only = False
+                    print(f"⚠️ /map fast path failed, fallback: {e}")
+            built = await _build_map_payload(db, lat, lng, radius_km, show_all, timings,
+                                             read_only_started=read_only)
+            return built, "parallel" if (MAP_PARALLEL and not show_all) else "serial"
+
+        # 4) Single-flight : requêtes identiques simultanées → une seule exécution
+        #    (clé = cellule normalisée + ETag, voir app/services/singleflight.py)
+        mode = "cache"
+        ran = False
+        if payload is None:
+            sf_key = (cache_key if cache_key is not None
+                      else (*singleflight.norm_point(lat, lng), radius_km, show_all), etag)
+            payload, mode = await _sf_map.do(sf_key, compute)
+            if not ran:
+                cache_state = "COALESCED"
+        timings["total"] = (time.perf_counter() - t0) * 1000.0
+
+        if cache_key is not None and cache_state == "MISS":
+            meta = None if show_all else (lat, lng, radius_km * 1000.0)
+            map_cache.set(cache_key, (etag, payload), meta)
 
-        # derniers reports pour les badges / info
-                # derniers reports pour les badges / info
-        q_rep = text(f"""
-            WITH me AS (
-              SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g
+        headers = {
+            # no-cache (et non plus no-store) : le client revalide avec If-None-Match
+            "Cache-Control": "private, no-cache",
+            "Pragma": "no-cache",
+            "X-Map-Cache": cache_state,
+            "X-Map-Mode": mode,
+            "Server-Timing": _server_timing(timings),
+        }
+        if etag:
+            headers["ETag"] = etag
+
+        # JSON pré-sérialisé par Postgres → renvoyé tel quel
+        if isinstance(payload, bytes):
+            return Response(
+                content=_with_server_now(payload, nowz()),
+                media_type="application/json",
+                headers=headers,
             )
-            SELECT id,
-                   kind::text   AS kind,
-                   signal::text AS signal,
-                   ST_Y((geom::geometry)) AS lat,
-                   ST_X((geom::geometry)) AS lng,
-                   user_id,
-                   created_at,
-                   phone                    -- 👈 on l’ajoute ici
-              FROM reports
-             WHERE ST_DWithin((geom::geography), (SELECT g FROM me), :r)
-               AND LOWER(TRIM(signal::text)) = 'cut'
-               AND created_at > NOW() - INTERVAL '{POINTS_WINDOW_MIN} minutes'
-             ORDER BY created_at DESC
-             LIMIT :max
-        """)
-        res_rep = await db.execute(q_rep, {"lng": lng, "lat": lat, "r": r_m, "max": MAX_REPORTS})
-        last_reports = [
-            {
-                "id": r.id,
-                "kind": r.kind,
-                "signal": r.signal,
-                "lat": float(r.lat),
-                "lng": float(r.lng),
-                "user_id": r.user_id,
-                "created_at": r.created_at,
-                "phone": getattr(r, "phone", None),   # 👈 on le remet dans le JSON
-            }
-            for r in res_rep.fetchall()
-        ]
 
+        if cache_state in ("HIT", "COALESCED"):
+            payload = {**payload, "server_now": nowz()}
+        # rendu direct (orjson) : pas de passage par jsonable_encoder
+        return FastJSONResponse(payload, headers=headers)
 
-        payload = {
-            "outages": outages,
-            "incidents": incidents,
-            "alert_zones": alert_zones,   # 👈 nouveau
-            "last_reports": last_reports,
+    except Exception as e:
+        try:
+            await db.rollback()
+        except Exception:
+            pass
+        return {
+            "outages": [],
+            "incidents": [],
+            "alert_zones": [],
+            "last_reports": [],
             "server_now": nowz(),
+            "error": f"{type(e).__name__}: {e}",
         }
-        if response is not None:
-            response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate"
-            response.headers["Pragma"] = "no-cache"
-        return payload
 
+
+
+# ---------- /map/viewport : bbox + zoom, clusters par niveau de zoom ----------
+def _viewport_cell_deg(zoom: int) -> float:
+    """Taille (degrés) d'une cellule de VIEWPORT_CLUSTER_PX pixels au zoom donné (tuiles 256 px)."""
+    return VIEWPORT_CLUSTER_PX * 360.0 / (256.0 * (2 ** zoom))
+
+
+def _viewport_events_sql(table: str, group_expr: str, active_only: bool) -> str:
+    # une ligne par (kind, cellule) ; quand n = 1 les colonnes « unitaires »
+    # (id, started_at…) sont celles du seul évènement du groupe
+    active_sql = "AND e.restored_at IS NULL" if active_only else ""
+    return f"""
+        WITH pts AS (
+          SELECT e.id,
+                 e.kind::text AS kind,
+                 (e.center::geometry) AS g,
+                 e.started_at,
+                 e.restored_at,
+                 COALESCE(e.attachments_count, 0) AS attachments_count,
+                 COALESCE(e.reports_count, 0)     AS reports_count
+            FROM {table} e
+           WHERE (e.center::geometry) && ST_MakeEnvelope(:min_lng, :min_lat, :max_lng, :max_lat, 4326)
+             {active_sql}
+        )
+        SELECT kind,
+               COUNT(*)::int AS n,
+               AVG(ST_Y(g)) AS lat,
+               AVG(ST_X(g)) AS lng,
+               COUNT(*) FILTER (WHERE restored_at IS NULL)::int AS active_count,
+               SUM(attachments_count)::int AS attachments_count,
+               SUM(reports_count)::int     AS reports_count,
+               (array_agg(id))[1] AS id,
+               MAX(started_at)  AS started_at,
+               MAX(restored_at) AS restored_at
+          FROM pts
+         GROUP BY kind, {group_expr}
+         ORDER BY n DESC, started_at DESC NULLS LAST
+         LIMIT :max_items
+    """
+
+
+def _viewport_reports_sql(group_expr: str) -> str:
+    return f"""
+        WITH pts AS (
+          SELECT id,
+                 kind::text   AS kind,
+                 signal::text AS signal,
+                 (geom::geometry) AS g,
+                 user_id,
+                 created_at,
+                 phone
+            FROM reports
+           WHERE (geom::geometry) && ST_MakeEnvelope(:min_lng, :min_lat, :max_lng, :max_lat, 4326)
+             AND LOWER(TRIM(signal::text)) = 'cut'
+             AND created_at > NOW() - INTERVAL '{POINTS_WINDOW_MIN} minutes'
+        )
+        SELECT kind,
+               COUNT(*)::int AS n,
+               AVG(ST_Y(g)) AS lat,
+               AVG(ST_X(g)) AS lng,
+               (array_agg(id))[1]      AS id,
+               (array_agg(signal))[1]  AS signal,
+               (array_agg(user_id))[1] AS user_id,
+               (array_agg(phone))[1]   AS phone,
+               MAX(created_at) AS created_at
+          FROM pts
+         GROUP BY kind, {group_expr}
+         ORDER BY created_at DESC
+         LIMIT :max_items
+    """
+
+
+def _viewport_event_item(r) -> dict:
+    if r.n == 1:
+        return {
+            "id": r.id, "kind": r.kind,
+            "status": "active" if r.active_count else "restored",
+            "lat": float(r.lat), "lng": float(r.lng),
+            "started_at": r.started_at,
+            "restored_at": r.restored_at,
+            "attachments_count": r.attachments_count,
+            "reports_count": r.reports_count,
+        }
+    return {
+        "cluster": True, "kind": r.kind, "count": r.n,
+        "lat": float(r.lat), "lng": float(r.lng),
+        "active_count": r.active_count,
+        "attachments_count": r.attachments_count,
+        "reports_count": r.reports_count,
+        "started_at": r.started_at,     # le plus récent du groupe
+    }
+
+
+def _viewport_report_item(r) -> dict:
+    if r.n == 1:
+        return {
+            "id": r.id, "kind": r.kind, "signal": r.signal,
+            "lat": float(r.lat), "lng": float(r.lng),
+            "user_id": r.user_id,
+            "created_at": r.created_at,
+            "phone": r.phone,
+        }
+    return {
+        "cluster": True, "kind": r.kind, "count": r.n,
+        "lat": float(r.lat), "lng": float(r.lng),
+        "created_at": r.created_at,     # le plus récent du groupe
+    }
+
+
+@router.get("/map/viewport")
+async def map_viewport(
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lng: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lng: float = Query(..., ge=-180, le=180),
+    zoom: int = Query(..., ge=0, le=22),
+    active_only: bool = Query(False, description="Si true: uniquement les évènements actifs."),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Variante de /map pilotée par la vue carte : bbox visible + zoom.
+    Outages / incidents / pins 'cut' sont regroupés par (kind, cellule de grille)
+    dont la taille suit le zoom ; un groupe d'un seul élément est renvoyé tel quel
+    (même format que /map), au-delà de VIEWPORT_POINTS_ZOOM tout est en points bruts.
+    """
+    def nowz():
+        return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+    if min_lat > max_lat or min_lng > max_lng:
+        raise HTTPException(status_code=400, detail="invalid bbox")
+
+    clustered = zoom < VIEWPORT_POINTS_ZOOM
+    cell = _viewport_cell_deg(zoom)
+    ev_group  = f"ST_SnapToGrid(g, {cell!r})" if clustered else "id"
+    params = {
+        "min_lat": min_lat, "min_lng": min_lng, "max_lat": max_lat, "max_lng": max_lng,
+        "max_items": VIEWPORT_MAX_ITEMS,
+    }
+
+    timings: dict = {}
+    try:
+        await _begin_read_only(db)
+
+        async def q_events(table):
+            res = await db.execute(text(_viewport_events_sql(table, ev_group, active_only)), params)
+            return [_viewport_event_item(r) for r in res.fetchall()]
+
+        async def q_reports():
+            p2 = dict(params, max_items=VIEWPORT_MAX_ITEMS if clustered else MAX_REPORTS)
+            res = await db.execute(text(_viewport_reports_sql(ev_group)), p2)
+            return [_viewport_report_item(r) for r in res.fetchall()]
+
+        outages      = await _timed(timings, "outages", q_events, "outages")
+        incidents    = await _timed(timings, "incidents", q_events, "incidents")
+        last_reports = await _timed(timings, "last_reports", q_reports)
+
+        # zones d'alerte : calcul DBSCAN existant sur le disque englobant la bbox
+        alert_zones = []
+        c_lat, c_lng = (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+        r_m = haversine_m(min_lat, min_lng, max_lat, max_lng) / 2.0
+        if r_m <= VIEWPORT_ZONES_MAX_KM * 1000.0:
+            zones = await _timed(timings, "alert_zones", fetch_alert_zones, db, c_lat, c_lng, r_m)
+            alert_zones = [
+                z for z in zones
+                if min_lat <= z["lat"] <= max_lat and min_lng <= z["lng"] <= max_lng
+            ]
     except Exception as e:
         try:
             await db.rollback()
         except Exception:
             pass
         return {
+            "zoom": zoom,
+            "clustered": clustered,
             "outages": [],
             "incidents": [],
             "alert_zones": [],
@@ -851,6 +1457,18 @@ async def map_endpoint(
             "error": f"{type(e).__name__}: {e}",
         }
 
+    return FastJSONResponse({
+        "zoom": zoom,
+        "clustered": clustered,
+        "outages": outages,
+        "incidents": incidents,
+        "alert_zones": alert_zones,
+        "last_reports": last_reports,
+        "server_now": nowz(),
+    }, headers={
+        "Cache-Control": "no-store, no-cache, must-revalidate",
+        "Server-Timing": _server_timing(timings),
+    })
 
 # --------- POST /report ----------
 from typing import Optional
@@ -872,18 +1490,149 @@ class ReportIn(BaseModel):
     phone: Optional[str] = None   # 👈 nouveau champ
 
 
+# Une requête, une transaction : prise de la clé d'idempotence, upsert user,
+# insert report, effet sur l'évènement (ouverture + compteurs pour 'cut',
+# ownership + clôture pour 'restored') et ligne report_events, en CTE modifiantes.
+# Les CTE voient toutes le même instantané : l'évènement ouvert par « ev »
+# n'est pas vu par « bump » → il naît directement avec reports_count = 1.
+# :kind sert à plusieurs types (report_kind, outage_kind, text) : toujours
+# passer par CAST(… AS text), sinon Postgres fige le type au premier usage.
+_REPORT_CTE_HEAD = """
+    WITH me AS (SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g),
+    own AS ({own_sql}),
+    -- clé primaire (scope, key) : un seul retry concurrent gagne ; la réponse
+    -- d'origine est écrite avec elle (services/idempotency.py)
+    claim AS (
+      INSERT INTO idempotency_keys(scope, key, completed_at, status_code, response)
+      SELECT 'report', CAST(:idem AS text), NOW(),
+             CASE WHEN (SELECT ok FROM own) THEN 200 ELSE 403 END,
+             CASE WHEN (SELECT ok FROM own)
+                  THEN jsonb_build_object('ok', true, 'id', CAST(:rid AS text),
+                                          'idempotency_key', CAST(:idem AS text))
+                  ELSE jsonb_build_object('detail', 'not_owner') END
+       WHERE CAST(:idem AS text) IS NOT NULL
+      ON CONFLICT (scope, key) DO NOTHING
+      RETURNING key
+    ),
+    -- :uid_new = uid seulement s'il n'est pas déjà connu (services/known_users.py)
+    u AS (
+      INSERT INTO app_users(id)
+      SELECT CAST(:uid_new AS uuid) WHERE CAST(:uid_new AS uuid) IS NOT NULL
+      ON CONFLICT (id) DO NOTHING
+    ),
+    rep AS (
+      INSERT INTO reports(id, kind, signal, geom, user_id, created_at, idempotency_key{phone_col}{sig_col})
+      SELECT CAST(:rid AS uuid),
+             CAST(CAST(:kind AS text) AS {kind_t}), CAST(CAST(:signal AS text) AS {signal_t}), (SELECT g FROM me),
+             CAST(:uid AS uuid), NOW(), CAST(:idem AS text){phone_val}{sig_val}
+       WHERE CAST(:idem AS text) IS NULL OR EXISTS (SELECT 1 FROM claim)
+      RETURNING id
+    ),
+    log AS (
+      INSERT INTO report_events(report_id, event) SELECT id, 'created' FROM rep
+    ),
+"""
+
+_REPORT_CTE_CUT = """
+    ev AS (
+      INSERT INTO {table}(kind, center, started_at, restored_at,
+                          reports_count, first_report_at, last_report_at)
+      SELECT CAST(CAST(:kind AS text) AS {ev_kind_t}), (SELECT g FROM me), NOW(), NULL, 1, NOW(), NOW()
+       WHERE EXISTS (SELECT 1 FROM rep)
+         AND NOT EXISTS (
+           SELECT 1 FROM {table} i
+            WHERE i.kind = CAST(CAST(:kind AS text) AS {ev_kind_t})
+              AND i.restored_at IS NULL
+              AND ST_DWithin(i.center, (SELECT g FROM me), 120)
+         )
+    ),
+    bump AS (
+      UPDATE {table} e
+         SET reports_count   = COALESCE(e.reports_count, 0) + 1,
+             first_report_at = COALESCE(e.first_report_at, NOW()),
+             last_report_at  = NOW()
+       WHERE EXISTS (SELECT 1 FROM rep)
+         AND e.kind::text = CAST(:kind AS text)
+         AND ST_DWithin((e.center::geography), (SELECT g FROM me), {counters_m})
+    )
+"""
+
+_REPORT_OWN_RESTORED = """
+      SELECT CAST(:is_admin AS boolean) OR EXISTS (
+        SELECT 1 FROM reports r
+         WHERE r.kind = CAST(CAST(:kind AS text) AS {kind_t}) AND lower(trim(r.signal::text))='cut'
+           AND r.user_id = CAST(:uid AS uuid)
+           AND r.created_at >= NOW() - INTERVAL '24 hours'
+           AND ST_DWithin(r.geom, (SELECT g FROM me), :ownr)
+      ) AS ok
+"""
+
+_REPORT_CTE_RESTORED = """
+    upd AS (
+      UPDATE {table} i
+         SET restored_at = COALESCE(i.restored_at, NOW())
+       WHERE EXISTS (SELECT 1 FROM rep) AND (SELECT ok FROM own)
+         AND i.kind = CAST(CAST(:kind AS text) AS {ev_kind_t})
+         AND i.restored_at IS NULL
+         AND ST_DWithin(i.center, (SELECT g FROM me), 150)
+    )
+"""
+
+# prev : réponse d'une écriture antérieure déjà commitée avec la même clé
+_REPORT_CTE_TAIL = """
+    SELECT (SELECT id FROM rep)     AS id,
+           (SELECT ok FROM own)     AS owner,
+           EXISTS (SELECT 1 FROM claim) AS claimed,
+           prev.status_code         AS prev_status,
+           prev.response            AS prev_response
+      FROM (SELECT 1) one
+      LEFT JOIN idempotency_keys prev
+        ON prev.scope = 'report' AND prev.key = CAST(:idem AS text)
+"""
+
+_report_sql_cache: dict = {}
+
+
+async def _report_sql(db: AsyncSession, signal: str, table: str):
+    # variante par (signal, table, version du schéma) : types enum/text et
+    # colonne phone lus dans le registre, jamais sondés à la requête
+    reg = await schema_registry.get(db)
+    key = (signal, table, reg.version)
+    stmt = _report_sql_cache.get(key)
+    if stmt is None:
+        if signal == "cut":
+            own_sql, effects = "SELECT true AS ok", _REPORT_CTE_CUT
+        else:
+            own_sql, effects = _REPORT_OWN_RESTORED, _REPORT_CTE_RESTORED
+        has_phone = reg.has_column("reports", "phone")
+        has_sig = reg.has_column("reports", "sig_version")
+        sql = _REPORT_CTE_HEAD.replace("{own_sql}", own_sql) + effects + _REPORT_CTE_TAIL
+        stmt = text(sql.format(
+            kind_t=reg.cast_type("reports", "kind"),
+            signal_t=reg.cast_type("reports", "signal"),
+            ev_kind_t=reg.cast_type(table, "kind"),
+            phone_col=", phone" if has_phone else "",
+            phone_val=", :phone" if has_phone else "",
+            sig_col=", signature, sig_version" if has_sig else "",
+            sig_val=", :sig, :sig_version" if has_sig else "",
+            table=table,
+            counters_m=COUNTERS_MATCH_M,
+        ))
+        _report_sql_cache[key] = stmt
+    return stmt
+
+
+async def _report_timeout(db: AsyncSession) -> None:
+    """statement_timeout de la transaction d'écriture (verrous des évènements / area_versions)."""
+    await db.execute(text(f"SET LOCAL statement_timeout = {REPORT_STATEMENT_TIMEOUT_MS}"))
+
+
 @router.post("/report")
 async def post_report(
     p: ReportIn = Body(...),
     db: AsyncSession = Depends(get_db),
     x_admin_token: Optional[str] = Header(default=None),
 ):
-    # petit timeout
-    try:
-        await db.execute(text("SET LOCAL statement_timeout = '8s'"))
-    except Exception:
-        await db.rollback()
-
     kind = (p.kind or "").lower().strip()
     signal = (p.signal or "").lower().strip()
     if kind not in ALLOWED_KINDS:
@@ -896,196 +1645,151 @@ async def post_report(
     is_admin = (x_admin_token or "").strip() == ADMIN_TOKEN
     idem = (p.idempotency_key or "").strip() or None
 
-    # upsert user
-    if uid:
-        try:
-            await db.execute(
-                text("INSERT INTO app_users(id) VALUES(CAST(:uid AS uuid)) ON CONFLICT (id) DO NOTHING"),
-                {"uid": uid}
-            )
-            await db.commit()
-        except Exception:
-            await db.rollback()
+    # retry récent : réponse d'origine depuis le LRU, sans aller-retour
+    prev = idempotency.recent(idempotency.SCOPE_REPORT, idem)
+    if prev is not None:
+        return _idem_replay(prev)
 
-    # 1) insertion report (idempotent) + phone
-    inserted_id = None
-    try:
-        res = await db.execute(text("""
-            INSERT INTO reports(
-                kind, signal, geom, user_id, created_at, idempotency_key, phone
-            )
-            SELECT
-              CAST(:kind   AS report_kind),
-              CAST(:signal AS report_signal),
-              ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography,
-              CAST(NULLIF(:uid,'') AS uuid),
-              NOW(),
-              NULLIF(:idem,'')::text,
-              :phone
-            WHERE
-              (:idem IS NULL OR :idem = '')
-              OR NOT EXISTS (SELECT 1 FROM reports WHERE idempotency_key = NULLIF(:idem,'')::text)
-            RETURNING id
-        """), {
-            "kind": kind,
-            "signal": signal,
-            "lng": p.lng,
-            "lat": p.lat,
-            "uid": (uid or ""),
-            "idem": idem,
-            "phone": p.phone,
-        })
-        row = res.fetchone()
-        await db.commit()
-        inserted_id = row[0] if row else None
-    except Exception:
-        # fallback si tes types Postgres sont en text
-        await db.rollback()
+    # Mode file (REPORT_INGEST_MODE=queue) : stockage durable + 202,
+    # outages / incidents appliqués par les workers (app/services/report_queue.py)
+    if report_queue.queue_mode():
         try:
-            res = await db.execute(text("""
-                INSERT INTO reports(
-                    kind, signal, geom, user_id, created_at, idempotency_key, phone
-                )
-                SELECT
-                  CAST(:kind   AS text),
-                  CAST(:signal AS text),
-                  ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography,
-                  CAST(NULLIF(:uid,'') AS uuid),
-                  NOW(),
-                  NULLIF(:idem,'')::text,
-                  :phone
-                WHERE
-                  (:idem IS NULL OR :idem = '')
-                  OR NOT EXISTS (SELECT 1 FROM reports WHERE idempotency_key = NULLIF(:idem,'')::text)
-                RETURNING id
-            """), {
-                "kind": kind,
-                "signal": signal,
-                "lng": p.lng,
-                "lat": p.lat,
-                "uid": (uid or ""),
-                "idem": idem,
-                "phone": p.phone,
+            await _report_timeout(db)
+            body, prev = await report_queue.enqueue_report(db, {
+                "kind": kind, "signal": signal, "lat": float(p.lat), "lng": float(p.lng),
+                "user_id": uid, "idempotency_key": idem, "phone": p.phone,
+                "is_admin": is_admin,
             })
-            row = res.fetchone()
-            await db.commit()
-            inserted_id = row[0] if row else None
-        except Exception as e2:
+        except Exception as e:
             await db.rollback()
-            raise HTTPException(500, f"report insert failed: {e2}")
+            raise HTTPException(500, f"report enqueue failed: {e}")
+        if prev is not None:
+            return _idem_replay(prev)
+        return FastJSONResponse(body, status_code=202)
 
-    # 2) mise à jour incidents / outages comme tu faisais
+    # Mode sync : un aller-retour (hors premier appel du process : introspection des types)
+    rid = str(uuid.uuid4())
+    params = {
+        "rid": rid,
+        "kind": kind,
+        "signal": signal,
+        "lng": float(p.lng),
+        "lat": float(p.lat),
+        "uid": uid,
+        "uid_new": None if known_users.is_known(uid) else uid,
+        "idem": idem,
+        "phone": p.phone,
+        "is_admin": is_admin,
+        "ownr": float(OWNERSHIP_RADIUS_M),
+        # signé avant l'insert (id pré-généré), écrit dans la même CTE
+        "sig": report_signature(rid, kind=kind, signal=signal, lat=float(p.lat), lng=float(p.lng),
+                                device_id=None, accuracy_m=None, photo_url=None, user_id=uid),
+        "sig_version": SIG_VERSION,
+    }
     try:
+        stmt = await _report_sql(db, signal, event_table(kind))
         try:
-            await db.execute(text("SET LOCAL statement_timeout = '6s'"))
-        except Exception:
+            await _report_timeout(db)
+            row = (await db.execute(stmt, params)).first()
+        except Exception as e:
+            if params["uid_new"] is not None or not known_users.is_missing_user(e):
+                raise
+            # id « connu » absent d'app_users (supprimé hors appli) : upsert cette fois
             await db.rollback()
+            known_users.forget(uid)
+            await _report_timeout(db)
+            row = (await db.execute(stmt, {**params, "uid_new": uid})).first()
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(500, f"report insert failed: {e}")
+    known_users.add(uid)
+
+    if idem and not row.claimed:
+        # clé déjà prise : réponse d'origine (commitée avant nous, sinon relue
+        # maintenant — retry concurrent qui a attendu le verrou de la clé)
+        if row.prev_status is not None:
+            prev = idempotency.replayed((row.prev_status, row.prev_response))
+        else:
+            prev = await idempotency.lookup(db, idempotency.SCOPE_REPORT, idem) or (None, None)
+        if prev[0] is not None:
+            idempotency.remember(idempotency.SCOPE_REPORT, idem, *prev)
+        return _idem_replay(prev)
 
-        if signal == "cut":
-            if kind in ("power", "water"):
-                # OUTAGES
-                try:
-                    await db.execute(text("""
-                        WITH me AS (SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g)
-                        INSERT INTO outages(kind, center, started_at, restored_at)
-                        SELECT CAST(:kind AS outage_kind), (SELECT g FROM me), NOW(), NULL
-                        WHERE NOT EXISTS (
-                          SELECT 1 FROM outages i
-                           WHERE i.kind = CAST(:kind AS outage_kind)
-                             AND i.restored_at IS NULL
-                             AND ST_DWithin(i.center, (SELECT g FROM me), 120)
-                        )
-                    """), {"kind": kind, "lng": p.lng, "lat": p.lat})
-                except Exception:
-                    await db.execute(text("""
-                        WITH me AS (SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g)
-                        INSERT INTO outages(kind, center, started_at, restored_at)
-                        SELECT CAST(:kind AS text), (SELECT g FROM me), NOW(), NULL
-                        WHERE NOT EXISTS (
-                          SELECT 1 FROM outages i
-                           WHERE i.kind = CAST(:kind AS text)
-                             AND i.restored_at IS NULL
-                             AND ST_DWithin(i.center, (SELECT g FROM me), 120)
-                        )
-                    """), {"kind": kind, "lng": p.lng, "lat": p.lat})
-                await db.commit()
-            else:
-                # INCIDENTS
-                await db.execute(text("""
-                    WITH me AS (SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g)
-                    INSERT INTO incidents(kind, center, started_at, restored_at)
-                    SELECT CAST(:kind AS text), (SELECT g FROM me), NOW(), NULL
-                    WHERE NOT EXISTS (
-                      SELECT 1 FROM incidents i
-                       WHERE i.kind = CAST(:kind AS text)
-                         AND i.restored_at IS NULL
-                         AND ST_DWithin(i.center, (SELECT g FROM me), 120)
-                    )
-                """), {"kind": kind, "lng": p.lng, "lat": p.lat})
-                await db.commit()
+    map_cache_invalidate_point(p.lat, p.lng)
+    if not row.owner:
+        # report stocké, évènement laissé ouvert (comme avant)
+        idempotency.remember(idempotency.SCOPE_REPORT, idem, 403, {"detail": "not_owner"})
+        raise HTTPException(403, "not_owner")
+    body = {"ok": True, "id": rid, "idempotency_key": idem}
+    idempotency.remember(idempotency.SCOPE_REPORT, idem, 200, body)
+    return body
+
+
+# --------- POST /reports/batch (files d'attente hors-ligne) ----------
+class ReportBatchIn(BaseModel):
+    reports: List[ReportIn]
+
+
+@router.post("/reports/batch")
+async def post_reports_batch(
+    p: ReportBatchIn = Body(...),
+    db: AsyncSession = Depends(get_db),
+    x_admin_token: Optional[str] = Header(default=None),
+):
+    """
+    Jusqu'à INGEST_BATCH_MAX reports, dans l'ordre où le client les a créés.
+    Mêmes règles que POST /report, statut par item (même ordre que la requête) :
+    created | duplicate (idempotency_key déjà vue) | invalid | not_owner.
+    Voir app/services/ingest.py.
+    """
+    if not p.reports:
+        raise HTTPException(400, "empty batch")
+    if len(p.reports) > INGEST_BATCH_MAX:
+        raise HTTPException(413, f"too many reports (max {INGEST_BATCH_MAX})")
+
+    is_admin = bool(ADMIN_TOKEN) and (x_admin_token or "").strip() == ADMIN_TOKEN
+    items, invalid = [], {}
+    for i, r in enumerate(p.reports):
+        kind = (r.kind or "").lower().strip()
+        signal = (r.signal or "").lower().strip()
+        if kind not in ALLOWED_KINDS:
+            invalid[i] = "invalid kind"
+        elif signal not in {"cut", "restored"}:
+            invalid[i] = "invalid signal"
+        elif not (-90 <= r.lat <= 90 and -180 <= r.lng <= 180):
+            invalid[i] = "invalid coordinates"
         else:
-            # RESTORED — on garde ta logique d'ownership
-            if not is_admin:
-                if uid:
-                    q = await db.execute(text("""
-                        WITH me AS (SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g)
-                        SELECT 1
-                          FROM reports r
-                         WHERE r.kind=:kind AND lower(trim(r.signal::text))='cut'
-                           AND r.user_id = CAST(:uid AS uuid)
-                           AND r.created_at >= NOW() - INTERVAL '24 hours'
-                           AND ST_DWithin(r.geom, (SELECT g FROM me), :ownr)
-                         LIMIT 1
-                    """), {
-                        "kind": kind,
-                        "uid": uid,
-                        "lng": p.lng,
-                        "lat": p.lat,
-                        "ownr": OWNERSHIP_RADIUS_M,
-                    })
-                    if q.first() is None:
-                        raise HTTPException(403, "not_owner")
-                else:
-                    raise HTTPException(403, "not_owner")
-
-            if kind in ("power", "water"):
-                try:
-                    await db.execute(text("""
-                        WITH me AS (SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g)
-                        UPDATE outages i
-                           SET restored_at = COALESCE(i.restored_at, NOW())
-                         WHERE i.kind = CAST(:kind AS outage_kind)
-                           AND i.restored_at IS NULL
-                           AND ST_DWithin(i.center, (SELECT g FROM me), 150)
-                    """), {"kind": kind, "lng": p.lng, "lat": p.lat})
-                except Exception:
-                    await db.execute(text("""
-                        WITH me AS (SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g)
-                        UPDATE outages i
-                           SET restored_at = COALESCE(i.restored_at, NOW())
-                         WHERE i.kind = CAST(:kind AS text)
-                           AND i.restored_at IS NULL
-                           AND ST_DWithin(i.center, (SELECT g FROM me), 150)
-                    """), {"kind": kind, "lng": p.lng, "lat": p.lat})
-                await db.commit()
-            else:
-                await db.execute(text("""
-                    WITH me AS (SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g)
-                    UPDATE incidents i
-                       SET restored_at = COALESCE(i.restored_at, NOW())
-                     WHERE i.kind = CAST(:kind AS text)
-                       AND i.restored_at IS NULL
-                       AND ST_DWithin(i.center, (SELECT g FROM me), 150)
-                """), {"kind": kind, "lng": p.lng, "lat": p.lat})
-                await db.commit()
-
-    except HTTPException:
-        raise
+            items.append({
+                "index": i, "kind": kind, "signal": signal,
+                "lat": float(r.lat), "lng": float(r.lng),
+                "user_id": _to_uuid_or_none(r.user_id),
+                "idempotency_key": (r.idempotency_key or "").strip() or None,
+                "phone": r.phone,
+            })
+
+    try:
+        out = await ingest_reports(db, items, is_admin=is_admin, ownership_radius_m=OWNERSHIP_RADIUS_M)
     except Exception as e:
         await db.rollback()
-        raise HTTPException(500, f"events update failed: {e}")
+        raise HTTPException(500, f"batch insert failed: {e}")
+
+    for it in out["created"]:
+        map_cache_invalidate_point(it["lat"], it["lng"])
 
-    return {"ok": True, "id": inserted_id, "idempotency_key": idem}
+    results = out["results"]
+    statuses = []
+    for i, r in enumerate(p.reports):
+        key = (r.idempotency_key or "").strip() or None
+        if i in invalid:
+            statuses.append({"index": i, "status": "invalid", "error": invalid[i], "idempotency_key": key})
+        else:
+            statuses.append({"index": i, **results[i], "idempotency_key": key})
+
+    counts: dict = {}
+    for s in statuses:
+        counts[s["status"]] = counts.get(s["status"], 0) + 1
+    return {"ok": True, "count": len(statuses), "counts": counts, "items": statuses}
 
 
 @router.get("/reports_recent")
@@ -1129,18 +1833,8 @@ async def admin_factory_reset(request: Request, db: AsyncSession = Depends(get_d
                 await db.rollback()
 
         await db.commit()
-
-        try:
-            await db.execute(text("ALTER TABLE incidents ADD COLUMN IF NOT EXISTS restored_at timestamp NULL"))
-            await db.execute(text("ALTER TABLE outages   ADD COLUMN IF NOT EXISTS restored_at timestamp NULL"))
-            await db.execute(text("CREATE INDEX IF NOT EXISTS idx_incidents_center ON incidents USING GIST ((center::geometry))"))
-            await db.execute(text("CREATE INDEX IF NOT EXISTS idx_outages_center   ON outages   USING GIST ((center::geometry))"))
-            await db.execute(text("CREATE INDEX IF NOT EXISTS idx_incidents_kind ON incidents(kind)"))
-            await db.execute(text("CREATE INDEX IF NOT EXISTS idx_outages_kind   ON outages(kind)"))
-            await db.commit()
-        except Exception:
-            await db.rollback()
-
+        map_cache_invalidate_all()
+        # colonnes / index : migrations (TRUNCATE ne touche pas au schéma)
         return {"ok": True}
     except Exception as e:
         await db.rollback()
@@ -1191,139 +1885,141 @@ async def upload_image(
     if is_video and len(data) > 50 * 1024 * 1024:
         raise HTTPException(status_code=413, detail="video too large")
 
-    # --- idempotency
+    # --- idempotency : prise atomique, ou réponse d'origine (services/idempotency.py)
     idem = (idempotency_key or "").strip() or None
-    if idem:
-        q = text("SELECT id, url FROM attachments WHERE idempotency_key = :k LIMIT 1")
-        rs = await db.execute(q, {"k": idem})
-        row = rs.first()
-        if row:
-            return {
-                "ok": True,
-                "id": str(row.id),
-                "url": row.url if is_admin else None,  # ne montre l'URL qu'à l’admin
-                "idempotency_key": idem,
-            }
-
-    # --- Ownership check : si pas admin, l'uploader doit avoir un report récent proche
-    if not is_admin:
-        if not user_id:
-            raise HTTPException(status_code=403, detail="not_owner")
-        chk = text("""
-            WITH me AS (SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g)
-            SELECT 1
-              FROM reports
-             WHERE user_id = :uid
-               AND LOWER(TRIM(kind::text))   = :k
-               AND LOWER(TRIM(signal::text)) = 'cut'
-               AND created_at > NOW() - INTERVAL '48 hours'
-               AND ST_DWithin((geom::geography),(SELECT g FROM me),150)
-             LIMIT 1
-        """)
-        rs = await db.execute(chk, {"uid": str(user_id), "k": K, "lat": lat, "lng": lng})
-        if rs.first() is None:
-            raise HTTPException(status_code=403, detail="not_owner")
-
-    # --- choix extension/filename
-    ext = ".jpg"
-    if is_video:
-        if "mp4" in ctype:
-            ext = ".mp4"
-        elif "webm" in ctype:
-            ext = ".webm"
-        else:
-            ext = ".mp4"
-    else:
-        if "jpeg" in ctype:
-            ext = ".jpg"
-        elif "png" in ctype:
-            ext = ".png"
-        elif "webp" in ctype:
-            ext = ".webp"
-        else:
-            ext = ".jpg"
-
-    # --- stockage Supabase (si configuré) sinon local
-    url_public = None
-    bucket   = os.getenv("SUPABASE_BUCKET", "attachments")
-    supa_url = (os.getenv("SUPABASE_URL") or "").rstrip("/")
-    supa_key = os.getenv("SUPABASE_SERVICE_ROLE") or os.getenv("SUPABASE_SERVICE_KEY")
+    prev = await idempotency.claim(db, idempotency.SCOPE_ATTACHMENT, idem)
+    if prev is not None:
+        body = _idem_replay(prev)
+        return {**body, "url": body.get("url") if is_admin else None}  # ne montre l'URL qu'à l’admin
 
     try:
-        if supa_url and supa_key:
-            import httpx
-            path = f"{K}/{int(time.time())}-{uuid.uuid4()}{ext}"
-            upload_url = f"{supa_url}/storage/v1/object/{bucket}/{path}"
-            headers = {
-                "Authorization": f"Bearer {supa_key}",
-                "Content-Type": ctype or ("video/mp4" if is_video else "image/jpeg"),
-                "x-upsert": "false",
-            }
-            async with httpx.AsyncClient(timeout=30) as client:
-                r = await client.post(upload_url, headers=headers, content=data)
-            if r.status_code not in (200, 201):
-                raise HTTPException(status_code=502, detail=f"supabase upload failed: {r.status_code}")
-            url_public = f"{supa_url}/storage/v1/object/public/{bucket}/{path}"
+        # --- Ownership check : si pas admin, l'uploader doit avoir un report récent proche
+        if not is_admin:
+            if not user_id:
+                raise HTTPException(status_code=403, detail="not_owner")
+            chk = text("""
+                WITH me AS (SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g)
+                SELECT 1
+                  FROM reports
+                 WHERE user_id = :uid
+                   AND LOWER(TRIM(kind::text))   = :k
+                   AND LOWER(TRIM(signal::text)) = 'cut'
+                   AND created_at > NOW() - INTERVAL '48 hours'
+                   AND ST_DWithin((geom::geography),(SELECT g FROM me),150)
+                 LIMIT 1
+            """)
+            rs = await db.execute(chk, {"uid": str(user_id), "k": K, "lat": lat, "lng": lng})
+            if rs.first() is None:
+                raise HTTPException(status_code=403, detail="not_owner")
+
+        # --- choix extension/filename
+        ext = ".jpg"
+        if is_video:
+            if "mp4" in ctype:
+                ext = ".mp4"
+            elif "webm" in ctype:
+                ext = ".webm"
+            else:
+                ext = ".mp4"
         else:
-            # local /static (dev)
-            os.makedirs(STATIC_DIR, exist_ok=True)
-            path = f"{K}-{uuid.uuid4()}{ext}"
-            disk_path = os.path.join(STATIC_DIR, path)
-            with open(disk_path, "wb") as fp:
-                fp.write(data)
-            base = (BASE_PUBLIC_URL or "").rstrip("/")
-            url_public = f"{base}{STATIC_URL_PATH}/{path}" if base else f"{STATIC_URL_PATH}/{path}"
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"storage_error: {e}")
+            if "jpeg" in ctype:
+                ext = ".jpg"
+            elif "png" in ctype:
+                ext = ".png"
+            elif "webp" in ctype:
+                ext = ".webp"
+            else:
+                ext = ".jpg"
 
-    if not url_public:
-        raise HTTPException(status_code=500, detail="no_public_url")
+        # --- stockage Supabase (si configuré) sinon local
+        url_public = None
+        bucket   = os.getenv("SUPABASE_BUCKET", "attachments")
+        supa_url = (os.getenv("SUPABASE_URL") or "").rstrip("/")
+        supa_key = os.getenv("SUPABASE_SERVICE_ROLE") or os.getenv("SUPABASE_SERVICE_KEY")
 
-    # --- insert DB
-    ins = text("""
-        INSERT INTO attachments (
-            kind, geom, user_id, url, idempotency_key, created_at,
-            is_sensitive, uploader_id
-        )
-        VALUES (
-            :k,
-            ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography,
-            :uid,
-            :url,
-            :idem,
-            NOW(),
-            TRUE,
-            :uploader
+        try:
+            if supa_url and supa_key:
+                import httpx
+                path = f"{K}/{int(time.time())}-{uuid.uuid4()}{ext}"
+                upload_url = f"{supa_url}/storage/v1/object/{bucket}/{path}"
+                headers = {
+                    "Authorization": f"Bearer {supa_key}",
+                    "Content-Type": ctype or ("video/mp4" if is_video else "image/jpeg"),
+                    "x-upsert": "false",
+                }
+                async with httpx.AsyncClient(timeout=30) as client:
+                    r = await client.post(upload_url, headers=headers, content=data)
+                if r.status_code not in (200, 201):
+                    raise HTTPException(status_code=502, detail=f"supabase upload failed: {r.status_code}")
+                url_public = f"{supa_url}/storage/v1/object/public/{bucket}/{path}"
+            else:
+                # local /static (dev)
+                os.makedirs(STATIC_DIR, exist_ok=True)
+                path = f"{K}-{uuid.uuid4()}{ext}"
+                disk_path = os.path.join(STATIC_DIR, path)
+                with open(disk_path, "wb") as fp:
+                    fp.write(data)
+                base = (BASE_PUBLIC_URL or "").rstrip("/")
+                url_public = f"{base}{STATIC_URL_PATH}/{path}" if base else f"{STATIC_URL_PATH}/{path}"
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"storage_error: {e}")
+
+        if not url_public:
+            raise HTTPException(status_code=500, detail="no_public_url")
+
+        # --- insert DB
+        ins = text("""
+            INSERT INTO attachments (
+                kind, geom, user_id, url, idempotency_key, created_at,
+                is_sensitive, uploader_id
+            )
+            VALUES (
+                :k,
+                ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography,
+                :uid,
+                :url,
+                :idem,
+                NOW(),
+                TRUE,
+                :uploader
+            )
+            RETURNING id
+        """)
+        rs = await db.execute(
+            ins,
+            {
+                "k": K,
+                "lng": float(lng),
+                "lat": float(lat),
+                "uid": str(user_id) if user_id else None,
+                "url": url_public,
+                "idem": idem,
+                "uploader": str(user_id) if user_id else None,
+            },
         )
-        RETURNING id
-    """)
-    rs = await db.execute(
-        ins,
-        {
-            "k": K,
-            "lng": float(lng),
-            "lat": float(lat),
-            "uid": str(user_id) if user_id else None,
+        new_id = rs.scalar() if hasattr(rs, "scalar") else (rs.first().id if rs.first() else None)
+        body = {
+            "ok": True,
+            "id": str(new_id) if new_id else None,
             "url": url_public,
-            "idem": idem,
-            "uploader": str(user_id) if user_id else None,
-        },
-    )
-    new_id = rs.scalar() if hasattr(rs, "scalar") else (rs.first().id if rs.first() else None)
-    await db.commit()
-
-    return {
-        "ok": True,
-        "id": str(new_id) if new_id else None,
-        "url": url_public if is_admin else None,  # L’URL n’est renvoyée qu’à l’admin
-        "idempotency_key": idem,
-    }
-
-
-
-
+            "idempotency_key": idem,
+        }
+        await idempotency.complete(db, idempotency.SCOPE_ATTACHMENT, idem, 200, body)   # commit
+        try:
+            await bump_attachments_count(db, K, float(lat), float(lng))
+            await db.commit()
+        except Exception as e:
+            await db.rollback()   # rattrapé au prochain tick d'agrégation
+            print(f"[upload] counters bump failed: {e}")
+        map_cache_invalidate_point(lat, lng)
+
+        return {**body, "url": url_public if is_admin else None}  # L’URL n’est renvoyée qu’à l’admin
+    except BaseException:
+        # 403, stockage ou insert en échec : la clé redevient libre pour un retry
+        await idempotency.release(db, idempotency.SCOPE_ATTACHMENT, idem)
+        raise
 
 @router.get("/admin/supabase_status")
 async def supabase_status():
@@ -1342,6 +2038,7 @@ async def reset_user(id: str = Query(..., alias="id"), db: AsyncSession = Depend
         except Exception:
             await db.execute(text("DELETE FROM reports WHERE user_id = :id::uuid"), {"id": id})
         await db.commit()
+        map_cache_invalidate_all()
         return {"ok": True}
     except Exception as e:
         await db.rollback()
@@ -1361,24 +2058,20 @@ async def admin_wipe_all(request: Request, truncate: bool = Query(False), db: As
             await db.execute(text("DELETE FROM incidents"))
             await db.execute(text("DELETE FROM outages"))
         await db.commit()
+        map_cache_invalidate_all()
         return {"ok": True}
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=f"wipe_all failed: {e}")
 
 @router.post("/admin/ensure_schema")
-async def admin_ensure_schema(db: AsyncSession = Depends(get_db)):
+async def admin_ensure_schema():
+    # le schéma appartient aux migrations versionnées (db/migrations, app/migrate.py)
     try:
-        await db.execute(text("ALTER TABLE incidents ADD COLUMN IF NOT EXISTS restored_at timestamp NULL"))
-        await db.execute(text("ALTER TABLE outages   ADD COLUMN IF NOT EXISTS restored_at timestamp NULL"))
-        await db.execute(text("CREATE INDEX IF NOT EXISTS idx_incidents_center ON incidents USING GIST ((center::geometry))"))
-        await db.execute(text("CREATE INDEX IF NOT EXISTS idx_outages_center   ON outages   USING GIST ((center::geometry))"))
-        await db.execute(text("CREATE INDEX IF NOT EXISTS idx_incidents_kind ON incidents(kind)"))
-        await db.execute(text("CREATE INDEX IF NOT EXISTS idx_outages_kind   ON outages(kind)"))
-        await db.commit()
-        return {"ok": True}
+        applied = await run_migrations()
+        await schema_registry.refresh()     # nouvelles colonnes / enums → variantes SQL reconstruites
+        return {"ok": True, "applied": applied}
     except Exception as e:
-        await db.rollback()
         raise HTTPException(status_code=500, detail=f"ensure_schema failed: {e}")
 
 @router.post("/admin/normalize_reports")
@@ -1417,6 +2110,7 @@ async def admin_seed_incident(p: AdminCreateIn, db: AsyncSession = Depends(get_d
             {"kind": p.kind, "lat": p.lat, "lng": p.lng, "started_at": p.started_at}
         )
         await db.commit()
+        map_cache_invalidate_point(p.lat, p.lng)
         return {"ok": True}
     except Exception as e:
         await db.rollback()
@@ -1434,6 +2128,7 @@ async def admin_seed_outage(p: AdminCreateIn, db: AsyncSession = Depends(get_db)
             {"kind": p.kind, "lat": p.lat, "lng": p.lng, "started_at": p.started_at}
         )
         await db.commit()
+        map_cache_invalidate_point(p.lat, p.lng)
         return {"ok": True}
     except Exception as e:
         await db.rollback()
@@ -1451,6 +2146,7 @@ async def admin_restore_near(p: AdminNearIn, db: AsyncSession = Depends(get_db))
             """), {"kind": p.kind, "lat": p.lat, "lng": p.lng, "r": p.radius_m}
         )
         await db.commit()
+        map_cache_invalidate_point(p.lat, p.lng, p.radius_m)
         return {"ok": True}
     except Exception as e:
         await db.rollback()
@@ -1468,6 +2164,7 @@ async def admin_unrestore_near(p: AdminNearIn, db: AsyncSession = Depends(get_db
             """), {"kind": p.kind, "lat": p.lat, "lng": p.lng, "r": p.radius_m}
         )
         await db.commit()
+        map_cache_invalidate_point(p.lat, p.lng, p.radius_m)
         return {"ok": True}
     except Exception as e:
         await db.rollback()
@@ -1485,6 +2182,7 @@ async def admin_delete_near(p: AdminNearIn, db: AsyncSession = Depends(get_db)):
             """), {"kind": p.kind, "lat": p.lat, "lng": p.lng, "r": p.radius_m}
         )
         await db.commit()
+        map_cache_invalidate_point(p.lat, p.lng, p.radius_m)
         return {"ok": True}
     except Exception as e:
         await db.rollback()
@@ -1505,6 +2203,7 @@ async def admin_purge_old_reports(days: int = Query(7, ge=1, le=365), db: AsyncS
     try:
         await db.execute(text("DELETE FROM reports WHERE created_at < NOW() - (:d || ' days')::interval"), {"d": days})
         await db.commit()
+        map_cache_invalidate_all()
         return {"ok": True}
     except Exception as e:
         await db.rollback()
@@ -1515,6 +2214,7 @@ async def admin_delete_report(id: int = Query(...), db: AsyncSession = Depends(g
     try:
         await db.execute(text("DELETE FROM reports WHERE id = :id"), {"id": id})
         await db.commit()
+        map_cache_invalidate_all()
         return {"ok": True}
     except Exception as e:
         await db.rollback()
@@ -1565,7 +2265,7 @@ async def admin_export_reports_csv(
     signal: str | None = None,        # 'cut'|'restored'
     min_lat: float | None = None, max_lat: float | None = None,
     min_lng: float | None = None, max_lng: float | None = None,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     if not _is_admin_req(request):
         raise HTTPException(status_code=401, detail="invalid admin token")
@@ -1627,7 +2327,7 @@ async def admin_export_events_csv(
     table: str | None = None,         # 'incidents'|'outages'|'both' (par défaut both)
     min_lat: float | None = None, max_lat: float | None = None,
     min_lng: float | None = None, max_lng: float | None = None,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     if not _is_admin_req(request):
         raise HTTPException(status_code=401, detail="invalid admin token")
@@ -1712,7 +2412,7 @@ async def admin_export_reports_geojson(
     min_lat: float | None = None, max_lat: float | None = None,
     min_lng: float | None = None, max_lng: float | None = None,
     limit: int = 200000,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     if not _is_admin_req(request):
         raise HTTPException(status_code=401, detail="invalid admin token")
@@ -1750,30 +2450,17 @@ async def admin_export_reports_geojson(
     res = await db.execute(q, params)
     rows = res.fetchall()
 
-    fc = {
-        "type": "FeatureCollection",
-        "features": []
-    }
-    for r in rows:
-        try:
-            geom = json.loads(r.geom_json)
-        except Exception:
-            continue
-        fc["features"].append({
-            "type": "Feature",
-            "geometry": geom,
-            "properties": {
-                "id": r.id,
-                "kind": r.kind,
-                "signal": r.signal,
-                "user_id": r.user_id,
-                "created_at": r.created_at.isoformat() if r.created_at else None,
-            }
+    feats = [
+        geojson_feature(r.geom_json, {
+            "id": r.id,
+            "kind": r.kind,
+            "signal": r.signal,
+            "user_id": r.user_id,
+            "created_at": r.created_at,
         })
-    buf = io.StringIO()
-    json.dump(fc, buf, ensure_ascii=False)
-    buf.seek(0)
-    return StreamingResponse(buf, media_type="application/geo+json",
+        for r in rows if r.geom_json
+    ]
+    return Response(content=geojson_collection(feats), media_type="application/geo+json",
         headers={"Content-Disposition": "attachment; filename=reports.geojson"})
 
 @router.get("/admin/export_events.geojson")
@@ -1787,7 +2474,7 @@ async def admin_export_events_geojson(
     min_lat: float | None = None, max_lat: float | None = None,
     min_lng: float | None = None, max_lng: float | None = None,
     limit: int = 200000,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     if not _is_admin_req(request):
         raise HTTPException(status_code=401, detail="invalid admin token")
@@ -1830,29 +2517,19 @@ async def admin_export_events_geojson(
         params["lim"] = limit
         res = await db.execute(sql, params)
         rows = res.fetchall()
-        for r in rows:
-            try:
-                geom = json.loads(r.geom_json)
-            except Exception:
-                continue
-            feats.append({
-                "type": "Feature",
-                "geometry": geom,
-                "properties": {
-                    "table": tname,
-                    "id": r.id,
-                    "kind": r.kind,
-                    "status": r.status,
-                    "started_at": r.started_at.isoformat() if r.started_at else None,
-                    "restored_at": r.restored_at.isoformat() if r.restored_at else None,
-                }
+        feats.extend(
+            geojson_feature(r.geom_json, {
+                "table": tname,
+                "id": r.id,
+                "kind": r.kind,
+                "status": r.status,
+                "started_at": r.started_at,
+                "restored_at": r.restored_at,
             })
+            for r in rows if r.geom_json
+        )
 
-    fc = {"type":"FeatureCollection","features":feats}
-    buf = io.StringIO()
-    json.dump(fc, buf, ensure_ascii=False)
-    buf.seek(0)
-    return StreamingResponse(buf, media_type="application/geo+json",
+    return Response(content=geojson_collection(feats), media_type="application/geo+json",
         headers={"Content-Disposition": "attachment; filename=events.geojson"})
 
 # --- Attachments près d'un point ---
@@ -1877,7 +2554,7 @@ async def attachments_near(
     ),
     debug: int = Query(0),
     request: Request = None,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     """
     Version stricte :
@@ -2019,7 +2696,7 @@ async def admin_export_aggregated_csv(
     date_from: str | None = None,
     date_to: str | None = None,
     kind: str | None = None,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     if not _is_admin_req(request):
         raise HTTPException(status_code=401, detail="invalid admin token")
@@ -2196,7 +2873,7 @@ async def alert_zones(
     hours: int = Query(int(os.getenv("ALERT_WINDOW_HOURS", "3")), ge=1, le=72),
     min_count: int = Query(int(os.getenv("ALERT_MIN_REPORTS", "3")), ge=2, le=50),
     cell_m: int = Query(int(os.getenv("ALERT_RADIUS_M", "150")), ge=50, le=1000),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     k = (kind or "").strip().lower()
     if k not in ALLOWED_KINDS:
@@ -2270,18 +2947,22 @@ async def alert_zones(
         "ack_r": float(cell_m),
     }
 
-    try:
+    async def run():
         rs = await db.execute(sql, params)
-        rows = rs.mappings().all()
+        return [
+            {"kind": r["kind"], "lat": float(r["lat"]), "lng": float(r["lng"]),
+             "radius_m": int(cell_m), "count": int(r["count"])}
+            for r in rs.mappings()
+        ]
+
+    try:
+        sf_key = (k, *singleflight.norm_point(lat, lng), float(radius_km), int(hours), int(min_count), int(cell_m))
+        zones = await _sf_alert_zones.do(sf_key, run)
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=f"alert_zones failed: {e}")
 
-    return [
-        {"kind": r["kind"], "lat": float(r["lat"]), "lng": float(r["lng"]),
-         "radius_m": int(cell_m), "count": int(r["count"])}
-        for r in rows
-    ]
+    return FastJSONResponse(zones)
 
 
 
@@ -2319,5 +3000,6 @@ async def fire_ack(
         await db.rollback()
         raise HTTPException(500, f"fire_ack failed: {e}")
 
+    map_cache_invalidate_point(p.lat, p.lng)
     return {"ok": True}
 
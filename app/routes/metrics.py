@@ -8,10 +8,23 @@ from fastapi import APIRouter, Depends, HTTPException, Request, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 
-from app.db import get_db
+from app.db import get_db, get_read_db, replica_usable, replica_status
+from app.services.map_cache import map_cache, tile_cache
+from app.services.map_snapshot import snapshot_stats
+from app.services.spatial_index import index_stats
+from app.services import singleflight
+from app.services.singleflight import singleflight_stats
+from app.services.report_queue import queue_stats
+from app.services import schema_registry
+from app.services.schema_registry import registry_status
+from app.services.idempotency import idempotency_stats
+from app.services.known_users import known_users_stats
 
 router = APIRouter(prefix="/metrics", tags=["Metrics"])
 
+# dashboards ouverts en parallèle → mêmes agrégats calculés une seule fois
+_sf_metrics = singleflight.group("metrics")
+
 # --- auth admin simple (x-admin-token) ---
 def _admin_token() -> str:
     return (os.getenv("ADMIN_TOKEN") or os.getenv("NEXT_PUBLIC_ADMIN_TOKEN") or "").strip()
@@ -29,7 +42,7 @@ async def require_admin(request: Request) -> bool:
 @router.get("/summary")
 async def metrics_summary(
     ok: bool = Depends(require_admin),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     hours: int = Query(24, ge=1, le=720),
 ):
     """
@@ -41,12 +54,33 @@ async def metrics_summary(
     """
     params = {"h": hours}
 
-    # total & par status
-    q_tot = text("""
-        SELECT COUNT(*)::int AS n_total,
-               COUNT(*) FILTER (WHERE COALESCE(status,'new')='new')::int AS n_new,
+    tot, rows_kind = await _sf_metrics.do(("summary", hours), _summary_rows, db, params)
+
+    # temps moyen jusqu'à 'resolved' (approx: on prend le dernier report resolved par (kind, zone ~200m))
+    # -> version simple: durée entre premier 'cut' et DERNIER 'resolved' par (same kind, 200m, 24h)
+    # Ici on donne une valeur indicative = non calculée finement (optionnel)
+    avg_min = None
+
+    return {
+        "window_h": hours,
+        "total": dict(tot),
+        "by_kind": rows_kind,
+        "avg_to_resolved_min": avg_min,
+        "server_now": datetime.now(timezone.utc).isoformat().replace("+00:00","Z"),
+    }
+
+
+async def _summary_rows(db: AsyncSession, params: Dict[str, Any]):
+    # total & par status (sans colonne status : tout est 'new')
+    if (await schema_registry.get(db)).has_column("reports", "status"):
+        by_status = """COUNT(*) FILTER (WHERE COALESCE(status,'new')='new')::int AS n_new,
                COUNT(*) FILTER (WHERE status='confirmed')::int AS n_confirmed,
-               COUNT(*) FILTER (WHERE status='resolved')::int AS n_resolved
+               COUNT(*) FILTER (WHERE status='resolved')::int AS n_resolved"""
+    else:
+        by_status = "COUNT(*)::int AS n_new, 0 AS n_confirmed, 0 AS n_resolved"
+    q_tot = text(f"""
+        SELECT COUNT(*)::int AS n_total,
+               {by_status}
           FROM reports
          WHERE created_at > NOW() - (:h || ' hours')::interval
     """)
@@ -61,25 +95,13 @@ async def metrics_summary(
          GROUP BY 1 ORDER BY 2 DESC
     """)
     rows_kind = (await db.execute(q_kind, params)).mappings().all()
-
-    # temps moyen jusqu'à 'resolved' (approx: on prend le dernier report resolved par (kind, zone ~200m))
-    # -> version simple: durée entre premier 'cut' et DERNIER 'resolved' par (same kind, 200m, 24h)
-    # Ici on donne une valeur indicative = non calculée finement (optionnel)
-    avg_min = None
-
-    return {
-        "window_h": hours,
-        "total": dict(tot),
-        "by_kind": rows_kind,
-        "avg_to_resolved_min": avg_min,
-        "server_now": datetime.now(timezone.utc).isoformat().replace("+00:00","Z"),
-    }
+    return tot, rows_kind
 
 
 @router.get("/incidents_by_day")
 async def metrics_incidents_by_day(
     ok: bool = Depends(require_admin),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     days: int = Query(30, ge=1, le=365),
     kind: Optional[str] = Query(None),
 ):
@@ -99,14 +121,17 @@ async def metrics_incidents_by_day(
            AND created_at >= NOW() - (:d || ' days')::interval
          GROUP BY 1 ORDER BY 1
     """)
-    rows = (await db.execute(q, params)).mappings().all()
+    async def run():
+        return (await db.execute(q, params)).mappings().all()
+
+    rows = await _sf_metrics.do(("incidents_by_day", days, kind), run)
     return {"days": days, "kind": kind, "series": rows}
 
 
 @router.get("/kind_breakdown")
 async def metrics_kind_breakdown(
     ok: bool = Depends(require_admin),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     days: int = Query(30, ge=1, le=365),
 ):
     """
@@ -118,5 +143,101 @@ async def metrics_kind_breakdown(
          WHERE created_at >= NOW() - (:d || ' days')::interval
          GROUP BY 1 ORDER BY 2 DESC
     """)
-    rows = (await db.execute(q, {"d": days})).mappings().all()
+    async def run():
+        return (await db.execute(q, {"d": days})).mappings().all()
+
+    rows = await _sf_metrics.do(("kind_breakdown", days), run)
     return {"days": days, "items": rows}
+
+
+@router.get("/map_cache")
+async def metrics_map_cache(
+    ok: bool = Depends(require_admin),
+):
+    """
+    Compteurs du cache /map (hits, misses, évictions LRU, expirations TTL, invalidations)
+    → pour dimensionner MAP_CACHE_MAX_ENTRIES / MAP_CACHE_TTL_S.
+    Les compteurs du cache des tuiles /tiles sont sous "tiles",
+    l'état du snapshot show_all sous "snapshot".
+    """
+    return {**map_cache.stats(), "tiles": tile_cache.stats(), "snapshot": snapshot_stats()}
+
+
+@router.get("/db_replica")
+async def metrics_db_replica(
+    ok: bool = Depends(require_admin),
+):
+    """
+    État du réplica de lecture (DATABASE_READ_URL) : retard mesuré, bascule
+    vers le primaire au-delà de REPLICA_MAX_LAG_S, compteurs de lectures.
+    """
+    await replica_usable()      # rafraîchit la mesure si elle est périmée
+    return replica_status()
+
+
+@router.get("/spatial_index")
+async def metrics_spatial_index(
+    ok: bool = Depends(require_admin),
+):
+    """
+    Index spatial mémoire (SPATIAL_INDEX_ENABLED) : tailles, notifications
+    reçues / appliquées, rechargements, divergences détectées, replis SQL.
+    """
+    return index_stats()
+
+
+@router.get("/singleflight")
+async def metrics_singleflight(
+    ok: bool = Depends(require_admin),
+):
+    """
+    Single-flight par groupe : executions = requêtes réellement envoyées à la base,
+    shared = requêtes servies par l'exécution d'une autre (exécutions économisées).
+    """
+    return singleflight_stats()
+
+
+@router.get("/schema")
+async def metrics_schema(
+    ok: bool = Depends(require_admin),
+):
+    """
+    Registre du schéma (services/schema_registry.py) : colonnes et enums
+    utilisés pour choisir les variantes SQL, version, date de chargement.
+    """
+    return registry_status()
+
+
+@router.get("/idempotency")
+async def metrics_idempotency(
+    ok: bool = Depends(require_admin),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Clés d'idempotence (services/idempotency.py) : clés en base, écritures en
+    cours, réponses rejouées (LRU ou base), clés libérées / purgées.
+    """
+    return await idempotency_stats(db)
+
+
+@router.get("/known_users")
+async def metrics_known_users(
+    ok: bool = Depends(require_admin),
+):
+    """
+    Cache des user_id connus (services/known_users.py) : hits = upserts
+    app_users évités, taille, préchauffage, reprises sur erreur FK.
+    """
+    return known_users_stats()
+
+
+@router.get("/ingest_queue")
+async def metrics_ingest_queue(
+    ok: bool = Depends(require_admin),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    File d'ingestion (REPORT_INGEST_MODE=queue) : profondeur, lettres mortes,
+    âge du plus ancien item en attente, délai enqueue → traitement (drain_lag_ms).
+    """
+    return await queue_stats(db)
@@ -1,10 +1,10 @@
 # app/routes/report_simple.py
 from typing import Any, Optional
 import json
+import uuid
 
 from fastapi import APIRouter, Body, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import text  # pour journaliser l'événement "created"
 
 # === Import get_db, tolérant ===
 try:
@@ -18,7 +18,7 @@ except Exception:
 
 # Cherche insert_report dans les modules probables
 _insert_report = None
-for path in ("app.services.reports", "app.core.reports", "app.db.reports", "app.reports"):
+for path in ("app.crud", "app.services.reports", "app.core.reports", "app.db.reports", "app.reports"):
     try:
         module = __import__(path, fromlist=["insert_report"])
         _insert_report = getattr(module, "insert_report", None)
@@ -30,8 +30,8 @@ if _insert_report is None:
     raise RuntimeError("Impossible d'importer insert_report. Corrige l'import ci-dessus.")
 insert_report = _insert_report
 
-# Hook d'intégrité (signature HMAC) après insertion
-from app.services.report_hooks import enrich_and_sign_report
+# Signature HMAC (intégrité), calculée avant l'insertion
+from app.services.report_hooks import report_signature
 
 # Essaie d'utiliser ton modèle ReportIn ; sinon, fallback Pydantic
 ReportIn = None
@@ -108,40 +108,37 @@ async def create_report(payload: Any = Body(...), db: AsyncSession = Depends(get
     kind = _normalize_enum_or_str(getattr(data, "kind", None))
     signal = _normalize_enum_or_str(getattr(data, "signal", None))
 
-    # 4) Insertion + signature + journal "created"
+    # 4) Id pré-généré → signature calculée avant l'insert ; report + signature
+    #    + journal "created" écrits en une requête, un commit (crud.insert_report)
+    rid = str(uuid.uuid4())
+    lat = float(getattr(data, "lat"))
+    lng = float(getattr(data, "lng"))
+    accuracy_m = int(getattr(data, "accuracy_m", 0)) if getattr(data, "accuracy_m", None) is not None else None
+    photo_url = getattr(data, "photo_url", None)
+    user_id = getattr(data, "user_id", None)
+    device_id = getattr(data, "device_id", None)
+    sig = report_signature(
+        rid, kind=kind, signal=signal, lat=lat, lng=lng,
+        device_id=device_id, accuracy_m=accuracy_m, photo_url=photo_url, user_id=user_id,
+    )
     try:
         rid = await insert_report(
             db,
             kind=kind,
             signal=signal,
-            lat=float(getattr(data, "lat")),
-            lng=float(getattr(data, "lng")),
-            accuracy_m=int(getattr(data, "accuracy_m", 0)) if getattr(data, "accuracy_m", None) is not None else None,
+            lat=lat,
+            lng=lng,
+            accuracy_m=accuracy_m,
             note=getattr(data, "note", None),
-            photo_url=getattr(data, "photo_url", None),
-            user_id=getattr(data, "user_id", None),
+            photo_url=photo_url,
+            user_id=user_id,
             idempotency_key=getattr(data, "idempotency_key", None),
-            device_id=getattr(data, "device_id", None),  # ✅ passe device_id si ton insert le supporte
+            device_id=device_id,
+            report_id=rid,
+            signature=sig,
+            log_event="created",
         )
 
-        # 4b) Signature HMAC (intégrité)
-        await enrich_and_sign_report(
-            db, rid,
-            kind=kind, signal=signal,
-            lat=float(getattr(data, "lat")), lng=float(getattr(data, "lng")),
-            device_id=getattr(data, "device_id", None),
-            accuracy_m=int(getattr(data, "accuracy_m", 0)) if getattr(data, "accuracy_m", None) is not None else None,
-            photo_url=getattr(data, "photo_url", None),
-            user_id=getattr(data, "user_id", None),
-        )
-
-        # 4c) Journaliser l'événement "created"
-        await db.execute(
-            text("INSERT INTO report_events (report_id, event) VALUES (CAST(:rid AS uuid), 'created')"),
-            {"rid": rid},
-        )
-        await db.commit()
-
         return {"ok": True, "id": rid, "idempotency_key": getattr(data, "idempotency_key", None)}
     except HTTPException:
         raise
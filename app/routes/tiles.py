@@ -0,0 +1,159 @@
+# app/routes/tiles.py
+"""
+Tuiles vectorielles (Mapbox Vector Tile) pour la carte :
+
+    GET /tiles/{z}/{x}/{y}.mvt
+
+Une couche par type, mêmes tables / mêmes champs que /map :
+  - outages      (outages.center)   id, kind, status, started_at, restored_at, compteurs
+  - incidents    (incidents.center) idem
+  - reports      (reports.geom)     pins 'cut' des POINTS_WINDOW_MIN dernières minutes
+  - alert_zones  clusters DBSCAN de fetch_alert_zones (à partir de TILE_ZONES_MIN_ZOOM)
+
+Le client ne charge que les tuiles à l'écran ; chaque tuile est mise en cache
+par (z, x, y) dans app/services/map_cache.py (invalidée par les écritures).
+"""
+import math
+import os
+import time
+
+from fastapi import APIRouter, Depends, HTTPException, Path, Response
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import get_read_db
+from app.routes.map import POINTS_WINDOW_MIN, fetch_alert_zones, _begin_read_only
+from app.services.map_cache import TILE_CACHE_ENABLED, tile_cache, haversine_m
+
+router = APIRouter()
+
+TILE_EXTENT          = int(os.getenv("TILE_EXTENT", "4096"))
+TILE_BUFFER          = int(os.getenv("TILE_BUFFER", "64"))
+TILE_MAX_AGE_S       = int(os.getenv("TILE_MAX_AGE_S", "30"))          # Cache-Control côté client/CDN
+TILE_RESTORED_KEEP_H = int(os.getenv("TILE_RESTORED_KEEP_H", "24"))    # évènements clos encore affichés
+TILE_ZONES_MIN_ZOOM  = int(os.getenv("TILE_ZONES_MIN_ZOOM", "10"))     # DBSCAN trop large en dessous
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+
+def tile_bbox(z: int, x: int, y: int):
+    """(min_lat, min_lng, max_lat, max_lng) de la tuile XYZ (Web Mercator)."""
+    n = 2 ** z
+
+    def lat_of(yy):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * yy / n))))
+
+    return lat_of(y + 1), x / n * 360.0 - 180.0, lat_of(y), (x + 1) / n * 360.0 - 180.0
+
+
+def _events_layer(table: str, alias: str) -> str:
+    return f"""
+        {alias} AS (
+          SELECT ST_AsMVTGeom(ST_Transform((e.center::geometry), 3857), b.g3857, {TILE_EXTENT}, {TILE_BUFFER}, true) AS geom,
+                 e.id::text   AS id,
+                 e.kind::text AS kind,
+                 CASE WHEN e.restored_at IS NULL THEN 'active' ELSE 'restored' END AS status,
+                 e.started_at::text  AS started_at,
+                 e.restored_at::text AS restored_at,
+                 COALESCE(e.attachments_count, 0)::int AS attachments_count,
+                 COALESCE(e.reports_count, 0)::int     AS reports_count
+            FROM {table} e, bounds b
+           WHERE (e.center::geometry) && b.g4326
+             AND (e.restored_at IS NULL
+                  OR e.restored_at > NOW() - INTERVAL '{TILE_RESTORED_KEEP_H} hours')
+        )"""
+
+
+TILE_SQL = f"""
+    WITH bounds AS (
+      SELECT ST_TileEnvelope(:z, :x, :y) AS g3857,
+             ST_Transform(ST_TileEnvelope(:z, :x, :y), 4326) AS g4326
+    ),
+    {_events_layer("outages", "lo")},
+    {_events_layer("incidents", "li")},
+    lr AS (
+      SELECT ST_AsMVTGeom(ST_Transform((r.geom::geometry), 3857), b.g3857, {TILE_EXTENT}, {TILE_BUFFER}, true) AS geom,
+             r.id::text     AS id,
+             r.kind::text   AS kind,
+             r.signal::text AS signal,
+             r.created_at::text AS created_at
+        FROM reports r, bounds b
+       WHERE (r.geom::geometry) && b.g4326
+         AND LOWER(TRIM(r.signal::text)) = 'cut'
+         AND r.created_at > NOW() - INTERVAL '{POINTS_WINDOW_MIN} minutes'
+    ),
+    lz AS (
+      SELECT ST_AsMVTGeom(ST_Transform(ST_SetSRID(ST_MakePoint(z.lng, z.lat), 4326), 3857), b.g3857, {TILE_EXTENT}, {TILE_BUFFER}, true) AS geom,
+             z.kind,
+             z.cnt AS count
+        FROM unnest(CAST(:zk AS text[]), CAST(:zn AS int[]), CAST(:zlat AS float8[]), CAST(:zlng AS float8[]))
+             AS z(kind, cnt, lat, lng),
+             bounds b
+    )
+    SELECT COALESCE((SELECT ST_AsMVT(lo, 'outages',     {TILE_EXTENT}, 'geom') FROM lo), ''::bytea)
+        || COALESCE((SELECT ST_AsMVT(li, 'incidents',   {TILE_EXTENT}, 'geom') FROM li), ''::bytea)
+        || COALESCE((SELECT ST_AsMVT(lr, 'reports',     {TILE_EXTENT}, 'geom') FROM lr), ''::bytea)
+        || COALESCE((SELECT ST_AsMVT(lz, 'alert_zones', {TILE_EXTENT}, 'geom') FROM lz), ''::bytea)
+       AS tile
+"""
+
+
+@router.get("/tiles/{z}/{x}/{y}.mvt")
+async def get_tile(
+    z: int = Path(..., ge=0, le=22),
+    x: int = Path(..., ge=0),
+    y: int = Path(..., ge=0),
+    db: AsyncSession = Depends(get_read_db),
+):
+    n = 2 ** z
+    if x >= n or y >= n:
+        raise HTTPException(status_code=400, detail="tile out of range")
+
+    key = (z, x, y)
+    tile = tile_cache.get(key) if TILE_CACHE_ENABLED else None
+    state = "HIT" if tile is not None else ("MISS" if TILE_CACHE_ENABLED else "BYPASS")
+
+    if tile is None:
+        t0 = time.perf_counter()
+        min_lat, min_lng, max_lat, max_lng = tile_bbox(z, x, y)
+        try:
+            await _begin_read_only(db)
+
+            # zones d'alerte : même calcul que /map, sur le disque englobant la tuile
+            zones = []
+            if z >= TILE_ZONES_MIN_ZOOM:
+                c_lat, c_lng = (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+                r_m = haversine_m(min_lat, min_lng, max_lat, max_lng) / 2.0
+                zones = [
+                    zz for zz in await fetch_alert_zones(db, c_lat, c_lng, r_m)
+                    if min_lat <= zz["lat"] <= max_lat and min_lng <= zz["lng"] <= max_lng
+                ]
+
+            res = await db.execute(text(TILE_SQL), {
+                "z": z, "x": x, "y": y,
+                "zk":   [zz["kind"] for zz in zones],
+                "zn":   [zz["count"] for zz in zones],
+                "zlat": [zz["lat"] for zz in zones],
+                "zlng": [zz["lng"] for zz in zones],
+            })
+            tile = bytes(res.scalar() or b"")
+        except Exception as e:
+            await db.rollback()
+            print(f"⚠️ /tiles/{z}/{x}/{y} error: {e}")
+            raise HTTPException(status_code=500, detail="tile_error")
+
+        if TILE_CACHE_ENABLED:
+            tile_cache.set(key, tile, (min_lat, min_lng, max_lat, max_lng))
+        dur = (time.perf_counter() - t0) * 1000.0
+    else:
+        dur = 0.0
+
+    return Response(
+        content=tile,
+        media_type=MVT_MEDIA_TYPE,
+        headers={
+            "Cache-Control": f"public, max-age={TILE_MAX_AGE_S}",
+            "X-Tile-Cache": state,
+            "Server-Timing": f"tile;dur={dur:.1f}",
+        },
+    )
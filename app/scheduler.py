@@ -3,7 +3,7 @@ import asyncio, os
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from app.db import SessionLocal
-from app.services.aggregation import run_aggregation
+from app.services.aggregation import run_aggregation, run_auto_expire, AUTO_EXPIRE_INTERVAL_S
 
 scheduler: AsyncIOScheduler | None = None
 
@@ -12,6 +12,10 @@ async def _tick():
     async with SessionLocal() as db:
         await run_aggregation(db)
 
+async def _expire_tick():
+    async with SessionLocal() as db:
+        await run_auto_expire(db)
+
 def start_scheduler():
     global scheduler
     if scheduler and scheduler.running:
@@ -25,6 +29,10 @@ def start_scheduler():
     scheduler.add_job(lambda: asyncio.create_task(_tick()),
                       trigger=IntervalTrigger(seconds=60),
                       id="awo_aggregator", replace_existing=True)
+    # auto-clôture (lecture /map sans écriture)
+    scheduler.add_job(lambda: asyncio.create_task(_expire_tick()),
+                      trigger=IntervalTrigger(seconds=AUTO_EXPIRE_INTERVAL_S),
+                      id="awo_expire", replace_existing=True)
     scheduler.start()
     return scheduler
 
@@ -3,6 +3,9 @@ import os
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.crud import expire_stale_outages, expire_incidents
+from app.services.map_cache import invalidate_all as map_cache_invalidate_all
+from app.services.event_counters import refresh_event_counters
+from app.services.map_sync import purge_tombstones
 
 # -------- Parameters (override via env if needed) ----------
 LOG_AGG = os.getenv("LOG_AGG", "0") == "1"
@@ -23,6 +26,49 @@ COOLDOWN_AFTER_RESTORE_MIN = int(os.getenv("OUTAGE_COOLDOWN_MIN", "5"))
 # NEW: auto-expire active incidents/outages after N hours (strict)
 AUTO_EXPIRE_HOURS = int(os.getenv("AUTO_EXPIRE_HOURS", "6"))
 
+# Auto-close stage formerly run by GET /map (same env vars, same semantics)
+AUTO_EXPIRE_H = int(os.getenv("AUTO_EXPIRE_H", "6"))
+AUTO_EXPIRE_INTERVAL_S = int(os.getenv("AUTO_EXPIRE_INTERVAL_S", "60"))
+
+
+def auto_expire_enabled() -> bool:
+    return os.getenv("AUTO_EXPIRE_ENABLED", "1") != "0"
+
+
+async def run_auto_expire(db: AsyncSession) -> int:
+    """Close incidents/outages started more than AUTO_EXPIRE_H hours ago.
+    Runs as its own scheduler job so that /map stays strictly read-only.
+    Returns the number of closed rows (0 when AUTO_EXPIRE_ENABLED=0).
+    """
+    if not auto_expire_enabled():
+        return 0
+    try:
+        res_i = await db.execute(text(f"""
+            UPDATE incidents
+               SET restored_at = COALESCE(restored_at, NOW())
+             WHERE restored_at IS NULL
+               AND started_at  < NOW() - INTERVAL '{AUTO_EXPIRE_H} hours'
+        """))
+        res_o = await db.execute(text(f"""
+            UPDATE outages
+               SET restored_at = COALESCE(restored_at, NOW())
+             WHERE restored_at IS NULL
+               AND started_at  < NOW() - INTERVAL '{AUTO_EXPIRE_H} hours'
+        """))
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        if LOG_AGG:
+            print(f"[expire] error: {e}")
+        return 0
+
+    n = (res_i.rowcount or 0) + (res_o.rowcount or 0)
+    if LOG_AGG:
+        print(f"[expire] incidents -> {res_i.rowcount or 0}, outages -> {res_o.rowcount or 0}")
+    if n:
+        map_cache_invalidate_all()
+    return n
+
 async def run_aggregation(db: AsyncSession) -> None:
     """Rebuild active outages from recent CUT reports and strictly close them when:
       - a RESTORED report is seen near the zone, OR
@@ -30,11 +76,7 @@ async def run_aggregation(db: AsyncSession) -> None:
     Also expire incidents/outages after AUTO_EXPIRE_HOURS and via crud helpers when enabled.
     """
 
-    # 0) Safety: ensure columns
-    await db.execute(text("ALTER TABLE outages  ADD COLUMN IF NOT EXISTS started_at timestamp NULL"))
-    await db.execute(text("ALTER TABLE outages  ADD COLUMN IF NOT EXISTS restored_at timestamp NULL"))
-    await db.execute(text("ALTER TABLE incidents ADD COLUMN IF NOT EXISTS restored_at timestamp NULL"))
-    await db.commit()
+    # 0) Schéma : géré par les migrations (db/migrations, app/migrate.py)
 
     # 0-bis) STRICT AUTO-EXPIRATION after N hours (default 6h)
     try:
@@ -164,3 +206,16 @@ async def run_aggregation(db: AsyncSession) -> None:
     if LOG_AGG:
         if c1 is not None: print(f"[agg] expire_stale_outages -> {c1}")
         if c2 is not None: print(f"[agg] expire_incidents -> {c2}")
+
+    # 5-bis) Compteurs maintenus (attachments/reports) : glissement des fenêtres
+    await refresh_event_counters(db)
+
+    # 5-ter) Tombstones de /map?since= au-delà de la durée de vie d'un curseur
+    try:
+        await purge_tombstones(db)
+    except Exception as e:
+        await db.rollback()
+        if LOG_AGG: print(f"[agg] purge tombstones error: {e}")
+
+    # 6) Les zones ont pu bouger partout → on vide le cache /map
+    map_cache_invalidate_all()
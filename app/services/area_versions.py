@@ -0,0 +1,90 @@
+# app/services/area_versions.py
+"""
+Versions par zone pour l'ETag de GET /map.
+
+- area_versions(cell, version) : une ligne par cellule geohash
+  (précision MAP_ETAG_PRECISION)
+- triggers (db/migrations/0004_area_versions.sql) sur outages / incidents /
+  reports / acks : toute écriture
+  (INSERT / UPDATE / DELETE) incrémente la version de sa cellule
+  (les deux cellules si le point a bougé)
+- /map calcule un ETag fort à partir des versions des cellules couvertes
+  par le disque demandé + paramètres + tranche de temps (les fenêtres
+  glissantes « reports des N dernières minutes » changent sans écriture)
+  → If-None-Match identique : 304 sans lancer les requêtes lourdes
+- show_all (évènements seulement) : pas de ligne globale (verrou chaud partagé
+  par toutes les écritures, migration 0009) → max(updated_at) de outages /
+  incidents + dernier tombstone (index, migration 0003). Une transaction
+  commitée après une autre plus récente peut garder l'ETag inchangé : 304
+  périmé borné par la tranche MAP_ETAG_BUCKET_S
+"""
+import hashlib
+import math
+import os
+import time
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.compression import base_etag
+from app.services import geohash
+
+MAP_ETAG_ENABLED   = os.getenv("MAP_ETAG_ENABLED", "1") != "0"
+MAP_ETAG_PRECISION = 5      # ≈4.9 km x 4.9 km — figée dans le trigger (migration 0004)
+MAP_ETAG_BUCKET_S  = int(os.getenv("MAP_ETAG_BUCKET_S", "60"))      # fenêtres glissantes
+# marge autour du disque : fusion outage/incident (≤350 m), compteurs (120 m)
+MAP_ETAG_MARGIN_M  = float(os.getenv("MAP_ETAG_MARGIN_M", "500"))
+
+_SHOW_ALL_SQL = text("""
+    SELECT (SELECT MAX(updated_at) FROM outages)   AS o,
+           (SELECT MAX(updated_at) FROM incidents) AS i,
+           (SELECT MAX(deleted_at) FROM map_tombstones WHERE tbl = 'outages')   AS od,
+           (SELECT MAX(deleted_at) FROM map_tombstones WHERE tbl = 'incidents') AS id_
+""")
+
+
+def covered_cells(lat: float, lng: float, r_m: float, show_all: bool) -> Optional[list]:
+    """Cellules couvertes par la requête /map (None → pas d'ETag possible, zone trop grande)."""
+    if show_all:
+        return []       # show_all : versions dérivées des évènements (map_etag)
+    r = r_m + MAP_ETAG_MARGIN_M
+    d_lat = r / 111_320.0
+    d_lng = d_lat / max(0.01, math.cos(math.radians(lat)))
+    return geohash.cover(
+        max(-90.0, lat - d_lat), max(-180.0, lng - d_lng),
+        min(90.0, lat + d_lat), min(179.999999, lng + d_lng),
+        MAP_ETAG_PRECISION,
+    )
+
+
+async def map_etag(db: AsyncSession, lat: float, lng: float, r_m: float, show_all: bool) -> Optional[str]:
+    """ETag fort de la réponse /map pour ces paramètres (1 lecture par clé primaire)."""
+    bucket = int(time.time() // MAP_ETAG_BUCKET_S)
+    if show_all:
+        row = (await db.execute(_SHOW_ALL_SQL)).first()
+        raw = f"{lat:.6f}|{lng:.6f}|{r_m:.1f}|all|{row.o}|{row.i}|{row.od}|{row.id_}|{bucket}"
+        return '"m-' + hashlib.sha1(raw.encode()).hexdigest()[:20] + '"'
+    cells = covered_cells(lat, lng, r_m, show_all)
+    if not cells:
+        return None
+    res = await db.execute(text("""
+        SELECT COALESCE(SUM(version), 0)::bigint AS v,
+               COUNT(*)::int                     AS n,
+               MAX(updated_at)                   AS t
+          FROM area_versions
+         WHERE cell = ANY(:cells)
+    """), {"cells": cells})
+    row = res.first()
+    # versions monotones → la somme change à chaque écriture dans la zone
+    raw = f"{lat:.6f}|{lng:.6f}|{r_m:.1f}|{int(show_all)}|{row.v}|{row.n}|{row.t}|{bucket}"
+    return '"m-' + hashlib.sha1(raw.encode()).hexdigest()[:20] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # comparaison faible, au codage près : la compression (app/compression.py)
+    # suffixe l'ETag de la représentation compressée ("v" → "v-br")
+    tags = [base_etag(t) for t in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
@@ -0,0 +1,159 @@
+# app/services/event_counters.py
+"""
+Compteurs maintenus sur outages / incidents :
+  attachments_count, reports_count, first_report_at, last_report_at
+
+Avant : deux LEFT JOIN LATERAL (COUNT + ST_DWithin 120 m) par ligne à chaque
+lecture de /map → 4000 scans spatiaux pour un show_all de 2000 évènements.
+Maintenant :
+  - incrément à l'écriture (report 'cut', upload) — best effort
+  - recalcul ensembliste à chaque tick d'agrégation (glissement des fenêtres
+    + rattrapage des incréments manqués / suppressions admin)
+  - la lecture devient un simple fetch de colonnes
+"""
+import json
+import os
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+LOG_AGG = os.getenv("LOG_AGG", "0") == "1"
+
+# mêmes fenêtres / rayon que l'ancien calcul à la volée de /map
+POINTS_WINDOW_MIN     = int(os.getenv("POINTS_WINDOW_MIN", "240"))
+ATTACH_WINDOW_H       = int(os.getenv("ATTACH_WINDOW_H", "48"))
+COUNTERS_MATCH_M      = int(os.getenv("COUNTERS_MATCH_M", "120"))
+# évènements clos récemment : leurs compteurs continuent de glisser
+COUNTERS_RESTORED_KEEP_H = int(os.getenv("COUNTERS_RESTORED_KEEP_H", "48"))
+
+EVENT_TABLES = ("outages", "incidents")
+
+
+def event_table(kind: str) -> str:
+    return "outages" if kind in ("power", "water") else "incidents"
+
+
+async def bump_reports_count(db: AsyncSession, kind: str, lat: float, lng: float) -> int:
+    """Nouveau report 'cut' en (lat, lng) → +1 sur les évènements du même type à ≤120 m.
+    Ne commit pas : à appeler dans la transaction de l'écriture."""
+    res = await db.execute(text(f"""
+        WITH me AS (SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g)
+        UPDATE {event_table(kind)} e
+           SET reports_count   = COALESCE(e.reports_count, 0) + 1,
+               first_report_at = COALESCE(e.first_report_at, NOW()),
+               last_report_at  = NOW()
+         WHERE e.kind::text = :kind
+           AND ST_DWithin((e.center::geography), (SELECT g FROM me), {COUNTERS_MATCH_M})
+    """), {"kind": kind, "lat": float(lat), "lng": float(lng)})
+    return res.rowcount or 0
+
+
+async def bump_reports_count_many(db: AsyncSession, points: list) -> int:
+    """Version ensembliste de bump_reports_count (POST /reports/batch) :
+    points = [{"kind", "lat", "lng"}, …] → +n sur chaque évènement à ≤120 m de n points.
+    Une requête par table d'évènements. Ne commit pas."""
+    n = 0
+    for table in EVENT_TABLES:
+        pts = [p for p in points if event_table(p["kind"]) == table]
+        if not pts:
+            continue
+        res = await db.execute(text(f"""
+            WITH pts AS (
+              SELECT x.kind, ST_SetSRID(ST_MakePoint(x.lng, x.lat),4326)::geography AS g
+                FROM jsonb_to_recordset(CAST(:pts AS jsonb)) AS x(kind text, lat float8, lng float8)
+            ),
+            hits AS (
+              SELECT e.id, COUNT(*)::int AS n
+                FROM {table} e
+                JOIN pts p ON e.kind::text = p.kind
+                          AND ST_DWithin((e.center::geography), p.g, {COUNTERS_MATCH_M})
+               GROUP BY e.id
+            )
+            UPDATE {table} e
+               SET reports_count   = COALESCE(e.reports_count, 0) + h.n,
+                   first_report_at = COALESCE(e.first_report_at, NOW()),
+                   last_report_at  = NOW()
+              FROM hits h
+             WHERE e.id = h.id
+        """), {"pts": json.dumps([{"kind": p["kind"], "lat": float(p["lat"]), "lng": float(p["lng"])}
+                                  for p in pts])})
+        n += res.rowcount or 0
+    return n
+
+
+async def bump_attachments_count(db: AsyncSession, kind: str, lat: float, lng: float) -> int:
+    """Nouvelle pièce jointe en (lat, lng) → +1 sur les évènements du même type à ≤120 m."""
+    res = await db.execute(text(f"""
+        WITH me AS (SELECT ST_SetSRID(ST_MakePoint(:lng,:lat),4326)::geography AS g)
+        UPDATE {event_table(kind)} e
+           SET attachments_count = COALESCE(e.attachments_count, 0) + 1
+         WHERE e.kind::text = :kind
+           AND ST_DWithin((e.center::geography), (SELECT g FROM me), {COUNTERS_MATCH_M})
+    """), {"kind": kind, "lat": float(lat), "lng": float(lng)})
+    return res.rowcount or 0
+
+
+def _refresh_sql(table: str) -> str:
+    # Recalcul ensembliste limité aux évènements dont les compteurs peuvent bouger :
+    # actifs, clos récemment, ou encore non nuls (→ retombent à 0 quand la fenêtre glisse).
+    # first/last_report_at sont « à vie » : on ne fait que les élargir.
+    return f"""
+        WITH cand AS (
+          SELECT e.id, e.kind::text AS kind, (e.center::geography) AS g
+            FROM {table} e
+           WHERE e.restored_at IS NULL
+              OR e.restored_at > NOW() - INTERVAL '{COUNTERS_RESTORED_KEEP_H} hours'
+              OR COALESCE(e.reports_count, 0) > 0
+              OR COALESCE(e.attachments_count, 0) > 0
+        ),
+        calc AS (
+          SELECT c.id,
+                 (SELECT COUNT(*)::int
+                    FROM attachments a
+                   WHERE a.kind::text = c.kind
+                     AND a.created_at > NOW() - INTERVAL '{ATTACH_WINDOW_H} hours'
+                     AND ST_DWithin((a.geom::geography), c.g, {COUNTERS_MATCH_M})) AS att,
+                 r.cnt AS rep, r.first_at, r.last_at
+            FROM cand c
+            CROSS JOIN LATERAL (
+              SELECT COUNT(*)::int AS cnt,
+                     MIN(r.created_at) AS first_at,
+                     MAX(r.created_at) AS last_at
+                FROM reports r
+               WHERE LOWER(TRIM(r.signal::text))='cut'
+                 AND r.created_at > NOW() - INTERVAL '{POINTS_WINDOW_MIN} minutes'
+                 AND r.kind::text = c.kind
+                 AND ST_DWithin((r.geom::geography), c.g, {COUNTERS_MATCH_M})
+            ) r
+        )
+        UPDATE {table} e
+           SET attachments_count = calc.att,
+               reports_count     = calc.rep,
+               first_report_at   = LEAST(e.first_report_at, calc.first_at),
+               last_report_at    = GREATEST(e.last_report_at, calc.last_at)
+          FROM calc
+         WHERE e.id = calc.id
+           AND (e.attachments_count, e.reports_count, e.first_report_at, e.last_report_at)
+               IS DISTINCT FROM
+               (calc.att, calc.rep,
+                LEAST(e.first_report_at, calc.first_at),
+                GREATEST(e.last_report_at, calc.last_at))
+    """
+
+
+async def refresh_event_counters(db: AsyncSession) -> int:
+    """Glissement des fenêtres : recalcule les compteurs des évènements concernés.
+    Retourne le nombre de lignes réellement modifiées."""
+    n = 0
+    try:
+        for t in EVENT_TABLES:
+            res = await db.execute(text(_refresh_sql(t)))
+            n += res.rowcount or 0
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        print(f"[counters] refresh error: {e}")
+        return 0
+    if LOG_AGG:
+        print(f"[counters] refreshed -> {n}")
+    return n
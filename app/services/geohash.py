@@ -0,0 +1,88 @@
+# app/services/geohash.py
+"""
+Geohash minimal (encode / bbox / centre) — sans dépendance externe.
+Sert à découper la carte en cellules stables (cache /map, versions de zone…).
+"""
+from typing import List, Optional, Tuple
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODE = {c: i for i, c in enumerate(_BASE32)}
+
+
+def encode(lat: float, lng: float, precision: int = 6) -> str:
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    out = []
+    bit, ch, even = 0, 0, True
+    while len(out) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                ch |= 1 << (4 - bit)
+                lng_lo = mid
+            else:
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                ch |= 1 << (4 - bit)
+                lat_lo = mid
+            else:
+                lat_hi = mid
+        even = not even
+        if bit < 4:
+            bit += 1
+        else:
+            out.append(_BASE32[ch])
+            bit, ch = 0, 0
+    return "".join(out)
+
+
+def bbox(gh: str) -> Tuple[float, float, float, float]:
+    """(min_lat, min_lng, max_lat, max_lng) de la cellule."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    even = True
+    for c in gh:
+        v = _DECODE[c]
+        for shift in (4, 3, 2, 1, 0):
+            b = (v >> shift) & 1
+            if even:
+                mid = (lng_lo + lng_hi) / 2
+                if b:
+                    lng_lo = mid
+                else:
+                    lng_hi = mid
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                if b:
+                    lat_lo = mid
+                else:
+                    lat_hi = mid
+            even = not even
+    return lat_lo, lng_lo, lat_hi, lng_hi
+
+
+def center(gh: str) -> Tuple[float, float]:
+    lat_lo, lng_lo, lat_hi, lng_hi = bbox(gh)
+    return (lat_lo + lat_hi) / 2, (lng_lo + lng_hi) / 2
+
+
+def cover(min_lat: float, min_lng: float, max_lat: float, max_lng: float,
+          precision: int = 5, max_cells: int = 4096) -> Optional[List[str]]:
+    """Cellules de `precision` qui recouvrent la bbox (None si plus de max_cells)."""
+    c_lat_lo, c_lng_lo, c_lat_hi, c_lng_hi = bbox(encode(min_lat, min_lng, precision))
+    h, w = c_lat_hi - c_lat_lo, c_lng_hi - c_lng_lo
+    n_lat = int((max_lat - c_lat_lo) // h) + 1
+    n_lng = int((max_lng - c_lng_lo) // w) + 1
+    if n_lat * n_lng > max_cells:
+        return None
+    out = set()
+    for i in range(n_lat):
+        lat = min(89.999999, c_lat_lo + (i + 0.5) * h)
+        for j in range(n_lng):
+            lng = c_lng_lo + (j + 0.5) * w
+            if lng >= 180.0:
+                lng -= 360.0
+            out.add(encode(lat, lng, precision))
+    return sorted(out)
@@ -0,0 +1,173 @@
+# app/services/idempotency.py
+"""
+Clés d'idempotence des écritures (table idempotency_keys, migration 0007).
+
+Avant : NOT EXISTS sur reports.idempotency_key / SELECT sur attachments puis
+INSERT → deux retries simultanés passaient tous les deux, et le retry
+recevait une réponse différente (id None).
+Maintenant :
+  - prise de clé = INSERT … ON CONFLICT sur la clé primaire (scope, key) :
+    un seul gagnant, les autres lisent la réponse d'origine
+  - POST /report : prise + réponse écrites dans la CTE de l'insert (même
+    transaction, pas d'état intermédiaire)
+  - uploads (stockage lent entre prise et insert) : clé « en cours » commitée
+    tout de suite → un retry concurrent reçoit 409 ; échec → clé libérée ;
+    bail IDEMPOTENCY_INFLIGHT_S si le process meurt en route
+  - LRU local des réponses terminées (immuables) → un retry récent ne touche
+    pas la base
+  - purge au-delà de IDEMPOTENCY_TTL_H (job du scheduler)
+
+/reports/batch et la file (report_queue) prennent aussi leurs clés ici, dans
+l'INSERT du lot (services/ingest.py) ; un item de file complète la clé 202
+posée à l'enqueue pour son propre id.
+"""
+import json
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.services.map_cache import LRUTTLCache
+
+IDEMPOTENCY_TTL_H            = int(os.getenv("IDEMPOTENCY_TTL_H", "48"))
+IDEMPOTENCY_INFLIGHT_S       = int(os.getenv("IDEMPOTENCY_INFLIGHT_S", "120"))
+IDEMPOTENCY_LRU_SIZE         = int(os.getenv("IDEMPOTENCY_LRU_SIZE", "10000"))
+IDEMPOTENCY_LRU_TTL_S        = float(os.getenv("IDEMPOTENCY_LRU_TTL_S", "600"))
+IDEMPOTENCY_PURGE_INTERVAL_S = int(os.getenv("IDEMPOTENCY_PURGE_INTERVAL_S", "3600"))
+
+SCOPE_REPORT = "report"
+SCOPE_ATTACHMENT = "attachment"
+
+# (status_code, body) ; status_code None = écriture encore en cours ailleurs
+Previous = Tuple[Optional[int], Optional[Dict[str, Any]]]
+
+_recent = LRUTTLCache(IDEMPOTENCY_LRU_SIZE, IDEMPOTENCY_LRU_TTL_S)
+_stats: Dict[str, Any] = {
+    "claimed": 0, "replayed": 0, "in_flight": 0, "released": 0, "purged": 0,
+}
+
+_CLAIM_SQL = text(f"""
+    INSERT INTO idempotency_keys(scope, key) VALUES (:scope, :key)
+    ON CONFLICT (scope, key) DO UPDATE
+       SET created_at = NOW()
+     -- reprise d'une clé abandonnée (process mort entre prise et fin)
+     WHERE idempotency_keys.completed_at IS NULL
+       AND idempotency_keys.created_at < NOW() - INTERVAL '{IDEMPOTENCY_INFLIGHT_S} seconds'
+    RETURNING key
+""")
+
+_LOOKUP_SQL = text("""
+    SELECT status_code, response FROM idempotency_keys WHERE scope = :scope AND key = :key
+""")
+
+
+def _as_dict(v: Any) -> Optional[Dict[str, Any]]:
+    return v if (v is None or isinstance(v, dict)) else json.loads(v)
+
+
+def recent(scope: str, key: Optional[str]) -> Optional[Previous]:
+    """Réponse terminée encore en LRU (aucune requête)."""
+    if not key:
+        return None
+    prev = _recent.get((scope, key))
+    if prev is not None:
+        _stats["replayed"] += 1
+    return prev
+
+
+def remember(scope: str, key: Optional[str], status_code: int, body: Dict[str, Any]) -> None:
+    """À appeler après le commit qui a rendu la réponse durable."""
+    if key:
+        _recent.set((scope, key), (int(status_code), body))
+
+
+def replayed(prev: Previous) -> Previous:
+    """Comptabilise une réponse relue en base (CTE de POST /report ou lookup)."""
+    if prev[0] is None:
+        _stats["in_flight"] += 1
+    else:
+        _stats["replayed"] += 1
+    return prev
+
+
+async def lookup(db: AsyncSession, scope: str, key: str) -> Optional[Previous]:
+    row = (await db.execute(_LOOKUP_SQL, {"scope": scope, "key": key})).first()
+    if row is None:
+        return None
+    return replayed((row.status_code, _as_dict(row.response)))
+
+
+async def claim(db: AsyncSession, scope: str, key: Optional[str]) -> Optional[Previous]:
+    """
+    Prend la clé (commit → visible « en cours » des autres process).
+    None → à nous : terminer par complete() ou release().
+    Sinon (status_code, body) de la première écriture, status_code None si encore en cours.
+    """
+    if not key:
+        return None
+    prev = recent(scope, key)
+    if prev is not None:
+        return prev
+    got = (await db.execute(_CLAIM_SQL, {"scope": scope, "key": key})).first()
+    await db.commit()
+    if got is not None:
+        _stats["claimed"] += 1
+        return None
+    prev = await lookup(db, scope, key)
+    # purgée entre-temps : très improbable, on la reprend
+    return prev if prev is not None else await claim(db, scope, key)
+
+
+async def complete(db: AsyncSession, scope: str, key: Optional[str],
+                   status_code: int, body: Dict[str, Any]) -> None:
+    """Enregistre la réponse et COMMIT : à appeler juste après l'écriture, même transaction."""
+    if key:
+        await db.execute(text("""
+            UPDATE idempotency_keys
+               SET completed_at = NOW(), status_code = :code, response = CAST(:body AS jsonb)
+             WHERE scope = :scope AND key = :key
+        """), {"scope": scope, "key": key, "code": int(status_code), "body": json.dumps(body, default=str)})
+    await db.commit()
+    remember(scope, key, status_code, body)
+
+
+async def release(db: AsyncSession, scope: str, key: Optional[str]) -> None:
+    """Écriture abandonnée (erreur, 403…) : un retry pourra reprendre la clé."""
+    if not key:
+        return
+    try:
+        await db.rollback()
+        await db.execute(text("""
+            DELETE FROM idempotency_keys WHERE scope = :scope AND key = :key AND completed_at IS NULL
+        """), {"scope": scope, "key": key})
+        await db.commit()
+        _stats["released"] += 1
+    except Exception as e:
+        await db.rollback()
+        print(f"[idempotency] release failed ({scope}/{key}): {e}")   # le bail expirera
+
+
+async def purge_expired(db: AsyncSession) -> int:
+    res = await db.execute(text(f"""
+        DELETE FROM idempotency_keys WHERE created_at < NOW() - INTERVAL '{IDEMPOTENCY_TTL_H} hours'
+    """))
+    await db.commit()
+    n = res.rowcount or 0
+    _stats["purged"] += n
+    return n
+
+
+async def idempotency_stats(db: AsyncSession) -> Dict[str, Any]:
+    row = (await db.execute(text("""
+        SELECT COUNT(*)::int AS keys,
+               COUNT(*) FILTER (WHERE completed_at IS NULL)::int AS in_flight_now
+          FROM idempotency_keys
+    """))).mappings().first()
+    return {
+        "ttl_h": IDEMPOTENCY_TTL_H,
+        "inflight_lease_s": IDEMPOTENCY_INFLIGHT_S,
+        **dict(row),
+        **_stats,
+        "lru": _recent.stats(),
+    }
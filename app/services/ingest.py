@@ -0,0 +1,293 @@
+# app/services/ingest.py
+"""
+Ingestion en lot des reports (POST /reports/batch) : files d'attente des
+clients mobiles rejouées au retour du réseau.
+
+Avant : N × POST /report = N × (upsert user + commit, insert + commit,
+évènement + commit). Ici, pour tout le lot :
+  1) dédoublonnage idempotency_key dans le lot
+  2) une requête : prise des clés dans idempotency_keys (INSERT … ON CONFLICT
+     … RETURNING, atomique face aux lots / POST /report concurrents), upsert
+     des users, INSERT multi-lignes (jsonb_to_recordset) des seuls items dont
+     la clé est obtenue, signés (report_hooks.report_signature), + lignes
+     report_events 'created' ;
+     les uuid sont générés côté Python → statut par item sans dépendre
+     de l'ordre du RETURNING
+  3) effets de bord outages / incidents ensemblistes, par table, sur chaque
+     suite consécutive de même signal (l'ordre cut → restored du lot est respecté) :
+       cut      : ouverture des évènements manquants (120 m) + compteurs
+       restored : contrôle d'ownership (hors admin) + clôture (150 m)
+  2) et 3) dans une seule transaction, un commit : un report n'est jamais
+  stocké sans ses effets (le tick d'agrégation ne reconstruit que les
+  outages, pas les incidents). Échec → rien n'est stocké, le lot entier
+  peut être rejoué (ses clés ne sont pas vues comme doublons).
+
+Mêmes règles que POST /report ; différence assumée : deux 'cut' du lot à
+< 120 m l'un de l'autre n'ouvrent qu'un évènement (le premier).
+"""
+import json
+import os
+import uuid
+from itertools import groupby
+from typing import Any, Dict, List
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.services import known_users
+from app.services import schema_registry
+from app.services.event_counters import bump_reports_count_many, event_table
+from app.services.integrity import SIG_VERSION
+from app.services.report_hooks import report_signature
+
+INGEST_BATCH_MAX = int(os.getenv("INGEST_BATCH_MAX", "200"))
+
+OPEN_MATCH_M  = 120     # même rayon que POST /report
+CLOSE_MATCH_M = 150
+
+_INSERT_SQL = """
+    WITH src AS (
+      SELECT *
+        FROM jsonb_to_recordset(CAST(:items AS jsonb)) AS x(
+          ord bigint, id uuid, kind text, signal text, lat float8, lng float8,
+          user_id uuid, idempotency_key text, phone text, signature text)
+    ),
+    -- prise des clés sur la clé primaire (scope, key), comme POST /report
+    -- (services/idempotency.py) : un seul gagnant même entre lots concurrents
+    claim AS (
+      INSERT INTO idempotency_keys(scope, key, completed_at, status_code, response)
+      SELECT 'report', s.idempotency_key, NOW(), 200,
+             jsonb_build_object('ok', true, 'id', s.id, 'idempotency_key', s.idempotency_key)
+        FROM src s
+       WHERE s.idempotency_key IS NOT NULL
+      ON CONFLICT (scope, key) DO UPDATE
+         SET completed_at = NOW(), status_code = EXCLUDED.status_code, response = EXCLUDED.response
+       -- item de file : clé prise à l'enqueue (202) pour ce même id → complétée
+       WHERE idempotency_keys.status_code = 202
+         AND idempotency_keys.response->>'id' = EXCLUDED.response->>'id'
+      RETURNING key
+    ),
+    users AS (
+      INSERT INTO app_users(id)
+      SELECT DISTINCT user_id FROM src WHERE user_id IS NOT NULL
+      ON CONFLICT (id) DO NOTHING
+    ),
+    ins AS (
+      INSERT INTO reports(id, kind, signal, geom, user_id, created_at, idempotency_key, phone,
+                          signature, sig_version)
+      SELECT s.id,
+             CAST(s.kind   AS {kind_t}),
+             CAST(s.signal AS {signal_t}),
+             ST_SetSRID(ST_MakePoint(s.lng, s.lat),4326)::geography,
+             s.user_id, NOW(), s.idempotency_key, s.phone,
+             s.signature, {sig_version}
+        FROM src s
+       WHERE s.idempotency_key IS NULL
+          OR EXISTS (SELECT 1 FROM claim c WHERE c.key = s.idempotency_key)
+       ORDER BY s.ord
+      ON CONFLICT (id) DO NOTHING     -- id pré-attribué déjà inséré (file rejouée, report_queue.py)
+      RETURNING id
+    ),
+    log AS (
+      INSERT INTO report_events(report_id, event) SELECT id, 'created' FROM ins
+    )
+    SELECT id FROM ins
+"""
+
+_PTS_CTE = """
+    pts AS (
+      SELECT x.ord, x.kind, x.user_id, ST_SetSRID(ST_MakePoint(x.lng, x.lat),4326)::geography AS g
+        FROM jsonb_to_recordset(CAST(:pts AS jsonb)) AS x(ord bigint, kind text, lat float8, lng float8, user_id uuid)
+    )
+"""
+
+
+def _pts_json(items: List[dict]) -> str:
+    return json.dumps([
+        {"ord": it["index"], "kind": it["kind"], "lat": it["lat"], "lng": it["lng"],
+         "user_id": it["user_id"]}
+        for it in items
+    ])
+
+
+async def _claimed_by_others(db: AsyncSession, keys: List[str]) -> Dict[str, str]:
+    """Clés non obtenues → id de la réponse d'origine (None : écriture encore en cours)."""
+    if not keys:
+        return {}
+    rs = await db.execute(text("""
+        SELECT key, response->>'id' AS id
+          FROM idempotency_keys
+         WHERE scope = 'report' AND key = ANY(:keys)
+    """), {"keys": keys})
+    return {r.key: r.id for r in rs}
+
+
+async def _insert_reports(db: AsyncSession, items: List[dict]) -> set:
+    payload = json.dumps([
+        {"ord": it["index"], "id": it["id"], "kind": it["kind"], "signal": it["signal"],
+         "lat": it["lat"], "lng": it["lng"], "user_id": it["user_id"],
+         "idempotency_key": it["idempotency_key"], "phone": it["phone"],
+         "signature": report_signature(it["id"], kind=it["kind"], signal=it["signal"],
+                                       lat=it["lat"], lng=it["lng"], device_id=None,
+                                       accuracy_m=None, photo_url=None, user_id=it["user_id"])}
+        for it in items
+    ])
+    reg = await schema_registry.get(db)
+    sql = _INSERT_SQL.format(kind_t=reg.cast_type("reports", "kind"),
+                             signal_t=reg.cast_type("reports", "signal"),
+                             sig_version=SIG_VERSION)
+    res = await db.execute(text(sql), {"items": payload})
+    return {str(r[0]) for r in res.fetchall()}
+
+
+async def _open_events(db: AsyncSession, table: str, items: List[dict]) -> None:
+    # un évènement par point sans évènement actif à 120 m, sauf si un point
+    # plus tôt dans le lot (même kind, < 120 m) en ouvre déjà un
+    sql = """
+        WITH {pts},
+        cand AS (
+          SELECT p.* FROM pts p
+           WHERE NOT EXISTS (
+             SELECT 1 FROM {table} i
+              WHERE i.kind::text = p.kind
+                AND i.restored_at IS NULL
+                AND ST_DWithin(i.center, p.g, {r})
+           )
+        )
+        INSERT INTO {table}(kind, center, started_at, restored_at)
+        SELECT CAST(c.kind AS {kind_t}), c.g, NOW(), NULL
+          FROM cand c
+         WHERE NOT EXISTS (
+           SELECT 1 FROM cand e
+            WHERE e.kind = c.kind AND e.ord < c.ord AND ST_DWithin(e.g, c.g, {r})
+         )
+         ORDER BY c.ord
+    """
+    kind_t = (await schema_registry.get(db)).cast_type(table, "kind")
+    await db.execute(text(sql.format(pts=_PTS_CTE, table=table, r=OPEN_MATCH_M, kind_t=kind_t)),
+                     {"pts": _pts_json(items)})
+
+
+async def _owned(db: AsyncSession, items: List[dict], ownership_radius_m: float) -> set:
+    """Index des 'restored' dont l'auteur a signalé un 'cut' proche (24 h) — règle de POST /report."""
+    candidates = [it for it in items if it["user_id"]]
+    if not candidates:
+        return set()
+    rs = await db.execute(text(f"""
+        WITH {_PTS_CTE}
+        SELECT p.ord
+          FROM pts p
+         WHERE EXISTS (
+           SELECT 1 FROM reports r
+            WHERE r.kind::text = p.kind AND lower(trim(r.signal::text))='cut'
+              AND r.user_id = p.user_id
+              AND r.created_at >= NOW() - INTERVAL '24 hours'
+              AND ST_DWithin(r.geom, p.g, :ownr)
+         )
+    """), {"pts": _pts_json(candidates), "ownr": float(ownership_radius_m)})
+    return {r.ord for r in rs}
+
+
+async def _close_events(db: AsyncSession, table: str, items: List[dict]) -> None:
+    await db.execute(text(f"""
+        WITH {_PTS_CTE}
+        UPDATE {table} i
+           SET restored_at = COALESCE(i.restored_at, NOW())
+          FROM pts p          -- jointure pilotée par les points → index GiST sur center
+         WHERE i.restored_at IS NULL
+           AND i.kind::text = p.kind
+           AND ST_DWithin(i.center, p.g, {CLOSE_MATCH_M})
+    """), {"pts": _pts_json(items)})
+
+
+async def _apply_events(db: AsyncSession, items: List[dict], is_admin: bool,
+                        ownership_radius_m: float, results: Dict[int, dict]) -> None:
+    for signal, run in groupby(items, key=lambda it: it["signal"]):
+        run = list(run)
+        if signal == "restored" and not is_admin:
+            check = [it for it in run if not it.get("is_admin")]
+            owned = await _owned(db, check, ownership_radius_m)
+            for it in check:
+                if it["index"] not in owned:
+                    results[it["index"]]["status"] = "not_owner"
+            run = [it for it in run if it.get("is_admin") or it["index"] in owned]
+        for table in ("outages", "incidents"):
+            part = [it for it in run if event_table(it["kind"]) == table]
+            if not part:
+                continue
+            if signal == "cut":
+                await _open_events(db, table, part)
+            else:
+                await _close_events(db, table, part)
+        if signal == "cut":
+            # compteurs (l'évènement éventuellement ouvert ci-dessus est inclus) ;
+            # savepoint : un échec n'annule pas le lot, rattrapé au prochain tick
+            # d'agrégation (refresh_event_counters)
+            try:
+                async with db.begin_nested():
+                    await bump_reports_count_many(db, run)
+            except Exception as e:
+                print(f"[ingest] counters bump failed: {e}")
+
+
+async def ingest_reports(
+    db: AsyncSession,
+    items: List[dict],
+    *,
+    is_admin: bool = False,
+    ownership_radius_m: float = 150,
+    commit: bool = True,
+) -> Dict[str, Any]:
+    """
+    items : reports déjà validés/normalisés, dans l'ordre du lot :
+      {"index", "kind", "signal", "lat", "lng", "user_id", "idempotency_key", "phone"}
+      + optionnels : "id" (uuid pré-attribué, file d'attente), "is_admin" (par item)
+    Retour : {"results": {index: {"status", "id", ...}}, "created": [items insérés]}
+    status : created | duplicate | not_owner ('restored' inséré, sans effet sur les évènements)
+    Reports + évènements : une transaction. commit=False → l'appelant commit
+    (report_queue : suppression des lignes de file dans la même transaction)
+    et ajoute les user_id créés à known_users. Exception → l'appelant rollback.
+    """
+    results: Dict[int, dict] = {}
+
+    # 1) doublons dans le lot (la base : prise des clés dans l'INSERT)
+    first_by_key: Dict[str, int] = {}
+    to_insert = []
+    for it in items:
+        k = it["idempotency_key"]
+        if k is not None and k in first_by_key:
+            results[it["index"]] = {"status": "duplicate", "id": None, "duplicate_of": first_by_key[k]}
+            continue
+        if k is not None:
+            first_by_key[k] = it["index"]
+        it.setdefault("id", str(uuid.uuid4()))
+        to_insert.append(it)
+
+    # 2) clés + users + reports + report_events : une requête
+    created = []
+    lost = []
+    if to_insert:
+        ids = await _insert_reports(db, to_insert)
+        for it in to_insert:
+            if it["id"] in ids:
+                results[it["index"]] = {"status": "created", "id": it["id"]}
+                created.append(it)
+            else:
+                # clé déjà prise (autre requête, éventuellement en parallèle),
+                # ou id pré-attribué déjà présent (item de file rejoué)
+                results[it["index"]] = {"status": "duplicate", "id": None}
+                if it["idempotency_key"] is not None:
+                    lost.append(it)
+        owners = await _claimed_by_others(db, [it["idempotency_key"] for it in lost])
+        for it in lost:
+            results[it["index"]]["id"] = owners.get(it["idempotency_key"])
+
+    # 3) outages / incidents, même transaction
+    if created:
+        await _apply_events(db, created, is_admin, ownership_radius_m, results)
+
+    if commit:
+        await db.commit()
+        for it in created:
+            known_users.add(it["user_id"])
+    return {"results": results, "created": created}
@@ -1,10 +1,14 @@
 # app/services/integrity.py
-import os, hmac, hashlib, json
-from typing import Dict, Any
+import os, hmac, hashlib, json, uuid
+from typing import Dict, Any, List, Optional, Sequence, Tuple
 
 # Utilise SIGNING_SECRET si présent, sinon ADMIN_TOKEN
 SECRET = os.getenv("SIGNING_SECRET") or os.getenv("ADMIN_TOKEN") or "dev-secret"
 
+# Forme canonique des signatures écrites maintenant (reports.sig_version, migration 0010) ;
+# les lignes sig_version NULL sont en version 1 (valeurs brutes du client)
+SIG_VERSION = 2
+
 def canonical(payload: Dict[str, Any]) -> bytes:
     # JSON stable : tri des clés, pas d'espaces
     return json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
@@ -13,3 +17,70 @@ def make_signature(payload: Dict[str, Any]) -> str:
     body = canonical(payload)
     sig = hmac.new(SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
     return sig
+
+def report_payload(
+    report_id: str,
+    *,
+    kind: str, signal: str, lat: float, lng: float,
+    device_id: Optional[str], accuracy_m: Optional[int],
+    photo_url: Optional[str], user_id: Optional[str],
+    version: int = SIG_VERSION,
+) -> Dict[str, Any]:
+    """
+    Champs signés d'un report (report_hooks.report_signature, verify_chunk).
+    Version 2 : valeurs sous leur forme relue en base (uuid::text minuscule,
+    kind / signal sans casse ni espaces) : la signature calculée avant l'insert
+    et celle recalculée depuis la ligne stockée coïncident.
+    Version 1 : valeurs telles quelles (signatures antérieures à la migration 0010).
+    """
+    if version == 1:
+        return {
+            "id": str(report_id),
+            "kind": kind, "signal": signal,
+            "lat": round(float(lat), 6),
+            "lng": round(float(lng), 6),
+            "device_id": device_id or "",
+            "accuracy_m": accuracy_m or 0,
+            "photo_url": photo_url or "",
+            "user_id": user_id or "",
+        }
+    return {
+        "id": _uuid_text(report_id),
+        "kind": _label(kind), "signal": _label(signal),
+        "lat": round(float(lat), 6),
+        "lng": round(float(lng), 6),
+        "device_id": device_id or "",
+        "accuracy_m": accuracy_m or 0,
+        "photo_url": photo_url or "",
+        "user_id": _uuid_text(user_id) if user_id else "",
+    }
+
+def _uuid_text(v: Any) -> str:
+    try:
+        return str(uuid.UUID(str(v)))
+    except ValueError:
+        return str(v)
+
+def _label(v: Any) -> str:
+    return str(getattr(v, "value", v) or "").strip().lower()
+
+# (id, kind, signal, lat, lng, device_id, accuracy_m, photo_url, user_id, signature, sig_version)
+ReportRow = Tuple[str, str, str, float, float, Optional[str], Optional[int], Optional[str], Optional[str], str,
+                  Optional[int]]
+
+def verify_chunk(rows: Sequence[ReportRow]) -> Tuple[int, List[Tuple[str, str, str]]]:
+    """
+    Recalcule la signature de chaque ligne. Exécuté dans les process du pool
+    de services/verify.py : stdlib seulement, arguments / résultat picklables.
+    Retourne (nb vérifiés, [(report_id, signature stockée, signature attendue)]).
+    """
+    bad = []
+    for rid, kind, signal, lat, lng, device_id, accuracy_m, photo_url, user_id, stored, version in rows:
+        expected = make_signature(report_payload(
+            rid, kind=kind, signal=signal, lat=lat, lng=lng,
+            device_id=device_id, accuracy_m=accuracy_m, photo_url=photo_url, user_id=user_id,
+            version=version or 1,
+        ))
+        if not hmac.compare_digest(expected, stored):
+            bad.append((rid, stored, expected))
+    return len(rows), bad
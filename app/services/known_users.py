@@ -0,0 +1,98 @@
+# app/services/known_users.py
+"""
+Ensemble borné (LRU) des user_id déjà présents dans app_users.
+
+Avant : chaque report avec user_id faisait INSERT INTO app_users … ON CONFLICT
+DO NOTHING (+ un commit dans crud.insert_report), alors que ce sont toute la
+journée les mêmes quelques milliers d'appareils.
+Maintenant : l'upsert n'est fait que pour un id absent de l'ensemble.
+
+- préchauffé au démarrage avec les KNOWN_USERS_MAX ids les plus récents
+- un id entre dans l'ensemble après un insert de report réussi (la FK garantit
+  alors que la ligne app_users existe)
+- l'application ne supprime jamais d'app_users ; si un id connu a été supprimé
+  à la main, l'insert échoue sur la FK (23503) → forget() + nouvel essai avec
+  upsert (is_missing_user)
+
+Local au worker, comme map_cache.
+"""
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import SessionLocal
+
+KNOWN_USERS_ENABLED = os.getenv("KNOWN_USERS_ENABLED", "1") != "0"
+KNOWN_USERS_MAX     = int(os.getenv("KNOWN_USERS_MAX", "50000"))
+
+_ids: "OrderedDict[str, None]" = OrderedDict()
+_stats: Dict[str, Any] = {"hits": 0, "misses": 0, "warmed": 0, "evictions": 0, "fk_retries": 0}
+
+
+def is_known(uid: Optional[str]) -> bool:
+    """True → l'upsert app_users peut être sauté. Compte hits / misses."""
+    if not uid or not KNOWN_USERS_ENABLED:
+        return False
+    if uid in _ids:
+        _ids.move_to_end(uid)
+        _stats["hits"] += 1
+        return True
+    _stats["misses"] += 1
+    return False
+
+
+def add(uid: Optional[str]) -> None:
+    if not uid or not KNOWN_USERS_ENABLED:
+        return
+    _ids[uid] = None
+    _ids.move_to_end(uid)
+    while len(_ids) > KNOWN_USERS_MAX:
+        _ids.popitem(last=False)
+        _stats["evictions"] += 1
+
+
+def forget(uid: Optional[str]) -> None:
+    if uid:
+        _ids.pop(uid, None)
+
+
+def is_missing_user(exc: BaseException) -> bool:
+    """Erreur FK (23503) : un id supposé connu n'existe plus dans app_users."""
+    orig = getattr(exc, "orig", exc)
+    if getattr(orig, "sqlstate", None) != "23503":
+        return False
+    _stats["fk_retries"] += 1
+    return True
+
+
+async def warm(db: AsyncSession) -> int:
+    rs = await db.execute(text("""
+        SELECT id::text AS id FROM app_users ORDER BY created_at DESC LIMIT :n
+    """), {"n": KNOWN_USERS_MAX})
+    ids = [r.id for r in rs]
+    for uid in reversed(ids):       # le plus récent en fin de LRU
+        add(uid)
+    _stats["warmed"] = len(ids)
+    return len(ids)
+
+
+async def start() -> None:
+    if not KNOWN_USERS_ENABLED:
+        return
+    async with SessionLocal() as db:
+        n = await warm(db)
+    print(f"[known-users] warmed {n} ids")
+
+
+def known_users_stats() -> Dict[str, Any]:
+    total = _stats["hits"] + _stats["misses"]
+    return {
+        "enabled": KNOWN_USERS_ENABLED,
+        "size": len(_ids),
+        "max": KNOWN_USERS_MAX,
+        **_stats,
+        "hit_rate": round(_stats["hits"] / total, 4) if total else None,
+    }
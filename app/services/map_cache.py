@@ -0,0 +1,162 @@
+# app/services/map_cache.py
+"""
+Cache en mémoire (par process) des réponses GET /map.
+
+- clé = cellule geohash du centre + rayon arrondi (+ show_all)
+- TTL court + éviction LRU (taille bornée)
+- invalidation ciblée à chaque écriture (report, ack, upload, admin)
+  et globale après chaque tick d'agrégation
+
+Même mécanique pour les tuiles vectorielles /tiles/{z}/{x}/{y}.mvt
+(`tile_cache`, clé = (z, x, y), meta = bbox de la tuile) : les mêmes
+appels invalidate_point / invalidate_all purgent les deux caches
+et planifient la reconstruction du snapshot show_all (map_snapshot.py).
+
+⚠️ Cache local au worker : avec plusieurs workers uvicorn, une écriture
+reçue par un autre worker n'invalide pas ce cache → au pire TTL de retard.
+"""
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from app.services import geohash
+from app.services.map_snapshot import schedule_rebuild as snapshot_schedule_rebuild
+
+MAP_CACHE_ENABLED     = os.getenv("MAP_CACHE_ENABLED", "1") != "0"
+MAP_CACHE_TTL_S       = float(os.getenv("MAP_CACHE_TTL_S", "30"))
+MAP_CACHE_MAX_ENTRIES = int(os.getenv("MAP_CACHE_MAX_ENTRIES", "1024"))
+MAP_CACHE_PRECISION   = int(os.getenv("MAP_CACHE_GEOHASH_PRECISION", "6"))   # ≈1.2 km x 0.6 km
+MAP_CACHE_RADIUS_STEP_KM = float(os.getenv("MAP_CACHE_RADIUS_STEP_KM", "0.5"))
+# marge autour d'une écriture : fusion outage/incident (≤350 m) + zones d'alerte
+MAP_CACHE_INVALIDATE_MARGIN_M = float(os.getenv("MAP_CACHE_INVALIDATE_MARGIN_M", "500"))
+
+TILE_CACHE_ENABLED     = os.getenv("TILE_CACHE_ENABLED", "1") != "0"
+TILE_CACHE_TTL_S       = float(os.getenv("TILE_CACHE_TTL_S", "30"))
+TILE_CACHE_MAX_ENTRIES = int(os.getenv("TILE_CACHE_MAX_ENTRIES", "2048"))
+
+
+def haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dphi = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * 6_371_000.0 * math.asin(min(1.0, math.sqrt(a)))
+
+
+class LRUTTLCache:
+    """
+    LRU + TTL minimaliste (asyncio mono-thread → pas de verrou).
+    Chaque entrée garde une `meta` libre, utilisée pour l'invalidation ciblée.
+    """
+
+    def __init__(self, max_entries: int, ttl_s: float):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_s = float(ttl_s)
+        self._data: "OrderedDict[Hashable, Tuple[float, Any, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value, _meta = item
+        if time.monotonic() >= expires_at:
+            del self._data[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, meta: Any = None) -> None:
+        self._data[key] = (time.monotonic() + self.ttl_s, value, meta)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate_where(self, pred: Callable[[Hashable, Any], bool]) -> int:
+        doomed = [k for k, (_, _, meta) in self._data.items() if pred(k, meta)]
+        for k in doomed:
+            del self._data[k]
+        self.invalidations += len(doomed)
+        return len(doomed)
+
+    def clear(self) -> int:
+        n = len(self._data)
+        self._data.clear()
+        self.invalidations += n
+        return n
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl_s,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+map_cache = LRUTTLCache(MAP_CACHE_MAX_ENTRIES, MAP_CACHE_TTL_S)
+tile_cache = LRUTTLCache(TILE_CACHE_MAX_ENTRIES, TILE_CACHE_TTL_S)
+
+
+def map_cell(lat: float, lng: float, radius_km: float, show_all: bool = False):
+    """
+    Quantifie (lat, lng, radius_km) → (clé, lat_c, lng_c, radius_km_q).
+    La requête est ensuite exécutée au centre de la cellule avec un rayon
+    élargi de la demi-diagonale : la zone servie couvre toujours la zone demandée.
+    """
+    if show_all:
+        return ("all",), lat, lng, radius_km
+    gh = geohash.encode(lat, lng, MAP_CACHE_PRECISION)
+    lat_c, lng_c = geohash.center(gh)
+    lat_lo, lng_lo, lat_hi, lng_hi = geohash.bbox(gh)
+    half_diag_km = haversine_m(lat_lo, lng_lo, lat_hi, lng_hi) / 2000.0
+    step = MAP_CACHE_RADIUS_STEP_KM
+    radius_q = math.ceil((radius_km + half_diag_km) / step) * step
+    return (gh, round(radius_q, 3)), lat_c, lng_c, radius_q
+
+
+def invalidate_point(lat: float, lng: float, radius_m: float = 0.0) -> int:
+    """Écriture en (lat, lng) → purge les cellules dont le disque servi la contient
+    (et les tuiles dont la bbox, élargie de la marge, la contient).
+    radius_m : écriture de zone (admin *_near) → toute ligne à ≤ radius_m du point
+    peut avoir changé, le disque touché est élargi d'autant."""
+    margin_m = MAP_CACHE_INVALIDATE_MARGIN_M + max(0.0, float(radius_m or 0.0))
+
+    def hit(_key, meta):
+        if meta is None:          # show_all : toujours concerné
+            return True
+        c_lat, c_lng, r_m = meta
+        return haversine_m(c_lat, c_lng, lat, lng) <= r_m + margin_m
+
+    d_lat = margin_m / 111_320.0
+    d_lng = d_lat / max(0.01, math.cos(math.radians(lat)))
+
+    def tile_hit(_key, meta):
+        min_lat, min_lng, max_lat, max_lng = meta
+        return (min_lat - d_lat <= lat <= max_lat + d_lat
+                and min_lng - d_lng <= lng <= max_lng + d_lng)
+
+    snapshot_schedule_rebuild()     # snapshot show_all (debounce)
+    return map_cache.invalidate_where(hit) + tile_cache.invalidate_where(tile_hit)
+
+
+def invalidate_all() -> int:
+    snapshot_schedule_rebuild()
+    return map_cache.clear() + tile_cache.clear()
@@ -0,0 +1,138 @@
+# app/services/map_snapshot.py
+"""
+Snapshot mémoire de GET /map?show_all=true.
+
+L'ensemble global des évènements actifs ne change qu'à l'arrivée d'un report
+ou d'un tick d'agrégation : on le construit une fois (JSON déjà sérialisé,
+en octets) et on le sert tel quel, sans accès DB.
+
+- reconstruit à la fin de chaque tick (agrégation, auto-expire)
+- reconstruit après chaque écriture, avec un debounce (MAP_SNAPSHOT_DEBOUNCE_S)
+  → déclenché par map_cache.invalidate_point / invalidate_all, que tous les
+  chemins d'écriture appellent déjà
+- au-delà de MAP_SNAPSHOT_MAX_AGE_S, servi quand même mais reconstruit en
+  arrière-plan (écritures reçues par un autre worker)
+
+Le corps contient "generated_at" ; "server_now" est ajouté à chaque réponse.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from app.responses import dumps
+
+MAP_SNAPSHOT_ENABLED    = os.getenv("MAP_SNAPSHOT_ENABLED", "1") != "0"
+MAP_SNAPSHOT_DEBOUNCE_S = float(os.getenv("MAP_SNAPSHOT_DEBOUNCE_S", "2"))
+MAP_SNAPSHOT_MAX_AGE_S  = float(os.getenv("MAP_SNAPSHOT_MAX_AGE_S", "60"))
+
+_state = {
+    "body": None,           # bytes JSON sans server_now
+    "etag": None,
+    "generated_at": None,   # iso Z
+    "built_at": 0.0,        # time.monotonic()
+    "build_ms": None,
+    "builds": 0,
+    "errors": 0,
+    "served": 0,
+}
+_build_lock = asyncio.Lock()
+_pending: Optional[asyncio.Task] = None
+
+
+def _nowz() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+async def _build_body() -> bytes:
+    # import tardif : les lectures vivent dans app/routes/map.py (qui importe ce module)
+    from app.db import SessionLocal
+    from app.routes.map import fetch_map_payload_json, _build_map_payload
+
+    # primaire : le snapshot doit voir l'écriture qui vient de le déclencher
+    async with SessionLocal() as db:
+        try:
+            return await fetch_map_payload_json(db, 0.0, 0.0, 0.0, True)
+        except Exception as e:
+            await db.rollback()
+            print(f"[snapshot] fast path failed, fallback: {e}")
+        payload = await _build_map_payload(db, 0.0, 0.0, 0.0, True)
+        payload.pop("server_now", None)
+        return dumps(payload)
+
+
+async def rebuild_snapshot() -> bool:
+    if not MAP_SNAPSHOT_ENABLED:
+        return False
+    async with _build_lock:
+        t0 = time.perf_counter()
+        try:
+            body = await _build_body()
+        except Exception as e:
+            _state["errors"] += 1
+            print(f"[snapshot] rebuild error: {e}")
+            return False
+        generated_at = _nowz()
+        body = body[:-1] + b',"generated_at":' + json.dumps(generated_at).encode("utf-8") + b"}"
+        _state.update({
+            "body": body,
+            "etag": '"s-' + hashlib.sha1(body).hexdigest()[:20] + '"',
+            "generated_at": generated_at,
+            "built_at": time.monotonic(),
+            "build_ms": round((time.perf_counter() - t0) * 1000.0, 1),
+        })
+        _state["builds"] += 1
+        return True
+
+
+async def _debounced_rebuild(delay: float) -> None:
+    global _pending
+    try:
+        await asyncio.sleep(delay)
+    finally:
+        _pending = None
+    await rebuild_snapshot()
+
+
+def schedule_rebuild(delay: Optional[float] = None) -> None:
+    """Reconstruction différée ; les écritures rapprochées n'en déclenchent qu'une."""
+    global _pending
+    if not MAP_SNAPSHOT_ENABLED or _pending is not None:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return      # hors boucle (script, test) : rien à faire
+    _pending = loop.create_task(
+        _debounced_rebuild(MAP_SNAPSHOT_DEBOUNCE_S if delay is None else delay)
+    )
+
+
+async def get_snapshot():
+    """(body, etag, generated_at) — construit au premier appel, rafraîchi si trop vieux."""
+    if _state["body"] is None:
+        await rebuild_snapshot()
+        if _state["body"] is None:
+            return None
+    elif time.monotonic() - _state["built_at"] > MAP_SNAPSHOT_MAX_AGE_S:
+        schedule_rebuild(0)
+    _state["served"] += 1
+    return _state["body"], _state["etag"], _state["generated_at"]
+
+
+def snapshot_stats() -> dict:
+    age = time.monotonic() - _state["built_at"] if _state["body"] is not None else None
+    return {
+        "enabled": MAP_SNAPSHOT_ENABLED,
+        "generated_at": _state["generated_at"],
+        "age_s": round(age, 1) if age is not None else None,
+        "bytes": len(_state["body"]) if _state["body"] is not None else 0,
+        "build_ms": _state["build_ms"],
+        "builds": _state["builds"],
+        "errors": _state["errors"],
+        "served": _state["served"],
+        "pending": _pending is not None,
+    }
@@ -0,0 +1,80 @@
+# app/services/map_sync.py
+"""
+Synchro incrémentale de /map (GET /map?since=<cursor>).
+
+Suivi des modifications côté Postgres, par triggers (migration
+db/migrations/0003_map_change_tracking.sql) → aucun chemin
+d'écriture (post_report, agrégation, routes admin, SQL à la main) ne peut
+l'oublier :
+  - outages / incidents / reports : colonne updated_at (clock_timestamp())
+    posée à chaque INSERT / UPDATE
+  - map_tombstones : une ligne par DELETE (id supprimé),
+    une ligne « reset » (row_id NULL) par TRUNCATE
+
+Curseur = horodatage serveur (µs epoch) opaque pour le client. La lecture
+repart de `cursor - MAP_SYNC_OVERLAP_S` : une transaction plus lente
+qui committe après coup n'est pas perdue (quelques doublons possibles,
+le client fusionne par id).
+"""
+import os
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+MAP_SYNC_OVERLAP_S   = int(os.getenv("MAP_SYNC_OVERLAP_S", "15"))
+MAP_SYNC_MAX_AGE_H   = int(os.getenv("MAP_SYNC_MAX_AGE_H", "24"))   # au-delà → payload complet
+TOMBSTONE_KEEP_H     = max(MAP_SYNC_MAX_AGE_H + 1, int(os.getenv("TOMBSTONE_KEEP_H", "48")))
+
+SYNC_TABLES = ("outages", "incidents", "reports")
+
+
+async def purge_tombstones(db: AsyncSession) -> int:
+    res = await db.execute(text(
+        f"DELETE FROM map_tombstones WHERE deleted_at < NOW() - INTERVAL '{TOMBSTONE_KEEP_H} hours'"
+    ))
+    await db.commit()
+    return res.rowcount or 0
+
+
+# ---------- curseur ----------
+async def new_cursor(db: AsyncSession) -> str:
+    """Curseur à renvoyer au client : « maintenant », côté Postgres (même horloge que les triggers)."""
+    res = await db.execute(text("SELECT FLOOR(EXTRACT(EPOCH FROM clock_timestamp()) * 1000000)::bigint"))
+    return str(res.scalar())
+
+
+def parse_cursor(since: Optional[str]) -> Optional[int]:
+    try:
+        v = int((since or "").strip())
+    except ValueError:
+        return None
+    return v if v > 0 else None
+
+
+async def needs_full_sync(db: AsyncSession, since_us: int) -> bool:
+    """Curseur trop vieux (tombstones purgées) ou TRUNCATE depuis → payload complet."""
+    res = await db.execute(text(f"""
+        SELECT (to_timestamp(:since / 1000000.0) < NOW() - INTERVAL '{MAP_SYNC_MAX_AGE_H} hours')
+            OR EXISTS (
+                 SELECT 1 FROM map_tombstones
+                  WHERE row_id IS NULL
+                    AND deleted_at > to_timestamp(:since / 1000000.0) - make_interval(secs => :overlap)
+               )
+    """), {"since": since_us, "overlap": MAP_SYNC_OVERLAP_S})
+    return bool(res.scalar())
+
+
+async def fetch_tombstones(db: AsyncSession, since_us: int) -> dict:
+    res = await db.execute(text("""
+        SELECT tbl, array_agg(DISTINCT row_id) AS ids
+          FROM map_tombstones
+         WHERE row_id IS NOT NULL
+           AND deleted_at > to_timestamp(:since / 1000000.0) - make_interval(secs => :overlap)
+         GROUP BY tbl
+    """), {"since": since_us, "overlap": MAP_SYNC_OVERLAP_S})
+    out = {t: [] for t in SYNC_TABLES}
+    for r in res.fetchall():
+        # outages/incidents : id entier comme dans /map ; reports : uuid en texte
+        out[r.tbl] = [int(i) if i.isdigit() else i for i in (r.ids or [])]
+    return out
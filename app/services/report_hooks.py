@@ -2,7 +2,25 @@
 from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from app.services.integrity import make_signature
+from app.services.integrity import SIG_VERSION, make_signature, report_payload
+
+def report_signature(
+    report_id: str,
+    *,
+    kind: str, signal: str, lat: float, lng: float,
+    device_id: Optional[str], accuracy_m: Optional[int],
+    photo_url: Optional[str], user_id: Optional[str]
+) -> str:
+    """
+    Signature HMAC d'un report (forme SIG_VERSION, à stocker dans reports.sig_version).
+    Ne dépend que des champs fournis par le client + l'id : avec un id pré-généré
+    (uuid4), elle se calcule avant l'insert et s'écrit dans la même requête
+    (crud.insert_report(signature=…), POST /report, ingest_reports).
+    """
+    return make_signature(report_payload(
+        report_id, kind=kind, signal=signal, lat=lat, lng=lng,
+        device_id=device_id, accuracy_m=accuracy_m, photo_url=photo_url, user_id=user_id,
+    ))
 
 async def enrich_and_sign_report(
     db: AsyncSession,
@@ -12,21 +30,15 @@ async def enrich_and_sign_report(
     device_id: Optional[str], accuracy_m: Optional[int],
     photo_url: Optional[str], user_id: Optional[str]
 ) -> None:
-    payload = {
-        "id": report_id,
-        "kind": kind, "signal": signal,
-        "lat": round(float(lat), 6),
-        "lng": round(float(lng), 6),
-        "device_id": device_id or "",
-        "accuracy_m": accuracy_m or 0,
-        "photo_url": photo_url or "",
-        "user_id": user_id or "",
-    }
-    sig = make_signature(payload)
+    """Signature a posteriori (reports déjà insérés sans signature)."""
+    sig = report_signature(
+        report_id, kind=kind, signal=signal, lat=lat, lng=lng,
+        device_id=device_id, accuracy_m=accuracy_m, photo_url=photo_url, user_id=user_id,
+    )
     q = text("""
         UPDATE reports
-        SET signature = :sig
+        SET signature = :sig, sig_version = :sig_version
         WHERE id = CAST(:rid AS uuid)
     """)
-    await db.execute(q, {"sig": sig, "rid": report_id})
+    await db.execute(q, {"sig": sig, "sig_version": SIG_VERSION, "rid": report_id})
     await db.commit()
@@ -0,0 +1,266 @@
+# app/services/report_queue.py
+"""
+Ingestion write-behind de POST /report (REPORT_INGEST_MODE=queue).
+
+Mode sync (défaut) : une requête SQL par report, mais une connexion tenue
+par requête HTTP. Sous rafale → pool saturé, timeouts.
+Mode queue :
+  - POST /report valide, écrit une ligne dans report_queue (1 INSERT, 1 commit)
+    et répond 202 avec l'id du report, attribué dès l'enqueue
+  - REPORT_QUEUE_WORKERS tâches vident la file par lots de REPORT_QUEUE_BATCH :
+      1) bail : UPDATE … claimed_at (FOR UPDATE SKIP LOCKED → workers et
+         process concurrents ne prennent jamais la même ligne)
+      2) ingest_reports (services/ingest.py) : même logique que /reports/batch
+      3) DELETE des lignes traitées
+    2) et 3) dans une seule transaction (reports, outages / incidents et
+    suppression de la file commités ensemble) : crash ou erreur avant le
+    commit → rien n'est stocké, le bail expire, le lot est rejoué en entier
+    (effets compris). L'id pré-attribué (ON CONFLICT (id) DO NOTHING) reste
+    une garde contre les doublons.
+  - lot en échec → rejoué item par item (un item empoisonné ne bloque pas
+    les autres) ; après REPORT_QUEUE_MAX_ATTEMPTS l'item reste en lettre morte
+
+Idempotence : la clé (idempotency_keys, services/idempotency.py) est prise
+dans la transaction de l'enqueue, avec la réponse 202 (même id) → un retry
+rejoue cette réponse au lieu d'enfiler un second report.
+
+Différence avec le mode sync : un 'restored' sans ownership n'obtient pas de
+403 (la vérification se fait au drain) ; le report est stocké, sans effet
+sur les évènements — comme en mode sync, où l'insert précède le 403.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import SessionLocal
+from app.services import known_users
+from app.services import idempotency
+from app.services.ingest import ingest_reports
+from app.services.map_cache import invalidate_point as map_cache_invalidate_point
+
+REPORT_INGEST_MODE        = os.getenv("REPORT_INGEST_MODE", "sync").strip().lower()   # sync | queue
+REPORT_QUEUE_WORKERS      = int(os.getenv("REPORT_QUEUE_WORKERS", "2"))
+REPORT_QUEUE_BATCH        = int(os.getenv("REPORT_QUEUE_BATCH", "100"))
+REPORT_QUEUE_POLL_S       = float(os.getenv("REPORT_QUEUE_POLL_S", "1"))
+REPORT_QUEUE_LEASE_S      = int(os.getenv("REPORT_QUEUE_LEASE_S", "60"))
+REPORT_QUEUE_MAX_ATTEMPTS = int(os.getenv("REPORT_QUEUE_MAX_ATTEMPTS", "5"))
+OWNERSHIP_RADIUS_M        = int(os.getenv("OWNERSHIP_RADIUS_M", "150"))
+
+_CLAIM_SQL = text("""
+    UPDATE report_queue q
+       SET claimed_at = NOW(), attempts = q.attempts + 1
+      FROM (
+        SELECT id FROM report_queue
+         WHERE attempts < :max_attempts
+           AND (claimed_at IS NULL OR claimed_at < NOW() - make_interval(secs => :lease))
+         ORDER BY id
+         LIMIT :n
+         FOR UPDATE SKIP LOCKED
+      ) c
+     WHERE q.id = c.id
+    RETURNING q.id, q.payload
+""")
+
+_tasks: List[asyncio.Task] = []
+_wake: Optional[asyncio.Event] = None
+_lags_ms: deque = deque(maxlen=1000)
+_stats: Dict[str, Any] = {
+    "enqueued": 0, "drained": 0, "batches": 0, "errors": 0,
+    "last_error": None, "last_drain_at": None,
+}
+
+
+def queue_mode() -> bool:
+    return REPORT_INGEST_MODE == "queue"
+
+
+_ENQUEUE_SQL = text(f"""
+    WITH claim AS (
+      INSERT INTO idempotency_keys(scope, key, completed_at, status_code, response)
+      SELECT :scope, CAST(:idem AS text), NOW(), 202, CAST(:resp AS jsonb)
+       WHERE CAST(:idem AS text) IS NOT NULL
+      ON CONFLICT (scope, key) DO UPDATE
+         SET created_at = NOW(), completed_at = NOW(),
+             status_code = EXCLUDED.status_code, response = EXCLUDED.response
+       -- reprise d'une clé abandonnée (même règle que idempotency.claim)
+       WHERE idempotency_keys.completed_at IS NULL
+         AND idempotency_keys.created_at < NOW() - INTERVAL '{idempotency.IDEMPOTENCY_INFLIGHT_S} seconds'
+      RETURNING key
+    ),
+    q AS (
+      INSERT INTO report_queue(payload)
+      SELECT CAST(:p AS jsonb)
+       WHERE CAST(:idem AS text) IS NULL OR EXISTS (SELECT 1 FROM claim)
+      RETURNING id
+    )
+    SELECT (SELECT id FROM q) AS qid, k.status_code AS prev_status, k.response AS prev_response
+      FROM (SELECT 1) one
+      LEFT JOIN idempotency_keys k
+        ON k.scope = :scope AND k.key = CAST(:idem AS text) AND NOT EXISTS (SELECT 1 FROM claim)
+""")
+
+
+async def enqueue_report(db: AsyncSession, item: Dict[str, Any]) -> tuple:
+    """
+    Stocke un report validé (format ingest_reports). Commit.
+    Retourne (body 202, None) ; si sa idempotency_key est déjà prise :
+    (None, (status_code, body) d'origine — status_code None si encore en cours).
+    """
+    item = {**item, "id": item.get("id") or str(uuid.uuid4())}
+    idem = item.get("idempotency_key")
+    body = {"ok": True, "queued": True, "id": item["id"], "idempotency_key": idem}
+    row = (await db.execute(_ENQUEUE_SQL, {
+        "p": json.dumps(item), "idem": idem, "scope": idempotency.SCOPE_REPORT,
+        "resp": json.dumps(body),
+    })).first()
+    await db.commit()
+    if row.qid is None:
+        # clé commitée par un autre après notre instantané : relue
+        if row.prev_status is not None:
+            prev = idempotency.replayed((row.prev_status, row.prev_response))
+        else:
+            prev = await idempotency.lookup(db, idempotency.SCOPE_REPORT, idem) or (None, None)
+        if prev[0] is not None:
+            idempotency.remember(idempotency.SCOPE_REPORT, idem, *prev)
+        return None, prev
+    idempotency.remember(idempotency.SCOPE_REPORT, idem, 202, body)
+    _stats["enqueued"] += 1
+    if _wake is not None:
+        _wake.set()
+    return body, None
+
+
+async def _process(db: AsyncSession, rows: List[Any]) -> None:
+    items = []
+    for r in rows:
+        payload = r.payload if isinstance(r.payload, dict) else json.loads(r.payload)
+        items.append({**payload, "index": r.id})
+    # pas de commit dans ingest_reports : reports + évènements + DELETE ci-dessous, un commit
+    out = await ingest_reports(db, items, ownership_radius_m=OWNERSHIP_RADIUS_M, commit=False)
+    res = await db.execute(text("""
+        DELETE FROM report_queue
+         WHERE id = ANY(:ids)
+        RETURNING EXTRACT(EPOCH FROM (clock_timestamp() - enqueued_at)) * 1000.0 AS lag_ms
+    """), {"ids": [r.id for r in rows]})
+    _lags_ms.extend(float(x.lag_ms) for x in res)
+    await db.commit()
+    for it in out["created"]:
+        known_users.add(it["user_id"])
+        map_cache_invalidate_point(it["lat"], it["lng"])
+    _stats["drained"] += len(rows)
+
+
+async def _release(db: AsyncSession, ids: List[int], error: str) -> None:
+    await db.execute(text("""
+        UPDATE report_queue SET claimed_at = NULL, last_error = :err WHERE id = ANY(:ids)
+    """), {"ids": ids, "err": error[:1000]})
+    await db.commit()
+
+
+async def drain_once(db: AsyncSession, limit: int = REPORT_QUEUE_BATCH) -> int:
+    """Un lot : bail → ingestion → suppression. Retourne le nombre de lignes prises."""
+    rows = (await db.execute(_CLAIM_SQL, {
+        "n": int(limit), "lease": REPORT_QUEUE_LEASE_S, "max_attempts": REPORT_QUEUE_MAX_ATTEMPTS,
+    })).fetchall()
+    await db.commit()
+    if not rows:
+        return 0
+    _stats["batches"] += 1
+    _stats["last_drain_at"] = time.time()
+    try:
+        await _process(db, rows)
+    except Exception as e:
+        await db.rollback()
+        _stats["errors"] += 1
+        _stats["last_error"] = f"{type(e).__name__}: {e}"
+        print(f"[report-queue] batch of {len(rows)} failed: {e}")
+        if len(rows) == 1:
+            await _release(db, [rows[0].id], f"{type(e).__name__}: {e}")
+            return 1
+        # item par item : seul l'item fautif reste en file (attempts++)
+        for r in rows:
+            try:
+                await _process(db, [r])
+            except Exception as e1:
+                await db.rollback()
+                await _release(db, [r.id], f"{type(e1).__name__}: {e1}")
+    return len(rows)
+
+
+async def _worker(n: int) -> None:
+    while True:
+        # effacé AVANT le lot : un enqueue pendant le drain laisse l'évènement
+        # levé → lot suivant sans attendre REPORT_QUEUE_POLL_S
+        _wake.clear()
+        try:
+            async with SessionLocal() as db:
+                taken = await drain_once(db)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            taken = 0
+            _stats["errors"] += 1
+            _stats["last_error"] = f"{type(e).__name__}: {e}"
+            print(f"[report-queue] worker {n} error: {e}")
+        if taken >= REPORT_QUEUE_BATCH:
+            continue                    # file encore pleine : lot suivant sans attendre
+        try:
+            await asyncio.wait_for(_wake.wait(), REPORT_QUEUE_POLL_S)
+        except asyncio.TimeoutError:
+            pass                        # poll : lignes enqueued par un autre process
+
+
+async def start() -> None:
+    global _wake
+    if not queue_mode() or _tasks:
+        return
+    _wake = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    _tasks.extend(loop.create_task(_worker(i)) for i in range(max(1, REPORT_QUEUE_WORKERS)))
+    print(f"[report-queue] {len(_tasks)} workers, batch {REPORT_QUEUE_BATCH}")
+
+
+async def stop() -> None:
+    for t in _tasks:
+        t.cancel()
+    for t in _tasks:
+        try:
+            await t
+        except BaseException:
+            pass
+    _tasks.clear()
+
+
+def _pct(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    s = sorted(values)
+    return round(s[min(len(s) - 1, int(p * len(s)))], 1)
+
+
+async def queue_stats(db: AsyncSession) -> Dict[str, Any]:
+    row = (await db.execute(text("""
+        SELECT COUNT(*) FILTER (WHERE attempts < :max_attempts)::int  AS depth,
+               COUNT(*) FILTER (WHERE attempts >= :max_attempts)::int AS dead,
+               COUNT(*) FILTER (WHERE claimed_at IS NOT NULL
+                                  AND attempts < :max_attempts)::int  AS in_flight,
+               EXTRACT(EPOCH FROM (NOW() - MIN(enqueued_at)
+                                   FILTER (WHERE attempts < :max_attempts)))::float AS oldest_s
+          FROM report_queue
+    """), {"max_attempts": REPORT_QUEUE_MAX_ATTEMPTS})).mappings().first()
+    lags = list(_lags_ms)
+    return {
+        "mode": REPORT_INGEST_MODE,
+        "workers": len(_tasks),
+        **dict(row),
+        # délai enqueue → traitement, sur les 1000 derniers reports de ce worker
+        "drain_lag_ms": {"p50": _pct(lags, 0.5), "p95": _pct(lags, 0.95), "max": _pct(lags, 1.0)},
+        **_stats,
+    }
@@ -0,0 +1,110 @@
+# app/services/schema_registry.py
+"""
+Métadonnées du schéma lues une fois (démarrage, ou à la demande) au lieu
+d'être sondées à chaque requête.
+
+Avant :
+  - crud.insert_report : 4 requêtes catalogue (pg_attribute / pg_enum) par report
+  - POST /report, ingest : CAST enum tenté, échec + rollback, retry en text
+  - /cta/incidents : requête avec reports.status, rejouée sans si elle échoue
+Maintenant : un instantané {table: {colonne: type}} + {enum: [labels]}, chargé
+au démarrage (lifespan) et rechargé après /admin/ensure_schema. Sans
+instantané (démarrage raté), le premier appelant le charge avec sa session.
+
+L'instantané est immuable : un rechargement le remplace, `version` change
+→ les variantes SQL mises en cache sur (… , version) sont reconstruites.
+"""
+import time
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import SessionLocal
+
+TABLES = ("reports", "outages", "incidents", "attachments", "app_users", "report_events")
+
+_COLUMNS_SQL = text("""
+    SELECT c.relname AS tbl, a.attname AS col, t.typname AS typ
+      FROM pg_attribute a
+      JOIN pg_class c     ON c.oid = a.attrelid
+      JOIN pg_namespace n ON n.oid = c.relnamespace
+      JOIN pg_type t      ON t.oid = a.atttypid
+     WHERE n.nspname = 'public'
+       AND c.relname = ANY(:tables)
+       AND a.attnum > 0 AND NOT a.attisdropped
+""")
+
+_ENUMS_SQL = text("""
+    SELECT t.typname AS typ, array_agg(e.enumlabel::text ORDER BY e.enumsortorder) AS labels
+      FROM pg_type t
+      JOIN pg_enum e ON e.enumtypid = t.oid
+     GROUP BY t.typname
+""")
+
+
+class SchemaRegistry:
+    def __init__(self, columns: Dict[str, Dict[str, str]], enums: Dict[str, List[str]], version: int):
+        self.columns = columns
+        self.enums = enums
+        self.version = version
+        self.loaded_at = time.time()
+
+    def has_column(self, table: str, column: str) -> bool:
+        return column in self.columns.get(table, {})
+
+    def column_type(self, table: str, column: str) -> Optional[str]:
+        return self.columns.get(table, {}).get(column)
+
+    def cast_type(self, table: str, column: str) -> str:
+        """Type à utiliser dans CAST(:x AS …) pour table.column : son enum, sinon text."""
+        typ = self.column_type(table, column)
+        return typ if typ in self.enums else "text"
+
+    def enum_labels(self, typname: str) -> List[str]:
+        return list(self.enums.get(typname, []))
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "columns": {t: dict(sorted(cols.items())) for t, cols in sorted(self.columns.items())},
+            "enums": self.enums,
+        }
+
+
+_current: Optional[SchemaRegistry] = None
+_loads = 0
+
+
+async def load(db: AsyncSession) -> SchemaRegistry:
+    """(Re)lit le catalogue avec la session fournie et remplace l'instantané."""
+    global _current, _loads
+    columns: Dict[str, Dict[str, str]] = {}
+    for r in await db.execute(_COLUMNS_SQL, {"tables": list(TABLES)}):
+        columns.setdefault(r.tbl, {})[r.col] = r.typ
+    enums = {r.typ: list(r.labels) for r in await db.execute(_ENUMS_SQL)}
+    _loads += 1
+    _current = SchemaRegistry(columns, enums, _loads)
+    return _current
+
+
+async def get(db: AsyncSession) -> SchemaRegistry:
+    """Instantané courant ; chargé avec `db` s'il n'existe pas encore."""
+    return _current if _current is not None else await load(db)
+
+
+async def refresh() -> SchemaRegistry:
+    async with SessionLocal() as db:
+        return await load(db)
+
+
+async def start() -> None:
+    reg = await refresh()
+    print(f"[schema] {sum(len(c) for c in reg.columns.values())} columns, {len(reg.enums)} enums")
+
+
+def registry_status() -> Dict[str, Any]:
+    if _current is None:
+        return {"loaded": False}
+    return {"loaded": True, **_current.status()}
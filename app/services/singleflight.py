@@ -0,0 +1,119 @@
+# app/services/singleflight.py
+"""
+Single-flight : requêtes identiques simultanées → une seule exécution.
+
+Le premier appel pour une clé (le « leader ») exécute la requête ; les appels
+concurrents sur la même clé attendent son résultat (au plus SINGLEFLIGHT_WAIT_S)
+au lieu de relancer la même requête PostGIS.
+
+- on partage des données (dict / list / bytes), jamais un objet Response :
+  chaque requête construit ses propres en-têtes
+- le résultat partagé est en lecture seule (copier avant de le modifier)
+- leader en échec (ex. statement timeout sous charge) → ses suiveurs reçoivent
+  la même exception : pas N relances simultanées au pire moment
+- attente dépassée ou leader annulé → le suiveur exécute lui-même
+- rien n'est gardé après la fin de l'exécution (ce n'est pas un cache)
+
+Local au worker, comme map_cache.
+"""
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "1") != "0"
+SINGLEFLIGHT_WAIT_S  = float(os.getenv("SINGLEFLIGHT_WAIT_S", "5"))
+# normalisation des coordonnées dans les clés : 5 décimales ≈ 1 m
+SINGLEFLIGHT_COORD_DECIMALS = int(os.getenv("SINGLEFLIGHT_COORD_DECIMALS", "5"))
+
+
+def norm_point(lat: float, lng: float) -> tuple:
+    return (round(float(lat), SINGLEFLIGHT_COORD_DECIMALS), round(float(lng), SINGLEFLIGHT_COORD_DECIMALS))
+
+
+def _consume(fut: asyncio.Future) -> None:
+    # évite "Future exception was never retrieved" quand personne n'attendait
+    if not fut.cancelled():
+        fut.exception()
+
+
+class SingleFlight:
+    def __init__(self, name: str, wait_s: float = SINGLEFLIGHT_WAIT_S):
+        self.name = name
+        self.wait_s = float(wait_s)
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.executions = 0     # exécutions réelles (leaders)
+        self.shared = 0         # requêtes servies par l'exécution d'un autre = exécutions économisées
+        self.timeouts = 0       # attente > wait_s → exécution propre
+        self.fallbacks = 0      # leader annulé → exécution propre
+        self.errors_shared = 0  # exception du leader transmise à un suiveur
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        if not SINGLEFLIGHT_ENABLED:
+            return await fn(*args, **kwargs)
+
+        fut = self._inflight.get(key)
+        if fut is not None:
+            try:
+                result = await asyncio.wait_for(asyncio.shield(fut), self.wait_s)
+                self.shared += 1
+                return result
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+            except asyncio.CancelledError:
+                if not fut.cancelled():
+                    raise           # c'est nous qui sommes annulés
+                self.fallbacks += 1
+            except Exception:
+                self.errors_shared += 1
+                raise
+            self.executions += 1
+            return await fn(*args, **kwargs)
+
+        fut = asyncio.get_running_loop().create_future()
+        fut.add_done_callback(_consume)
+        self._inflight[key] = fut
+        self.executions += 1
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            if self._inflight.get(key) is fut:
+                del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.executions + self.shared
+        return {
+            "executions": self.executions,
+            "shared": self.shared,
+            "timeouts": self.timeouts,
+            "fallbacks": self.fallbacks,
+            "errors_shared": self.errors_shared,
+            "inflight": len(self._inflight),
+            "saved_ratio": round(self.shared / total, 4) if total else 0.0,
+        }
+
+
+_groups: Dict[str, SingleFlight] = {}
+
+
+def group(name: str) -> SingleFlight:
+    g = _groups.get(name)
+    if g is None:
+        g = _groups[name] = SingleFlight(name)
+    return g
+
+
+def singleflight_stats() -> Dict[str, Any]:
+    return {
+        "enabled": SINGLEFLIGHT_ENABLED,
+        "wait_s": SINGLEFLIGHT_WAIT_S,
+        "groups": {name: g.stats() for name, g in sorted(_groups.items())},
+    }
@@ -0,0 +1,429 @@
+# app/services/spatial_index.py
+"""
+Index spatial en mémoire des évènements actifs (outages / incidents) et des
+acks pompiers — petit ensemble très lu, interrogé à chaque /map.
+
+- grille régulière (SPATIAL_INDEX_CELL_DEG) : cellule → {id: item}, les items
+  sont déjà au format de fetch_outages / fetch_incidents
+- chargé au démarrage, puis tenu à jour par LISTEN ayii_spatial
+  (triggers de la migration 0005) : chaque notification porte (table, id),
+  la ligne est relue par lots → payload NOTIFY minuscule, format exact
+- contrôle de cohérence périodique (count / somme des ids / max(updated_at))
+  → rechargement complet si l'index a divergé
+- repli SQL (les fonctions renvoient None) tant que l'index n'est pas chargé,
+  si la connexion LISTEN est tombée ou si des notifications attendent depuis
+  plus de SPATIAL_INDEX_MAX_LAG_S
+
+Distance : haversine (sphère) vs ST_DWithin (sphéroïde) → écart < 0,5 % en
+bord de rayon, sans effet visible sur la carte.
+
+LISTEN exige une connexion directe (pas pgBouncer en mode transaction) :
+SPATIAL_INDEX_LISTEN_URL si DATABASE_URL pointe sur le pooler.
+"""
+import asyncio
+import json
+import math
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.services.map_cache import haversine_m
+
+SPATIAL_INDEX_ENABLED    = os.getenv("SPATIAL_INDEX_ENABLED", "0") == "1"
+SPATIAL_INDEX_CELL_DEG   = float(os.getenv("SPATIAL_INDEX_CELL_DEG", "0.01"))    # ≈1.1 km
+SPATIAL_INDEX_CHECK_S    = float(os.getenv("SPATIAL_INDEX_CHECK_S", "60"))
+SPATIAL_INDEX_MAX_LAG_S  = float(os.getenv("SPATIAL_INDEX_MAX_LAG_S", "2"))
+SPATIAL_INDEX_BATCH_MS   = float(os.getenv("SPATIAL_INDEX_BATCH_MS", "50"))
+SPATIAL_INDEX_LISTEN_URL = (os.getenv("SPATIAL_INDEX_LISTEN_URL") or "").strip() or None
+
+CHANNEL = "ayii_spatial"        # = migration 0005
+EVENT_TABLES = ("outages", "incidents")
+
+
+class _Grid:
+    """Grille lat/lng → {id: item} ; pas de verrou (boucle asyncio unique)."""
+
+    def __init__(self, cell_deg: float):
+        self.cell = cell_deg
+        self.cells: Dict[Tuple[int, int], dict] = {}
+        self.items: Dict[int, Tuple[Tuple[int, int], dict]] = {}
+
+    def _key(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell), math.floor(lng / self.cell))
+
+    def put(self, id_: int, item: dict) -> None:
+        self.remove(id_)
+        k = self._key(item["lat"], item["lng"])
+        self.cells.setdefault(k, {})[id_] = item
+        self.items[id_] = (k, item)
+
+    def remove(self, id_: int) -> None:
+        old = self.items.pop(id_, None)
+        if old is None:
+            return
+        bucket = self.cells.get(old[0])
+        if bucket is not None:
+            bucket.pop(id_, None)
+            if not bucket:
+                del self.cells[old[0]]
+
+    def query(self, lat: float, lng: float, r_m: float) -> List[dict]:
+        d_lat = r_m / 111_320.0
+        d_lng = d_lat / max(0.01, math.cos(math.radians(lat)))
+        i0, j0 = self._key(lat - d_lat, lng - d_lng)
+        i1, j1 = self._key(lat + d_lat, lng + d_lng)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self.cells):
+            buckets = [b for (i, j), b in self.cells.items() if i0 <= i <= i1 and j0 <= j <= j1]
+        else:
+            buckets = [b for b in (self.cells.get((i, j)) for i in range(i0, i1 + 1)
+                                   for j in range(j0, j1 + 1)) if b]
+        return [it for b in buckets for it in b.values()
+                if haversine_m(lat, lng, it["lat"], it["lng"]) <= r_m]
+
+    def values(self):
+        return (it for _, it in self.items.values())
+
+
+_grids: Dict[str, _Grid] = {}
+_updated: Dict[str, Dict[int, Optional[datetime]]] = {}   # updated_at par id (contrôle de cohérence)
+_pending: Dict[str, set] = {}
+_state = {
+    "ready": False,
+    "listening": False,
+    "loaded_at": None,          # time.time()
+    "load_ms": None,
+    "pending_since": None,      # time.monotonic() de la plus vieille notification non appliquée
+    "reload_requested": False,
+    "notifications": 0,
+    "applied": 0,
+    "reloads": 0,
+    "drift": 0,
+    "errors": 0,
+    "hits": 0,
+    "fallbacks": 0,
+    "last_check": None,
+}
+_wake: Optional[asyncio.Event] = None
+_tasks: List[asyncio.Task] = []
+
+
+def _event_sql(table: str, where: str) -> str:
+    return f"""
+        SELECT e.id,
+               e.kind::text AS kind,
+               e.restored_at,
+               ST_Y((e.center::geometry)) AS lat,
+               ST_X((e.center::geometry)) AS lng,
+               e.started_at,
+               COALESCE(e.attachments_count, 0)::int AS attachments_count,
+               COALESCE(e.reports_count, 0)::int AS reports_count,
+               e.updated_at
+          FROM {table} e
+         WHERE {where}
+    """
+
+
+_ACKS_SQL = """
+    SELECT ak.id, ak.kind,
+           ST_Y((ak.geom::geometry)) AS lat,
+           ST_X((ak.geom::geometry)) AS lng
+      FROM acks ak
+     WHERE ak.geom IS NOT NULL AND {where}
+"""
+
+
+def _event_item(r) -> dict:
+    # même format que fetch_outages / fetch_incidents (app/routes/map.py)
+    return {
+        "id": r.id, "kind": r.kind, "status": "active",
+        "lat": float(r.lat), "lng": float(r.lng),
+        "started_at": r.started_at,
+        "restored_at": None,
+        "attachments_count": r.attachments_count,
+        "reports_count": r.reports_count,
+    }
+
+
+async def load_all() -> None:
+    """(Re)chargement complet ; les nouvelles grilles remplacent les anciennes d'un coup."""
+    from app.db import SessionLocal
+
+    t0 = time.perf_counter()
+    grids = {t: _Grid(SPATIAL_INDEX_CELL_DEG) for t in (*EVENT_TABLES, "acks")}
+    updated: Dict[str, Dict[int, Optional[datetime]]] = {t: {} for t in EVENT_TABLES}
+    async with SessionLocal() as db:
+        for t in EVENT_TABLES:
+            res = await db.execute(text(_event_sql(t, "e.restored_at IS NULL")))
+            for r in res.fetchall():
+                grids[t].put(r.id, _event_item(r))
+                updated[t][r.id] = r.updated_at
+        res = await db.execute(text(_ACKS_SQL.format(where="TRUE")))
+        for r in res.fetchall():
+            grids["acks"].put(r.id, {"id": r.id, "kind": r.kind, "lat": float(r.lat), "lng": float(r.lng)})
+    _grids.clear()
+    _grids.update(grids)
+    _updated.clear()
+    _updated.update(updated)
+    _state.update({
+        "ready": True,
+        "loaded_at": time.time(),
+        "load_ms": round((time.perf_counter() - t0) * 1000.0, 1),
+        "reload_requested": False,
+    })
+    _state["reloads"] += 1
+
+
+async def _apply_pending() -> None:
+    from app.db import SessionLocal
+
+    batch = {t: ids for t, ids in _pending.items() if ids}
+    _pending.clear()
+    since = _state["pending_since"]
+    _state["pending_since"] = None
+    if not batch:
+        return
+    try:
+        async with SessionLocal() as db:
+            for t, ids in batch.items():
+                params = {"ids": list(ids)}
+                if t == "acks":
+                    res = await db.execute(text(_ACKS_SQL.format(where="ak.id = ANY(:ids)")), params)
+                    seen = set()
+                    for r in res.fetchall():
+                        _grids["acks"].put(r.id, {"id": r.id, "kind": r.kind,
+                                                  "lat": float(r.lat), "lng": float(r.lng)})
+                        seen.add(r.id)
+                else:
+                    res = await db.execute(text(_event_sql(t, "e.id = ANY(:ids)")), params)
+                    seen = set()
+                    for r in res.fetchall():
+                        seen.add(r.id)
+                        if r.restored_at is None:
+                            _grids[t].put(r.id, _event_item(r))
+                            _updated[t][r.id] = r.updated_at
+                        else:
+                            _grids[t].remove(r.id)
+                            _updated[t].pop(r.id, None)
+                for id_ in ids - seen:          # supprimés (ou ack sans géométrie)
+                    _grids[t].remove(id_)
+                    _updated.get(t, {}).pop(id_, None)
+                _state["applied"] += len(ids)
+    except Exception as e:
+        # on remet le lot en attente : l'index reste « en retard » → repli SQL
+        for t, ids in batch.items():
+            _pending.setdefault(t, set()).update(ids)
+        _state["pending_since"] = since or time.monotonic()
+        _state["errors"] += 1
+        print(f"[spatial-index] apply error: {e}")
+        await asyncio.sleep(1.0)
+
+
+def _on_notify(payload: str) -> None:
+    _state["notifications"] += 1
+    try:
+        msg = json.loads(payload)
+        t = msg["t"]
+    except Exception:
+        return
+    if t not in _grids:
+        return
+    if msg.get("reset"):
+        _state["reload_requested"] = True
+    else:
+        _pending.setdefault(t, set()).add(int(msg["id"]))
+    if _state["pending_since"] is None:
+        _state["pending_since"] = time.monotonic()
+    if _wake is not None:
+        _wake.set()
+
+
+async def _apply_loop() -> None:
+    while True:
+        await _wake.wait()
+        await asyncio.sleep(SPATIAL_INDEX_BATCH_MS / 1000.0)    # regroupe les rafales
+        _wake.clear()
+        if _state["reload_requested"]:
+            _pending.clear()
+            _state["pending_since"] = None
+            try:
+                await load_all()
+            except Exception as e:
+                _state["errors"] += 1
+                print(f"[spatial-index] reload error: {e}")
+                _wake.set()
+                await asyncio.sleep(1.0)
+            continue
+        await _apply_pending()
+        if _state["pending_since"] is not None:
+            _wake.set()
+
+
+def _listen_conninfo() -> str:
+    from sqlalchemy.engine import make_url
+    from app.db import DATABASE_URL
+
+    url = make_url(SPATIAL_INDEX_LISTEN_URL or DATABASE_URL)
+    return url.set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+async def _listen_loop() -> None:
+    import psycopg
+
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(_listen_conninfo(), autocommit=True) as conn:
+                await conn.execute(f"LISTEN {CHANNEL}")
+                # chargement APRÈS le LISTEN : aucune écriture ne passe entre les deux
+                await load_all()
+                _state["listening"] = True
+                print(f"[spatial-index] loaded in {_state['load_ms']} ms, listening on {CHANNEL}")
+                async for n in conn.notifies():
+                    _on_notify(n.payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _state["errors"] += 1
+            print(f"[spatial-index] listener error: {e}")
+        _state.update({"ready": False, "listening": False})
+        await asyncio.sleep(5.0)
+
+
+async def _db_fingerprint() -> dict:
+    from app.db import SessionLocal
+
+    out = {}
+    async with SessionLocal() as db:
+        for t in EVENT_TABLES:
+            r = (await db.execute(text(f"""
+                SELECT COUNT(*)::bigint AS n, COALESCE(SUM(id), 0)::bigint AS s, MAX(updated_at) AS u
+                  FROM {t} WHERE restored_at IS NULL
+            """))).first()
+            out[t] = (r.n, r.s, r.u)
+        r = (await db.execute(text(
+            "SELECT COUNT(*)::bigint AS n, COALESCE(SUM(id), 0)::bigint AS s FROM acks WHERE geom IS NOT NULL"
+        ))).first()
+        out["acks"] = (r.n, r.s, None)
+    return out
+
+
+def _index_fingerprint() -> dict:
+    out = {}
+    for t in EVENT_TABLES:
+        ids = _grids[t].items.keys()
+        upd = [u for u in _updated[t].values() if u is not None]
+        out[t] = (len(ids), sum(ids), max(upd) if upd else None)
+    acks = _grids["acks"].items.keys()
+    out["acks"] = (len(acks), sum(acks), None)
+    return out
+
+
+async def check_consistency() -> bool:
+    """Compare l'index à la base ; recharge si divergence persistante. True = cohérent."""
+    if not _state["ready"] or _state["pending_since"] is not None:
+        return True         # notifications en vol : on vérifiera au prochain tour
+    db_fp = await _db_fingerprint()
+    ok = db_fp == _index_fingerprint()
+    if not ok:
+        # une écriture a pu committer entre les deux lectures : on laisse passer ses notifications
+        await asyncio.sleep(max(0.5, 2 * SPATIAL_INDEX_BATCH_MS / 1000.0))
+        if _state["pending_since"] is None:
+            ok = await _db_fingerprint() == _index_fingerprint()
+    _state["last_check"] = time.time()
+    if not ok:
+        _state["drift"] += 1
+        print("[spatial-index] drift detected, reloading")
+        await load_all()
+    return ok
+
+
+async def _check_loop() -> None:
+    while True:
+        await asyncio.sleep(SPATIAL_INDEX_CHECK_S)
+        try:
+            await check_consistency()
+        except Exception as e:
+            _state["errors"] += 1
+            print(f"[spatial-index] check error: {e}")
+
+
+async def start() -> None:
+    global _wake
+    if not SPATIAL_INDEX_ENABLED or _tasks:
+        return
+    _wake = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    _tasks.extend([
+        loop.create_task(_listen_loop()),
+        loop.create_task(_apply_loop()),
+        loop.create_task(_check_loop()),
+    ])
+
+
+async def stop() -> None:
+    for t in _tasks:
+        t.cancel()
+    for t in _tasks:
+        try:
+            await t
+        except BaseException:
+            pass
+    _tasks.clear()
+    _state.update({"ready": False, "listening": False})
+
+
+# ---------- lectures ----------
+def usable() -> bool:
+    if not (SPATIAL_INDEX_ENABLED and _state["ready"] and _state["listening"]):
+        return False
+    since = _state["pending_since"]
+    return since is None or time.monotonic() - since <= SPATIAL_INDEX_MAX_LAG_S
+
+
+def _sorted_events(items) -> List[dict]:
+    # ORDER BY started_at DESC NULLS LAST, id DESC
+    return sorted((dict(it) for it in items),
+                  key=lambda it: (it["started_at"] is not None, it["started_at"] or datetime.min, it["id"]),
+                  reverse=True)
+
+
+def query_events(table: str, lat: float, lng: float, r_m: float) -> Optional[List[dict]]:
+    """Évènements actifs à ≤ r_m (format fetch_outages) ; None → passer par SQL."""
+    if not usable():
+        _state["fallbacks"] += 1
+        return None
+    _state["hits"] += 1
+    return _sorted_events(_grids[table].query(lat, lng, r_m))
+
+
+def active_events(table: str, limit: int) -> Optional[List[dict]]:
+    """Tous les évènements actifs (show_all), même tri / cap que fetch_*_all."""
+    if not usable():
+        _state["fallbacks"] += 1
+        return None
+    _state["hits"] += 1
+    return _sorted_events(_grids[table].values())[:limit]
+
+
+def acked_near(kind: str, lat: float, lng: float, r_m: float) -> Optional[bool]:
+    """Un ack du même type à ≤ r_m ? None → passer par SQL."""
+    if not usable():
+        return None
+    return any(a["kind"] == kind for a in _grids["acks"].query(lat, lng, r_m))
+
+
+def merge_events(active: List[dict], restored: List[dict]) -> List[dict]:
+    """Actifs (index) + clos (SQL), dans l'ordre de /map."""
+    return _sorted_events(active + restored)
+
+
+def index_stats() -> dict:
+    return {
+        "enabled": SPATIAL_INDEX_ENABLED,
+        "usable": usable(),
+        "sizes": {t: len(g.items) for t, g in _grids.items()},
+        "pending": sum(len(v) for v in _pending.values()),
+        **{k: v for k, v in _state.items() if k not in ("pending_since", "reload_requested")},
+    }
@@ -0,0 +1,303 @@
+# app/services/verify.py
+"""
+Vérification en masse des signatures HMAC des reports (migration 0008).
+
+Un passage = une plage created_at [from_ts, to_ts[ :
+  1) lecture en flux (curseur serveur, VERIFY_CHUNK lignes à la fois) des
+     reports signés de la plage — jamais toute la plage en mémoire
+  2) chaque lot part dans un ProcessPoolExecutor (integrity.verify_chunk :
+     canonical() dans la forme de reports.sig_version + HMAC) → le calcul ne tient ni la boucle asyncio ni le GIL
+     du process web ; au plus VERIFY_MAX_INFLIGHT lots en vol (la lecture
+     attend les process, pas l'inverse)
+  3) écarts → integrity_audit ; progression + débit (lignes/s) → integrity_runs
+     après chaque lot, visibles de tous les workers
+
+Deux entrées :
+  - API (routes/integrity.py) : start_job() lance le passage en tâche de fond,
+    registre _jobs local au worker (annulation seulement sur le worker qui
+    l'exécute, au plus VERIFY_MAX_JOBS à la fois)
+  - CLI : python -m app.services.verify [--from …] [--to …] [--days 30]
+
+Process créés en « spawn » (pas de fork d'un process qui a déjà des threads
+et des connexions ouvertes), à la première vérification.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import SessionLocal
+from app.services import schema_registry
+from app.services.integrity import verify_chunk
+
+VERIFY_CHUNK        = int(os.getenv("VERIFY_CHUNK", "5000"))
+VERIFY_PROCESSES    = int(os.getenv("VERIFY_PROCESSES", "0")) or max(1, (os.cpu_count() or 2) - 1)
+VERIFY_MAX_INFLIGHT = int(os.getenv("VERIFY_MAX_INFLIGHT", "0")) or 2 * VERIFY_PROCESSES
+VERIFY_MAX_JOBS     = int(os.getenv("VERIFY_MAX_JOBS", "1"))
+VERIFY_STALE_S      = int(os.getenv("VERIFY_STALE_S", "600"))   # 'running' sans progrès → 'stalled'
+
+_pool: Optional[ProcessPoolExecutor] = None
+_jobs: Dict[int, asyncio.Task] = {}
+_start_lock = asyncio.Lock()     # contrôle VERIFY_MAX_JOBS → create_run → enregistrement, d'un bloc
+
+_AUDIT_SQL = text("""
+    INSERT INTO integrity_audit(run_id, report_id, stored_signature, expected_signature)
+    VALUES (:run_id, CAST(:rid AS uuid), :stored, :expected)
+""")
+
+_PROGRESS_SQL = text("""
+    UPDATE integrity_runs
+       SET scanned = :scanned, mismatches = :mismatches, rows_per_s = :rps, updated_at = NOW()
+     WHERE id = :run_id
+""")
+
+_RUN_COLS = f"""
+    id, from_ts, to_ts, source, scanned, mismatches, rows_per_s, error,
+    started_at, updated_at, finished_at,
+    CASE WHEN status = 'running' AND updated_at < NOW() - INTERVAL '{VERIFY_STALE_S} seconds'
+         THEN 'stalled' ELSE status END AS status
+"""
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=VERIFY_PROCESSES, mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def _stream_sql(reg: schema_registry.SchemaRegistry):
+    if not reg.has_column("reports", "signature"):
+        raise RuntimeError("reports.signature missing")
+
+    def opt(col: str, typ: str) -> str:
+        return col if reg.has_column("reports", col) else f"NULL::{typ}"
+
+    # ordre des colonnes = integrity.ReportRow
+    return text(f"""
+        SELECT id::text, kind::text, signal::text,
+               ST_Y(geom::geometry), ST_X(geom::geometry),
+               {opt('device_id', 'text')}, {opt('accuracy_m', 'integer')}, {opt('photo_url', 'text')},
+               user_id::text, signature, {opt('sig_version', 'smallint')}
+          FROM reports
+         WHERE created_at >= :from_ts AND created_at < :to_ts
+           AND signature IS NOT NULL
+    """).execution_options(yield_per=VERIFY_CHUNK)
+
+
+async def create_run(db: AsyncSession, from_ts: datetime, to_ts: datetime, source: str = "api") -> int:
+    res = await db.execute(text("""
+        INSERT INTO integrity_runs(from_ts, to_ts, source) VALUES (:f, :t, :s) RETURNING id
+    """), {"f": from_ts, "t": to_ts, "s": source})
+    run_id = res.scalar_one()
+    await db.commit()
+    return int(run_id)
+
+
+async def run_verification(run_id: int, from_ts: datetime, to_ts: datetime) -> Dict[str, Any]:
+    """Un passage complet (voir docstring du module). Retourne scanned / mismatches / débit."""
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    pending: deque = deque()
+    st = {"scanned": 0, "mismatches": 0}
+    t0 = time.monotonic()
+
+    def rps() -> float:
+        return round(st["scanned"] / max(time.monotonic() - t0, 1e-6), 1)
+
+    async with SessionLocal() as wdb, SessionLocal() as rdb:
+        async def collect() -> None:
+            n, bad = await pending.popleft()
+            st["scanned"] += n
+            st["mismatches"] += len(bad)
+            if bad:
+                await wdb.execute(_AUDIT_SQL, [
+                    {"run_id": run_id, "rid": rid, "stored": stored, "expected": expected}
+                    for rid, stored, expected in bad
+                ])
+            await wdb.execute(_PROGRESS_SQL, {"run_id": run_id, "rps": rps(), **st})
+            await wdb.commit()
+
+        try:
+            reg = await schema_registry.get(rdb)
+            result = await rdb.stream(_stream_sql(reg), {"from_ts": from_ts, "to_ts": to_ts})
+            async for part in result.partitions():
+                pending.append(loop.run_in_executor(pool, verify_chunk, [tuple(r) for r in part]))
+                while len(pending) >= VERIFY_MAX_INFLIGHT:
+                    await collect()
+            await rdb.rollback()            # ferme le curseur / la transaction de lecture
+            while pending:
+                await collect()
+        finally:
+            for f in pending:
+                f.cancel()
+
+    elapsed = time.monotonic() - t0
+    return {**st, "elapsed_s": round(elapsed, 2), "rows_per_s": rps()}
+
+
+async def _finish_run(run_id: int, status: str, stats: Optional[Dict[str, Any]] = None,
+                      error: Optional[str] = None) -> None:
+    stats = stats or {}
+    async with SessionLocal() as db:
+        await db.execute(text("""
+            UPDATE integrity_runs
+               SET status = :status, error = :error, finished_at = NOW(), updated_at = NOW(),
+                   scanned = COALESCE(:scanned, scanned),
+                   mismatches = COALESCE(:mismatches, mismatches),
+                   rows_per_s = COALESCE(:rps, rows_per_s)
+             WHERE id = :run_id
+        """), {
+            "run_id": run_id, "status": status, "error": error,
+            "scanned": stats.get("scanned"), "mismatches": stats.get("mismatches"),
+            "rps": stats.get("rows_per_s"),
+        })
+        await db.commit()
+
+
+async def execute(run_id: int, from_ts: datetime, to_ts: datetime) -> Dict[str, Any]:
+    """run_verification + statut final du passage (done | failed | cancelled)."""
+    try:
+        stats = await run_verification(run_id, from_ts, to_ts)
+    except asyncio.CancelledError:
+        await _finish_run(run_id, "cancelled")
+        raise
+    except Exception as e:
+        print(f"[verify] run {run_id} failed: {e}")
+        await _finish_run(run_id, "failed", error=f"{type(e).__name__}: {e}"[:1000])
+        raise
+    await _finish_run(run_id, "done", stats)
+    print(f"[verify] run {run_id}: {stats['scanned']} reports, {stats['mismatches']} mismatches, "
+          f"{stats['rows_per_s']} rows/s")
+    return stats
+
+
+# -----------------------------------------------------------------------------
+# Registre des passages lancés par ce worker (API)
+# -----------------------------------------------------------------------------
+def running_jobs() -> List[int]:
+    for run_id in [k for k, t in _jobs.items() if t.done()]:
+        _jobs.pop(run_id)
+    return sorted(_jobs)
+
+
+async def start_job(db: AsyncSession, from_ts: datetime, to_ts: datetime) -> Optional[int]:
+    """Lance un passage en tâche de fond ; None si VERIFY_MAX_JOBS passages tournent déjà ici."""
+    async with _start_lock:
+        if len(running_jobs()) >= VERIFY_MAX_JOBS:
+            return None
+        run_id = await create_run(db, from_ts, to_ts, "api")
+
+        async def _job() -> None:
+            try:
+                await execute(run_id, from_ts, to_ts)
+            except Exception:
+                pass                        # déjà enregistré dans integrity_runs
+
+        _jobs[run_id] = asyncio.get_running_loop().create_task(_job())
+    return run_id
+
+
+def cancel_job(run_id: int) -> bool:
+    task = _jobs.get(run_id)
+    if task is None or task.done():
+        return False
+    task.cancel()
+    return True
+
+
+async def get_run(db: AsyncSession, run_id: int, mismatch_limit: int = 100) -> Optional[Dict[str, Any]]:
+    row = (await db.execute(text(f"SELECT {_RUN_COLS} FROM integrity_runs WHERE id = :id"),
+                            {"id": run_id})).mappings().first()
+    if row is None:
+        return None
+    rs = await db.execute(text("""
+        SELECT report_id::text AS report_id, stored_signature, expected_signature, detected_at
+          FROM integrity_audit
+         WHERE run_id = :id
+         ORDER BY id
+         LIMIT :n
+    """), {"id": run_id, "n": mismatch_limit})
+    return {**dict(row), "local": run_id in running_jobs(), "mismatch_rows": [dict(r) for r in rs.mappings()]}
+
+
+async def list_runs(db: AsyncSession, limit: int = 20) -> List[Dict[str, Any]]:
+    rs = await db.execute(text(f"SELECT {_RUN_COLS} FROM integrity_runs ORDER BY started_at DESC LIMIT :n"),
+                          {"n": limit})
+    return [dict(r) for r in rs.mappings()]
+
+
+async def stop() -> None:
+    global _pool
+    for task in list(_jobs.values()):
+        task.cancel()
+    for task in list(_jobs.values()):
+        try:
+            await task
+        except BaseException:
+            pass
+    _jobs.clear()
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def verify_status() -> Dict[str, Any]:
+    return {
+        "processes": VERIFY_PROCESSES,
+        "chunk": VERIFY_CHUNK,
+        "max_inflight": VERIFY_MAX_INFLIGHT,
+        "max_jobs": VERIFY_MAX_JOBS,
+        "pool_started": _pool is not None,
+        "running_here": running_jobs(),
+    }
+
+
+# -----------------------------------------------------------------------------
+# CLI
+# -----------------------------------------------------------------------------
+def _parse_ts(v: str) -> datetime:
+    ts = datetime.fromisoformat(v)
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+async def _main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(prog="python -m app.services.verify",
+                                 description="Vérifie les signatures HMAC des reports d'une plage created_at.")
+    ap.add_argument("--from", dest="from_ts", type=_parse_ts, help="début (ISO 8601, UTC par défaut)")
+    ap.add_argument("--to", dest="to_ts", type=_parse_ts, help="fin exclue (défaut : maintenant)")
+    ap.add_argument("--days", type=int, default=30, help="plage si --from absent (défaut 30)")
+    args = ap.parse_args(argv)
+
+    to_ts = args.to_ts or datetime.now(timezone.utc)
+    from_ts = args.from_ts or to_ts - timedelta(days=args.days)
+
+    from app.db import engine
+    try:
+        async with SessionLocal() as db:
+            run_id = await create_run(db, from_ts, to_ts, "cli")
+        print(f"[verify] run {run_id}: {from_ts.isoformat()} → {to_ts.isoformat()}, "
+              f"{VERIFY_PROCESSES} processes, chunk {VERIFY_CHUNK}")
+        stats = await execute(run_id, from_ts, to_ts)
+        return 2 if stats["mismatches"] else 0
+    except Exception as e:
+        print(f"[verify] failed: {e}")
+        return 1
+    finally:
+        await stop()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
@@ -0,0 +1,128 @@
+-- 0001_baseline.sql
+-- Schéma de base (tables, colonnes, index) tel qu'il était créé jusqu'ici
+-- à la volée par l'app (run_aggregation, ensure_schema, mark_status, factory_reset).
+-- Idempotent : s'applique aussi bien sur une base vide que sur la prod existante.
+
+CREATE EXTENSION IF NOT EXISTS postgis;
+CREATE EXTENSION IF NOT EXISTS pgcrypto;   -- gen_random_uuid() (< PG13)
+
+-- ---------- types ----------
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'report_kind') THEN
+    CREATE TYPE report_kind AS ENUM
+      ('traffic','accident','fire','flood','power','water','assault','weapon','medical');
+  END IF;
+  IF NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'report_signal') THEN
+    CREATE TYPE report_signal AS ENUM ('cut','restored');
+  END IF;
+  IF NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'outage_kind') THEN
+    CREATE TYPE outage_kind AS ENUM ('power','water');
+  END IF;
+END $$;
+
+-- ---------- app_users ----------
+CREATE TABLE IF NOT EXISTS app_users (
+  id         uuid PRIMARY KEY,
+  created_at timestamptz NOT NULL DEFAULT now()
+);
+
+-- ---------- reports ----------
+CREATE TABLE IF NOT EXISTS reports (
+  id         uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+  kind       report_kind   NOT NULL,
+  signal     report_signal NOT NULL,
+  geom       geography(Point, 4326) NOT NULL,
+  user_id    uuid NULL REFERENCES app_users(id),
+  created_at timestamptz NOT NULL DEFAULT now()
+);
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS idempotency_key text NULL;
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS phone           text NULL;
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS accuracy_m      integer NULL;
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS note            text NULL;
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS photo_url       text NULL;
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS device_id       text NULL;
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS signature       text NULL;   -- HMAC (services/integrity.py)
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS status          text NULL;   -- CTA : new|confirmed|resolved
+
+CREATE INDEX IF NOT EXISTS idx_reports_geom       ON reports USING GIST (geom);
+CREATE INDEX IF NOT EXISTS idx_reports_geom_gm    ON reports USING GIST ((geom::geometry));
+CREATE INDEX IF NOT EXISTS idx_reports_created_at ON reports (created_at);
+CREATE INDEX IF NOT EXISTS idx_reports_idem       ON reports (idempotency_key) WHERE idempotency_key IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_reports_user       ON reports (user_id, created_at);
+
+-- ---------- outages ----------
+CREATE TABLE IF NOT EXISTS outages (
+  id     bigserial PRIMARY KEY,
+  kind   outage_kind NOT NULL,
+  center geography(Point, 4326) NOT NULL
+);
+ALTER TABLE outages ADD COLUMN IF NOT EXISTS started_at     timestamp NULL;
+ALTER TABLE outages ADD COLUMN IF NOT EXISTS restored_at    timestamp NULL;
+ALTER TABLE outages ADD COLUMN IF NOT EXISTS radius_m       integer NULL DEFAULT 350;
+ALTER TABLE outages ADD COLUMN IF NOT EXISTS status         text NULL;
+ALTER TABLE outages ADD COLUMN IF NOT EXISTS label_override text NULL;
+
+CREATE INDEX IF NOT EXISTS idx_outages_center    ON outages USING GIST ((center::geometry));
+CREATE INDEX IF NOT EXISTS idx_outages_center_gg ON outages USING GIST (center);
+CREATE INDEX IF NOT EXISTS idx_outages_kind      ON outages (kind);
+
+-- ---------- incidents ----------
+CREATE TABLE IF NOT EXISTS incidents (
+  id     bigserial PRIMARY KEY,
+  kind   text NOT NULL,
+  center geography(Point, 4326) NOT NULL
+);
+ALTER TABLE incidents ADD COLUMN IF NOT EXISTS started_at     timestamp NULL DEFAULT now();
+ALTER TABLE incidents ADD COLUMN IF NOT EXISTS restored_at    timestamp NULL;
+ALTER TABLE incidents ADD COLUMN IF NOT EXISTS active         boolean NULL DEFAULT true;
+ALTER TABLE incidents ADD COLUMN IF NOT EXISTS created_at     timestamptz NULL DEFAULT now();
+ALTER TABLE incidents ADD COLUMN IF NOT EXISTS last_report_at timestamptz NULL;
+ALTER TABLE incidents ADD COLUMN IF NOT EXISTS ended_at       timestamptz NULL;
+
+CREATE INDEX IF NOT EXISTS idx_incidents_center    ON incidents USING GIST ((center::geometry));
+CREATE INDEX IF NOT EXISTS idx_incidents_center_gg ON incidents USING GIST (center);
+CREATE INDEX IF NOT EXISTS idx_incidents_kind      ON incidents (kind);
+
+-- ---------- attachments ----------
+CREATE TABLE IF NOT EXISTS attachments (
+  id         uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+  kind       text NULL,
+  geom       geography(Point, 4326) NULL,
+  user_id    uuid NULL,
+  url        text NULL,
+  created_at timestamptz NOT NULL DEFAULT now()
+);
+ALTER TABLE attachments ADD COLUMN IF NOT EXISTS idempotency_key text NULL;
+ALTER TABLE attachments ADD COLUMN IF NOT EXISTS is_sensitive    boolean NULL DEFAULT true;
+ALTER TABLE attachments ADD COLUMN IF NOT EXISTS uploader_id     uuid NULL;
+
+CREATE INDEX IF NOT EXISTS idx_attachments_geom       ON attachments USING GIST (geom);
+CREATE INDEX IF NOT EXISTS idx_attachments_created_at ON attachments (created_at);
+
+-- ---------- acks (pompiers) / responder_claims ----------
+CREATE TABLE IF NOT EXISTS acks (
+  id         bigserial PRIMARY KEY,
+  kind       text NULL,
+  geom       geography(Point, 4326) NULL,
+  user_id    uuid NULL,
+  created_at timestamptz NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS idx_acks_geom ON acks USING GIST (geom);
+
+CREATE TABLE IF NOT EXISTS responder_claims (
+  id         bigserial PRIMARY KEY,
+  kind       text NULL,
+  center     geography(Point, 4326) NULL,
+  responder  text NULL,
+  created_at timestamptz NOT NULL DEFAULT now()
+);
+
+-- ---------- audit (phase 1) ----------
+CREATE TABLE IF NOT EXISTS report_events (
+  id         bigserial PRIMARY KEY,
+  report_id  uuid NULL,
+  event      text NOT NULL,
+  created_at timestamptz NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS idx_report_events_report ON report_events (report_id);
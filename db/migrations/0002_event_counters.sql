@@ -0,0 +1,12 @@
+-- 0002_event_counters.sql
+-- Compteurs maintenus sur outages / incidents (services/event_counters.py)
+
+ALTER TABLE outages   ADD COLUMN IF NOT EXISTS attachments_count integer NOT NULL DEFAULT 0;
+ALTER TABLE outages   ADD COLUMN IF NOT EXISTS reports_count     integer NOT NULL DEFAULT 0;
+ALTER TABLE outages   ADD COLUMN IF NOT EXISTS first_report_at   timestamptz NULL;
+ALTER TABLE outages   ADD COLUMN IF NOT EXISTS last_report_at    timestamptz NULL;
+
+ALTER TABLE incidents ADD COLUMN IF NOT EXISTS attachments_count integer NOT NULL DEFAULT 0;
+ALTER TABLE incidents ADD COLUMN IF NOT EXISTS reports_count     integer NOT NULL DEFAULT 0;
+ALTER TABLE incidents ADD COLUMN IF NOT EXISTS first_report_at   timestamptz NULL;
+ALTER TABLE incidents ADD COLUMN IF NOT EXISTS last_report_at    timestamptz NULL;
@@ -0,0 +1,68 @@
+-- 0003_map_change_tracking.sql
+-- Synchro incrémentale /map?since= (services/map_sync.py) :
+-- updated_at posé par trigger + tombstones des DELETE / TRUNCATE
+
+CREATE TABLE IF NOT EXISTS map_tombstones (
+  id         bigserial PRIMARY KEY,
+  tbl        text        NOT NULL,
+  row_id     text        NULL,          -- NULL = TRUNCATE (reset complet)
+  deleted_at timestamptz NOT NULL DEFAULT clock_timestamp()
+);
+CREATE INDEX IF NOT EXISTS idx_map_tombstones_deleted_at ON map_tombstones(deleted_at);
+
+CREATE OR REPLACE FUNCTION map_touch_updated_at() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  NEW.updated_at := clock_timestamp();
+  RETURN NEW;
+END $$;
+
+CREATE OR REPLACE FUNCTION map_tombstone_row() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  INSERT INTO map_tombstones(tbl, row_id) VALUES (TG_TABLE_NAME, OLD.id::text);
+  RETURN OLD;
+END $$;
+
+CREATE OR REPLACE FUNCTION map_tombstone_truncate() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  INSERT INTO map_tombstones(tbl, row_id) VALUES (TG_TABLE_NAME, NULL);
+  RETURN NULL;
+END $$;
+
+ALTER TABLE outages   ADD COLUMN IF NOT EXISTS updated_at timestamptz NULL;
+ALTER TABLE incidents ADD COLUMN IF NOT EXISTS updated_at timestamptz NULL;
+ALTER TABLE reports   ADD COLUMN IF NOT EXISTS updated_at timestamptz NULL;
+CREATE INDEX IF NOT EXISTS idx_outages_updated_at   ON outages(updated_at);
+CREATE INDEX IF NOT EXISTS idx_incidents_updated_at ON incidents(updated_at);
+CREATE INDEX IF NOT EXISTS idx_reports_updated_at   ON reports(updated_at);
+
+DROP TRIGGER IF EXISTS trg_outages_touch ON outages;
+CREATE TRIGGER trg_outages_touch BEFORE INSERT OR UPDATE ON outages
+  FOR EACH ROW EXECUTE FUNCTION map_touch_updated_at();
+DROP TRIGGER IF EXISTS trg_incidents_touch ON incidents;
+CREATE TRIGGER trg_incidents_touch BEFORE INSERT OR UPDATE ON incidents
+  FOR EACH ROW EXECUTE FUNCTION map_touch_updated_at();
+DROP TRIGGER IF EXISTS trg_reports_touch ON reports;
+CREATE TRIGGER trg_reports_touch BEFORE INSERT OR UPDATE ON reports
+  FOR EACH ROW EXECUTE FUNCTION map_touch_updated_at();
+
+DROP TRIGGER IF EXISTS trg_outages_tombstone ON outages;
+CREATE TRIGGER trg_outages_tombstone AFTER DELETE ON outages
+  FOR EACH ROW EXECUTE FUNCTION map_tombstone_row();
+DROP TRIGGER IF EXISTS trg_incidents_tombstone ON incidents;
+CREATE TRIGGER trg_incidents_tombstone AFTER DELETE ON incidents
+  FOR EACH ROW EXECUTE FUNCTION map_tombstone_row();
+-- reports : pas de tombstone pour les vieux reports (purges admin massives, hors fenêtre /map)
+DROP TRIGGER IF EXISTS trg_reports_tombstone ON reports;
+CREATE TRIGGER trg_reports_tombstone AFTER DELETE ON reports
+  FOR EACH ROW WHEN (OLD.created_at > NOW() - INTERVAL '24 hours')
+  EXECUTE FUNCTION map_tombstone_row();
+
+DROP TRIGGER IF EXISTS trg_outages_truncate ON outages;
+CREATE TRIGGER trg_outages_truncate AFTER TRUNCATE ON outages
+  FOR EACH STATEMENT EXECUTE FUNCTION map_tombstone_truncate();
+DROP TRIGGER IF EXISTS trg_incidents_truncate ON incidents;
+CREATE TRIGGER trg_incidents_truncate AFTER TRUNCATE ON incidents
+  FOR EACH STATEMENT EXECUTE FUNCTION map_tombstone_truncate();
+DROP TRIGGER IF EXISTS trg_reports_truncate ON reports;
+CREATE TRIGGER trg_reports_truncate AFTER TRUNCATE ON reports
+  FOR EACH STATEMENT EXECUTE FUNCTION map_tombstone_truncate();
@@ -0,0 +1,57 @@
+-- 0004_area_versions.sql
+-- Versions par cellule geohash pour l'ETag de /map (services/area_versions.py).
+-- Précision 5 : doit rester égale à MAP_ETAG_PRECISION côté Python.
+
+CREATE TABLE IF NOT EXISTS area_versions (
+  cell       text        PRIMARY KEY,
+  version    bigint      NOT NULL DEFAULT 0,
+  updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION area_versions_bump() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+  c_new text;
+  c_old text;
+BEGIN
+  IF TG_OP <> 'DELETE' THEN
+    IF TG_TABLE_NAME IN ('outages', 'incidents') THEN
+      c_new := ST_GeoHash(NEW.center::geometry, 5);
+    ELSE
+      c_new := ST_GeoHash(NEW.geom::geometry, 5);
+    END IF;
+  END IF;
+  IF TG_OP <> 'INSERT' THEN
+    IF TG_TABLE_NAME IN ('outages', 'incidents') THEN
+      c_old := ST_GeoHash(OLD.center::geometry, 5);
+    ELSE
+      c_old := ST_GeoHash(OLD.geom::geometry, 5);
+    END IF;
+  END IF;
+
+  INSERT INTO area_versions(cell, version, updated_at)
+  SELECT c, 1, clock_timestamp()
+    FROM (SELECT DISTINCT c FROM unnest(ARRAY[c_new, c_old]) AS c WHERE c IS NOT NULL) s
+  ON CONFLICT (cell) DO UPDATE
+     SET version = area_versions.version + 1, updated_at = EXCLUDED.updated_at;
+
+  -- show_all ne lit que les évènements
+  IF TG_TABLE_NAME IN ('outages', 'incidents') THEN
+    INSERT INTO area_versions(cell, version, updated_at) VALUES ('*', 1, clock_timestamp())
+    ON CONFLICT (cell) DO UPDATE
+       SET version = area_versions.version + 1, updated_at = EXCLUDED.updated_at;
+  END IF;
+  RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS trg_outages_area_version ON outages;
+CREATE TRIGGER trg_outages_area_version AFTER INSERT OR UPDATE OR DELETE ON outages
+  FOR EACH ROW EXECUTE FUNCTION area_versions_bump();
+DROP TRIGGER IF EXISTS trg_incidents_area_version ON incidents;
+CREATE TRIGGER trg_incidents_area_version AFTER INSERT OR UPDATE OR DELETE ON incidents
+  FOR EACH ROW EXECUTE FUNCTION area_versions_bump();
+DROP TRIGGER IF EXISTS trg_reports_area_version ON reports;
+CREATE TRIGGER trg_reports_area_version AFTER INSERT OR UPDATE OR DELETE ON reports
+  FOR EACH ROW EXECUTE FUNCTION area_versions_bump();
+DROP TRIGGER IF EXISTS trg_acks_area_version ON acks;
+CREATE TRIGGER trg_acks_area_version AFTER INSERT OR UPDATE OR DELETE ON acks
+  FOR EACH ROW EXECUTE FUNCTION area_versions_bump();
@@ -0,0 +1,44 @@
+-- 0005_spatial_index_notify.sql
+-- Index spatial en mémoire (services/spatial_index.py) : chaque écriture sur
+-- outages / incidents / acks publie {"t": table, "id": id} sur le canal
+-- ayii_spatial ; TRUNCATE publie {"t": table, "reset": true}.
+-- NOTIFY n'est délivré qu'au COMMIT → l'index ne voit jamais de ligne annulée.
+
+CREATE OR REPLACE FUNCTION spatial_index_notify_row() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+  rid bigint;
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    rid := OLD.id;
+  ELSE
+    rid := NEW.id;
+  END IF;
+  PERFORM pg_notify('ayii_spatial', json_build_object('t', TG_TABLE_NAME, 'id', rid)::text);
+  RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION spatial_index_notify_truncate() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  PERFORM pg_notify('ayii_spatial', json_build_object('t', TG_TABLE_NAME, 'reset', true)::text);
+  RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS trg_outages_spatial_notify ON outages;
+CREATE TRIGGER trg_outages_spatial_notify AFTER INSERT OR UPDATE OR DELETE ON outages
+  FOR EACH ROW EXECUTE FUNCTION spatial_index_notify_row();
+DROP TRIGGER IF EXISTS trg_incidents_spatial_notify ON incidents;
+CREATE TRIGGER trg_incidents_spatial_notify AFTER INSERT OR UPDATE OR DELETE ON incidents
+  FOR EACH ROW EXECUTE FUNCTION spatial_index_notify_row();
+DROP TRIGGER IF EXISTS trg_acks_spatial_notify ON acks;
+CREATE TRIGGER trg_acks_spatial_notify AFTER INSERT OR UPDATE OR DELETE ON acks
+  FOR EACH ROW EXECUTE FUNCTION spatial_index_notify_row();
+
+DROP TRIGGER IF EXISTS trg_outages_spatial_truncate ON outages;
+CREATE TRIGGER trg_outages_spatial_truncate AFTER TRUNCATE ON outages
+  FOR EACH STATEMENT EXECUTE FUNCTION spatial_index_notify_truncate();
+DROP TRIGGER IF EXISTS trg_incidents_spatial_truncate ON incidents;
+CREATE TRIGGER trg_incidents_spatial_truncate AFTER TRUNCATE ON incidents
+  FOR EACH STATEMENT EXECUTE FUNCTION spatial_index_notify_truncate();
+DROP TRIGGER IF EXISTS trg_acks_spatial_truncate ON acks;
+CREATE TRIGGER trg_acks_spatial_truncate AFTER TRUNCATE ON acks
+  FOR EACH STATEMENT EXECUTE FUNCTION spatial_index_notify_truncate();
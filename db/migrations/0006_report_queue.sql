@@ -0,0 +1,13 @@
+-- 0006_report_queue.sql
+-- File d'ingestion write-behind (REPORT_INGEST_MODE=queue, services/report_queue.py) :
+-- POST /report stocke le report ici et répond 202 ; des workers vident la file
+-- par lots (FOR UPDATE SKIP LOCKED) et appliquent la logique outages / incidents.
+
+CREATE TABLE IF NOT EXISTS report_queue (
+  id          bigserial   PRIMARY KEY,
+  payload     jsonb       NOT NULL,             -- item normalisé (services/ingest.py), id du report pré-attribué
+  enqueued_at timestamptz NOT NULL DEFAULT now(),
+  claimed_at  timestamptz NULL,                 -- bail d'un worker (REPORT_QUEUE_LEASE_S)
+  attempts    integer     NOT NULL DEFAULT 0,   -- ≥ REPORT_QUEUE_MAX_ATTEMPTS → lettre morte, gardée pour analyse
+  last_error  text        NULL
+);
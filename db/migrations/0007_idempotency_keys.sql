@@ -0,0 +1,38 @@
+-- 0007_idempotency_keys.sql
+-- Clés d'idempotence des écritures (services/idempotency.py) : POST /report,
+-- /upload_image, /upload_video. La clé primaire rend la prise de clé atomique
+-- (deux retries simultanés : un seul passe), la réponse d'origine est gardée
+-- pour être rejouée. Purge au-delà de IDEMPOTENCY_TTL_H.
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+  scope        text        NOT NULL,            -- 'report' | 'attachment'
+  key          text        NOT NULL,
+  created_at   timestamptz NOT NULL DEFAULT now(),
+  completed_at timestamptz NULL,                -- NULL = écriture en cours (bail IDEMPOTENCY_INFLIGHT_S)
+  status_code  integer     NULL,
+  response     jsonb       NULL,
+  PRIMARY KEY (scope, key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at);
+
+-- reprise des clés récentes : un retry qui chevauche le déploiement reste dédoublonné
+INSERT INTO idempotency_keys(scope, key, created_at, completed_at, status_code, response)
+SELECT DISTINCT ON (idempotency_key)
+       'report', idempotency_key, created_at, created_at, 200,
+       jsonb_build_object('ok', true, 'id', id, 'idempotency_key', idempotency_key)
+  FROM reports
+ WHERE idempotency_key IS NOT NULL
+   AND created_at > now() - INTERVAL '48 hours'
+ ORDER BY idempotency_key, created_at
+ON CONFLICT (scope, key) DO NOTHING;
+
+INSERT INTO idempotency_keys(scope, key, created_at, completed_at, status_code, response)
+SELECT DISTINCT ON (idempotency_key)
+       'attachment', idempotency_key, created_at, created_at, 200,
+       jsonb_build_object('ok', true, 'id', id::text, 'url', url, 'idempotency_key', idempotency_key)
+  FROM attachments
+ WHERE idempotency_key IS NOT NULL
+   AND created_at > now() - INTERVAL '48 hours'
+ ORDER BY idempotency_key, created_at
+ON CONFLICT (scope, key) DO NOTHING;
@@ -0,0 +1,34 @@
+-- 0008_integrity_audit.sql
+-- Vérification en masse des signatures HMAC des reports (services/verify.py).
+-- integrity_runs : un passage (plage created_at) = une ligne, progression et
+-- débit mis à jour au fil du passage (visible de tous les workers).
+-- integrity_audit : reports dont la signature stockée ne correspond plus.
+
+CREATE TABLE IF NOT EXISTS integrity_runs (
+  id          bigserial   PRIMARY KEY,
+  from_ts     timestamptz NOT NULL,
+  to_ts       timestamptz NOT NULL,
+  status      text        NOT NULL DEFAULT 'running',   -- running | done | failed | cancelled
+  source      text        NOT NULL DEFAULT 'api',       -- api | cli
+  scanned     bigint      NOT NULL DEFAULT 0,
+  mismatches  bigint      NOT NULL DEFAULT 0,
+  rows_per_s  double precision NULL,
+  error       text        NULL,
+  started_at  timestamptz NOT NULL DEFAULT now(),
+  updated_at  timestamptz NOT NULL DEFAULT now(),
+  finished_at timestamptz NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_integrity_runs_started ON integrity_runs (started_at DESC);
+
+CREATE TABLE IF NOT EXISTS integrity_audit (
+  id                 bigserial   PRIMARY KEY,
+  run_id             bigint      NOT NULL REFERENCES integrity_runs(id) ON DELETE CASCADE,
+  report_id          uuid        NOT NULL,
+  stored_signature   text        NOT NULL,
+  expected_signature text        NOT NULL,
+  detected_at        timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_integrity_audit_run    ON integrity_audit (run_id, id);
+CREATE INDEX IF NOT EXISTS idx_integrity_audit_report ON integrity_audit (report_id);
@@ -0,0 +1,40 @@
+-- 0009_area_versions_no_global_row.sql
+-- La ligne globale '*' (show_all) était incrémentée par toute écriture sur
+-- outages / incidents (compteurs, refresh_event_counters, auto-expire,
+-- agrégation…) : verrou de ligne tenu jusqu'au COMMIT → toutes les écritures
+-- concurrentes sérialisées sur une seule ligne.
+-- La version show_all est désormais dérivée de max(updated_at) des
+-- évènements + dernier tombstone (services/area_versions.py, migration 0003).
+-- Les cellules geohash restent versionnées par le trigger.
+
+CREATE OR REPLACE FUNCTION area_versions_bump() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+  c_new text;
+  c_old text;
+BEGIN
+  IF TG_OP <> 'DELETE' THEN
+    IF TG_TABLE_NAME IN ('outages', 'incidents') THEN
+      c_new := ST_GeoHash(NEW.center::geometry, 5);
+    ELSE
+      c_new := ST_GeoHash(NEW.geom::geometry, 5);
+    END IF;
+  END IF;
+  IF TG_OP <> 'INSERT' THEN
+    IF TG_TABLE_NAME IN ('outages', 'incidents') THEN
+      c_old := ST_GeoHash(OLD.center::geometry, 5);
+    ELSE
+      c_old := ST_GeoHash(OLD.geom::geometry, 5);
+    END IF;
+  END IF;
+
+  INSERT INTO area_versions(cell, version, updated_at)
+  SELECT c, 1, clock_timestamp()
+    FROM (SELECT DISTINCT c FROM unnest(ARRAY[c_new, c_old]) AS c WHERE c IS NOT NULL) s
+  ON CONFLICT (cell) DO UPDATE
+     SET version = area_versions.version + 1, updated_at = EXCLUDED.updated_at;
+  RETURN NULL;
+END $$;
+
+DELETE FROM area_versions WHERE cell = '*';
+
+CREATE INDEX IF NOT EXISTS idx_map_tombstones_tbl_deleted_at ON map_tombstones(tbl, deleted_at);
@@ -0,0 +1,9 @@
+-- 0010_reports_sig_version.sql
+-- Version de la forme canonique signée des reports (services/integrity.py) :
+--   NULL = 1 : valeurs brutes reçues du client (signatures antérieures)
+--   2        : forme relue en base (uuid minuscule, kind / signal normalisés)
+-- La vérification (services/verify.py) recalcule chaque ligne dans la forme
+-- de sa version : l'historique reste vérifiable sans re-signature (qui
+-- blanchirait au passage une ligne altérée).
+
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS sig_version smallint NULL;
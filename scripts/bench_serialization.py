@@ -0,0 +1,149 @@
+# scripts/bench_serialization.py
+"""
+Coût de sérialisation par 1 000 évènements, avant / après app/responses.py.
+
+avant : lignes → dict (getattr / float champ par champ) → jsonable_encoder
+        → JSONResponse (json stdlib)
+après : lignes → dict(mapping) → FastJSONResponse (orjson)
+
+Les lignes sont de vrais Row SQLAlchemy (sans base) : on mesure la construction
+du payload + le rendu, pas la requête.
+
+Usage :
+    python scripts/bench_serialization.py [--n 1000] [--repeat 20]
+"""
+import argparse
+import json
+import pathlib
+import random
+import sys
+import timeit
+import uuid
+from datetime import datetime, timedelta, timezone
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from fastapi.encoders import jsonable_encoder               # noqa: E402
+from fastapi.responses import JSONResponse                   # noqa: E402
+from sqlalchemy.engine.result import IteratorResult, SimpleResultMetaData  # noqa: E402
+
+from app.responses import FastJSONResponse, geojson_collection, geojson_feature, orjson  # noqa: E402
+
+EVENT_KEYS = ("id", "kind", "status", "lat", "lng", "started_at", "restored_at",
+              "attachments_count", "reports_count")
+REPORT_KEYS = ("id", "kind", "signal", "lat", "lng", "user_id", "created_at", "phone")
+
+
+def _result(keys, rows):
+    return IteratorResult(SimpleResultMetaData(keys), iter(rows))
+
+
+def _event_rows(n):
+    now = datetime.now()
+    return [
+        (i, random.choice(("power", "water")), "active",
+         6.13 + random.random() / 10, 1.22 + random.random() / 10,
+         now - timedelta(minutes=random.randint(0, 600)), None,
+         random.randint(0, 5), random.randint(0, 40))
+        for i in range(n)
+    ]
+
+
+def _report_rows(n):
+    now = datetime.now(timezone.utc)
+    return [
+        (uuid.uuid4(), "fire", "cut", 6.13 + random.random() / 10, 1.22 + random.random() / 10,
+         uuid.uuid4() if i % 2 else None, now - timedelta(seconds=i), "+22890000000")
+        for i in range(n)
+    ]
+
+
+# ---------- avant ----------
+def events_before(rows):
+    res = _result(EVENT_KEYS, rows)
+    payload = {"outages": [
+        {
+            "id": r.id, "kind": r.kind, "status": r.status,
+            "lat": float(r.lat), "lng": float(r.lng),
+            "started_at": getattr(r, "started_at", None),
+            "restored_at": getattr(r, "restored_at", None),
+            "attachments_count": getattr(r, "attachments_count", 0),
+            "reports_count": getattr(r, "reports_count", 0),
+        } for r in res.fetchall()
+    ]}
+    return JSONResponse(jsonable_encoder(payload)).body
+
+
+def reports_before(rows):
+    res = _result(REPORT_KEYS, rows)
+    payload = {"last_reports": [
+        {
+            "id": r.id, "kind": r.kind, "signal": r.signal,
+            "lat": float(r.lat), "lng": float(r.lng),
+            "user_id": r.user_id, "created_at": r.created_at,
+            "phone": getattr(r, "phone", None),
+        } for r in res.fetchall()
+    ]}
+    return JSONResponse(jsonable_encoder(payload)).body
+
+
+def geojson_before(rows):
+    res = _result(("id", "kind", "geom_json", "created_at"), rows)
+    fc = {"type": "FeatureCollection", "features": []}
+    for r in res.fetchall():
+        fc["features"].append({
+            "type": "Feature", "geometry": json.loads(r.geom_json),
+            "properties": {"id": r.id, "kind": r.kind,
+                           "created_at": r.created_at.isoformat() if r.created_at else None},
+        })
+    return json.dumps(fc, ensure_ascii=False).encode("utf-8")
+
+
+# ---------- après ----------
+def events_after(rows):
+    res = _result(EVENT_KEYS, rows)
+    return FastJSONResponse({"outages": [dict(m) for m in res.mappings()]}).body
+
+
+def reports_after(rows):
+    res = _result(REPORT_KEYS, rows)
+    return FastJSONResponse({"last_reports": [dict(m) for m in res.mappings()]}).body
+
+
+def geojson_after(rows):
+    res = _result(("id", "kind", "geom_json", "created_at"), rows)
+    return geojson_collection([
+        geojson_feature(r.geom_json, {"id": r.id, "kind": r.kind, "created_at": r.created_at})
+        for r in res.fetchall() if r.geom_json
+    ])
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--n", type=int, default=1000)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    ev, rep = _event_rows(args.n), _report_rows(args.n)
+    geo = [(r[0], r[1], json.dumps({"type": "Point", "coordinates": [r[4], r[3]]}), r[5]) for r in ev]
+    cases = [
+        ("/map events", events_before, events_after, ev),
+        ("/map last_reports", reports_before, reports_after, rep),
+        ("export geojson", geojson_before, geojson_after, geo),
+    ]
+    print(f"serializer: {'orjson ' + orjson.__version__ if orjson else 'json (stdlib fallback)'}"
+          f" — {args.n} rows, best of {args.repeat}")
+    print(f"{'case':<20} {'before ms/1k':>13} {'after ms/1k':>12} {'speedup':>8}")
+    for name, before, after, rows in cases:
+        # même contenu JSON des deux côtés (sinon la mesure ne veut rien dire)
+        assert json.loads(before(rows)) == json.loads(after(rows)), name
+        per_1k = 1000.0 / args.n
+        t_b = min(timeit.repeat(lambda: before(rows), number=1, repeat=args.repeat)) * 1000 * per_1k
+        t_a = min(timeit.repeat(lambda: after(rows), number=1, repeat=args.repeat)) * 1000 * per_1k
+        print(f"{name:<20} {t_b:>13.2f} {t_a:>12.2f} {t_b / t_a:>7.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,407 @@
+# scripts/plan_check.py
+"""
+Non-régression des plans de requête sur les chemins chauds.
+
+1) (--seed) remplit une base PostGIS locale avec un volume réaliste
+   (reports sur 30 jours, outages, incidents, pièces jointes, acks…) puis ANALYZE
+2) exécute les scénarios : routes de map.py / cta.py / admin_cta.py /
+   metrics.py / tiles.py (via ASGI, sans serveur) + fonctions de crud.py
+   et aggregation.py — chaque requête SQL envoyée au driver est capturée
+3) rejoue chaque requête distincte sous EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)
+   dans une transaction annulée (les écritures ne laissent pas de trace)
+4) échoue (code 1) si une requête :
+   - fait un Seq Scan qui examine ≥ PLAN_SEQ_MIN_ROWS lignes
+     (les petites tables restent libres de se faire scanner)
+   - dépasse PLAN_MAX_MS de temps d'exécution
+   - dépasse PLAN_MAX_BUFFERS blocs partagés (hit + read)
+   sauf exception déclarée dans ALLOW (avec sa raison)
+
+Usage :
+    PLAN_DATABASE_URL=postgresql+psycopg://postgres@localhost/ayii_plan \\
+        python scripts/plan_check.py --seed [--scale 2] [--verbose] [--json out.json]
+
+PLAN_DATABASE_URL est obligatoire et doit différer de DATABASE_URL :
+--seed vide les tables.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import pathlib
+import re
+import sys
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from psycopg.errors import UniqueViolation
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+PLAN_MAX_MS      = float(os.getenv("PLAN_MAX_MS", "250"))
+PLAN_MAX_BUFFERS = int(os.getenv("PLAN_MAX_BUFFERS", "5000"))
+PLAN_SEQ_MIN_ROWS = int(os.getenv("PLAN_SEQ_MIN_ROWS", "1000"))
+
+ADMIN_TOKEN = "plan-check"
+
+# Centre des données de test (Lomé) : les scénarios interrogent autour
+LAT0, LNG0 = 6.1319, 1.2228
+
+# Exceptions connues : (regex sur « scénario\nSQL », règles levées, raison)
+ALLOW = [
+    (r"^map: GET /admin/export_",
+     {"seq", "time", "buffers"}, "exports admin : dump complet de la table, voulu"),
+    (r"WITH cand AS \(\s*SELECT e\.id, e\.kind::text AS kind",
+     {"seq"}, "refresh_event_counters : balayage des évènements actifs/récents, voulu"),
+    (r"UPDATE incidents\s+SET active=false, ended_at=COALESCE\(ended_at, NOW\(\)\)\s+WHERE active=true",
+     {"seq"}, "expire_incidents : TTL sur tous les incidents actifs"),
+    (r"UPDATE outages o\s+SET status='restored',\s+restored_at = COALESCE",
+     {"seq"}, "expire_stale_outages : toutes les zones 'ongoing'"),
+]
+
+# Requêtes non pertinentes : catalogue, verrous, migrations
+_SKIP_RE = re.compile(r"\bpg_(type|attribute|class|enum|namespace|stat\w*|advisory\w*|last_\w+|is_in_recovery)\b"
+                      r"|\bschema_migrations\b", re.I)
+_HEAD_RE = re.compile(r"^\s*(?:--[^\n]*\n\s*)*(\w+)", re.S)
+_EXPLAINABLE = {"SELECT", "WITH", "INSERT", "UPDATE", "DELETE"}
+
+
+def _configure_env() -> str:
+    url = (os.getenv("PLAN_DATABASE_URL") or "").strip()
+    if not url:
+        sys.exit("[plan] PLAN_DATABASE_URL manquant (base jetable, elle sera vidée par --seed)")
+    if url == (os.getenv("DATABASE_URL") or "").strip():
+        sys.exit("[plan] PLAN_DATABASE_URL doit différer de DATABASE_URL")
+    # avant tout import de app.* : db.py / map.py lisent l'env à l'import
+    os.environ.update({
+        "DATABASE_URL": url,
+        "ADMIN_TOKEN": ADMIN_TOKEN,
+        "SCHEDULER_ENABLED": "0",
+        "MIGRATE_ON_STARTUP": "0",
+        # on veut la requête, pas le cache
+        "MAP_CACHE_ENABLED": "0",
+        "TILE_CACHE_ENABLED": "0",
+        "MAP_SNAPSHOT_ENABLED": "0",
+    })
+    os.environ.pop("DATABASE_READ_URL", None)
+    return url
+
+
+# ---------- données ----------
+def _seed_sql(scale: float) -> List[str]:
+    n = lambda base: max(1, int(base * scale))  # noqa: E731
+    # ~70 % des points autour de Lomé, le reste sur tout le pays
+    lat = f"CASE WHEN random() < 0.7 THEN {LAT0} + (random() - 0.5) * 0.3 ELSE 6.0 + random() * 5.0 END"
+    lng = f"CASE WHEN random() < 0.7 THEN {LNG0} + (random() - 0.5) * 0.4 ELSE 0.0 + random() * 1.8 END"
+    pt = f"ST_SetSRID(ST_MakePoint({lng}, {lat}), 4326)::geography"
+    kinds = "(ARRAY['traffic','accident','fire','flood','power','water'])[1 + floor(random() * 6)::int]"
+    return [
+        "TRUNCATE reports, outages, incidents, attachments, acks, responder_claims, "
+        "report_events, app_users RESTART IDENTITY CASCADE",
+        f"""INSERT INTO app_users (id)
+            SELECT gen_random_uuid() FROM generate_series(1, {n(5000)})""",
+        # 10 % des reports dans les 4 dernières heures (fenêtres glissantes de /map)
+        f"""WITH u AS (SELECT array_agg(id) AS ids FROM app_users)
+            INSERT INTO reports (kind, signal, geom, user_id, created_at)
+            SELECT {kinds}::report_kind,
+                   (CASE WHEN random() < 0.8 THEN 'cut' ELSE 'restored' END)::report_signal,
+                   {pt},
+                   CASE WHEN random() < 0.5 THEN u.ids[1 + floor(random() * array_length(u.ids, 1))::int] END,
+                   NOW() - CASE WHEN random() < 0.1 THEN random() * INTERVAL '4 hours'
+                                ELSE random() * INTERVAL '30 days' END
+              FROM generate_series(1, {n(100000)}), u""",
+        f"""INSERT INTO outages (kind, center, started_at, restored_at, radius_m, status)
+            SELECT k::outage_kind, {pt}, s, CASE WHEN ongoing THEN NULL ELSE s + INTERVAL '3 hours' END,
+                   200 + floor(random() * 400)::int,
+                   CASE WHEN ongoing THEN 'ongoing' ELSE 'restored' END
+              FROM (SELECT (ARRAY['power','water'])[1 + floor(random() * 2)::int] AS k,
+                           random() < 0.1 AS ongoing,
+                           NOW() - random() * INTERVAL '30 days' AS s
+                      FROM generate_series(1, {n(5000)})) x""",
+        f"""INSERT INTO incidents (kind, center, started_at, created_at, last_report_at, active, restored_at, ended_at)
+            SELECT k, {pt}, s, s, s + INTERVAL '10 minutes', active,
+                   CASE WHEN active THEN NULL ELSE s + INTERVAL '2 hours' END,
+                   CASE WHEN active THEN NULL ELSE s + INTERVAL '2 hours' END
+              FROM (SELECT (ARRAY['traffic','accident','fire','flood'])[1 + floor(random() * 4)::int] AS k,
+                           random() < 0.1 AS active,
+                           NOW() - random() * INTERVAL '30 days' AS s
+                      FROM generate_series(1, {n(8000)})) x""",
+        f"""INSERT INTO attachments (kind, geom, url, created_at, is_sensitive)
+            SELECT {kinds}, {pt}, 'https://example.invalid/a/' || g || '.jpg',
+                   NOW() - random() * INTERVAL '10 days', random() < 0.5
+              FROM generate_series(1, {n(10000)}) g""",
+        f"""INSERT INTO acks (kind, geom, created_at)
+            SELECT {kinds}, {pt}, NOW() - random() * INTERVAL '10 days'
+              FROM generate_series(1, {n(3000)})""",
+        """INSERT INTO report_events (report_id, event, created_at)
+            SELECT id, 'created', created_at FROM reports
+             WHERE random() < 0.5""",
+        "ANALYZE",
+    ]
+
+
+async def seed(engine, scale: float) -> None:
+    t0 = time.perf_counter()
+    async with engine.begin() as conn:
+        for sql in _seed_sql(scale):
+            await conn.exec_driver_sql(sql)
+    print(f"[plan] seeded (scale={scale}) in {time.perf_counter() - t0:.1f}s")
+
+
+# ---------- capture ----------
+_scenario: Dict[str, Optional[str]] = {"label": None}
+_captured: Dict[str, Dict[str, Any]] = {}
+
+
+def _norm(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+def _on_execute(conn, cursor, statement, parameters, context, executemany):
+    label = _scenario["label"]
+    if label is None or executemany:
+        return
+    m = _HEAD_RE.match(statement)
+    if not m or m.group(1).upper() not in _EXPLAINABLE or _SKIP_RE.search(statement):
+        return
+    key = _norm(statement)
+    entry = _captured.get(key)
+    if entry is None:
+        _captured[key] = {"sql": statement, "params": parameters, "scenarios": [label], "calls": 1}
+    else:
+        entry["calls"] += 1
+        if label not in entry["scenarios"]:
+            entry["scenarios"].append(label)
+
+
+def _tile_xy(z: int, lat: float, lng: float):
+    n = 2 ** z
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return x, y
+
+
+async def run_scenarios() -> None:
+    import httpx
+    from app.main import app
+    from app.db import SessionLocal
+    from app import crud
+    from app.services.aggregation import run_aggregation, run_auto_expire
+
+    adm = {"x-admin-token": ADMIN_TOKEN}
+    near = {"lat": LAT0, "lng": LNG0}
+    since_us = int((time.time() - 600) * 1_000_000)
+    tx, ty = _tile_xy(14, LAT0, LNG0)
+
+    async def one_report_id() -> str:
+        async with SessionLocal() as db:
+            from sqlalchemy import text
+            return str((await db.execute(text("SELECT id FROM reports ORDER BY created_at DESC LIMIT 1"))).scalar())
+
+    routes = [
+        ("map", "GET /map local", "GET", "/map", {**near, "radius_km": 5}, None),
+        ("map", "GET /map show_all", "GET", "/map", {**near, "radius_km": 5, "show_all": 1}, None),
+        ("map", "GET /map since", "GET", "/map", {**near, "radius_km": 5, "since": since_us}, None),
+        ("map", "GET /map/viewport z11", "GET", "/map/viewport",
+         {"min_lat": 5.9, "min_lng": 0.9, "max_lat": 6.4, "max_lng": 1.6, "zoom": 11}, None),
+        ("map", "GET /map/viewport z17", "GET", "/map/viewport",
+         {"min_lat": 6.128, "min_lng": 1.219, "max_lat": 6.136, "max_lng": 1.227, "zoom": 17}, None),
+        ("map", "GET /attachments_near", "GET", "/attachments_near", {**near, "kind": "fire", "radius_m": 500}, None),
+        ("map", "GET /alert_zones", "GET", "/alert_zones", {**near, "kind": "fire", "radius_km": 5}, None),
+        ("map", "GET /reports_recent", "GET", "/reports_recent", {}, None),
+        ("map", "GET /admin/export_reports.csv", "GET", "/admin/export_reports.csv", {}, None),
+        ("map", "GET /admin/export_events.csv", "GET", "/admin/export_events.csv", {}, None),
+        ("map", "GET /admin/export_reports.geojson", "GET", "/admin/export_reports.geojson", {}, None),
+        ("map", "GET /admin/export_events.geojson", "GET", "/admin/export_events.geojson", {}, None),
+        ("map", "GET /admin/export_aggregated.csv", "GET", "/admin/export_aggregated.csv", {}, None),
+        ("tiles", "GET /tiles", "GET", f"/tiles/14/{tx}/{ty}.mvt", {}, None),
+        ("map", "POST /report cut", "POST", "/report", {}, {"kind": "power", "signal": "cut", **near}),
+        ("map", "POST /report incident", "POST", "/report", {}, {"kind": "fire", "signal": "cut", **near}),
+        ("map", "POST /report restored", "POST", "/report", {}, {"kind": "power", "signal": "restored", **near}),
+        ("map", "POST /reports/batch", "POST", "/reports/batch", {}, {"reports": [
+            {"kind": "power", "signal": "cut", **near, "idempotency_key": "plan-batch-1"},
+            {"kind": "fire", "signal": "cut", **near, "idempotency_key": "plan-batch-2"},
+            {"kind": "power", "signal": "restored", **near},
+        ]}),
+        ("map", "POST /responder/ack", "POST", "/responder/ack", {}, {"kind": "fire", **near}),
+        ("map", "POST /fire_ack", "POST", "/fire_ack", {}, {"kind": "fire", **near}),
+        ("cta", "GET /cta/incidents_v2", "GET", "/cta/incidents_v2", {}, None),
+        ("cta", "GET /cta/incidents_v2 status", "GET", "/cta/incidents_v2", {"status": "new"}, None),
+        ("admin_cta", "GET /cta/incidents", "GET", "/cta/incidents", {}, None),
+        ("admin_cta", "GET /cta/incidents status", "GET", "/cta/incidents", {"status": "new"}, None),
+        ("metrics", "GET /metrics/summary", "GET", "/metrics/summary", {}, None),
+        ("metrics", "GET /metrics/incidents_by_day", "GET", "/metrics/incidents_by_day", {}, None),
+        ("metrics", "GET /metrics/kind_breakdown", "GET", "/metrics/kind_breakdown", {}, None),
+    ]
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://plan") as client:
+        for module, label, method, path, params, body in routes:
+            _scenario["label"] = f"{module}: {label}"
+            r = await client.request(method, path, params=params, json=body, headers=adm)
+            if r.status_code >= 400:
+                print(f"[plan] ⚠️ {label} -> HTTP {r.status_code} {r.text[:120]}")
+
+        _scenario["label"] = None
+        rid = await one_report_id()
+        _scenario["label"] = "admin_cta: POST /cta/mark_status"
+        r = await client.post("/cta/mark_status", json={"id": rid, "status": "confirmed"}, headers=adm)
+        if r.status_code >= 400:
+            print(f"[plan] ⚠️ mark_status -> HTTP {r.status_code} {r.text[:120]}")
+
+    # crud / agrégation : appels directs (insert_report n'est plus derrière une route)
+    calls = [
+        ("crud: insert_report restored outage",
+         lambda db: crud.insert_report(db, kind="power", signal="restored", lat=LAT0, lng=LNG0,
+                                       user_id=str(uuid.uuid4()))),
+        ("crud: insert_report cut incident",
+         lambda db: crud.insert_report(db, kind="traffic", signal="cut", lat=LAT0, lng=LNG0)),
+        ("crud: insert_report restored incident",
+         lambda db: crud.insert_report(db, kind="traffic", signal="restored", lat=LAT0, lng=LNG0)),
+        ("crud: get_outages_in_radius", lambda db: crud.get_outages_in_radius(db, LAT0, LNG0, 5.0)),
+        ("aggregation: run_aggregation", run_aggregation),
+        ("aggregation: run_auto_expire", run_auto_expire),
+    ]
+    for label, fn in calls:
+        _scenario["label"] = label
+        async with SessionLocal() as db:
+            try:
+                await fn(db)
+            except Exception as e:
+                await db.rollback()
+                print(f"[plan] ⚠️ {label} -> {e}")
+    _scenario["label"] = None
+
+
+# ---------- EXPLAIN ----------
+def _walk(node: dict):
+    yield node
+    for child in node.get("Plans", []) or []:
+        yield from _walk(child)
+
+
+def analyze_plan(doc: dict) -> Dict[str, Any]:
+    root = doc["Plan"]
+    seq = []
+    for nd in _walk(root):
+        if nd.get("Node Type") == "Seq Scan":
+            loops = nd.get("Actual Loops", 1) or 1
+            # EXPLAIN sans ANALYZE : lignes estimées
+            rows = nd.get("Actual Rows", nd.get("Plan Rows", 0))
+            examined = (rows + nd.get("Rows Removed by Filter", 0)) * loops
+            seq.append({"relation": nd.get("Relation Name"), "rows": int(examined)})
+    return {
+        "ms": round(float(doc.get("Execution Time", 0.0)), 2),
+        "buffers": int(root.get("Shared Hit Blocks", 0) + root.get("Shared Read Blocks", 0)),
+        "seq_scans": seq,
+    }
+
+
+def _allowed(scenario: str, sql: str) -> tuple:
+    rules, reasons = set(), []
+    for rx, allow, why in ALLOW:
+        if re.search(rx, scenario + "\n" + sql, re.S | re.M):
+            rules |= allow
+            reasons.append(why)
+    return rules, reasons
+
+
+async def _explain(pg, prefix: str, sql: str, params) -> dict:
+    async with pg.transaction(force_rollback=True):
+        async with pg.cursor() as cur:
+            await cur.execute("SET LOCAL statement_timeout = '60s'")
+            await cur.execute(prefix + sql, params or None)
+            return (await cur.fetchone())[0][0]
+
+
+async def explain_all(engine) -> List[dict]:
+    results = []
+    async with engine.connect() as conn:
+        raw = await conn.get_raw_connection()
+        pg = raw.driver_connection          # psycopg AsyncConnection : même paramétrage que l'app
+        for entry in _captured.values():
+            sql, params = entry["sql"], entry["params"]
+            res = {"scenarios": entry["scenarios"], "calls": entry["calls"], "sql": _norm(sql), "failures": []}
+            try:
+                doc = await _explain(pg, "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ", sql, params)
+            except UniqueViolation:
+                # INSERT à clés générées côté client (POST /reports/batch) : déjà exécuté
+                # par le scénario → rejouer l'exécuter viole la clé ; plan estimé seulement
+                try:
+                    doc = await _explain(pg, "EXPLAIN (FORMAT JSON) ", sql, params)
+                    res["estimated"] = True
+                except Exception as e:
+                    res.update({"error": str(e).splitlines()[0], "failures": ["error"]})
+                    results.append(res)
+                    continue
+            except Exception as e:
+                res.update({"error": str(e).splitlines()[0], "failures": ["error"]})
+                results.append(res)
+                continue
+
+            stats = analyze_plan(doc)
+            res.update(stats)
+            res["plan"] = doc["Plan"]
+            allow, reasons = _allowed(entry["scenarios"][0], sql)
+            big = [s for s in stats["seq_scans"] if s["rows"] >= PLAN_SEQ_MIN_ROWS]
+            if big and "seq" not in allow:
+                res["failures"].append(
+                    "seq scan " + ", ".join(f"{s['relation']}({s['rows']})" for s in big))
+            if stats["ms"] > PLAN_MAX_MS and "time" not in allow:
+                res["failures"].append(f"time {stats['ms']}ms > {PLAN_MAX_MS}ms")
+            if stats["buffers"] > PLAN_MAX_BUFFERS and "buffers" not in allow:
+                res["failures"].append(f"buffers {stats['buffers']} > {PLAN_MAX_BUFFERS}")
+            if reasons:
+                res["allowed"] = reasons
+            results.append(res)
+    return results
+
+
+def report(results: List[dict], verbose: bool) -> int:
+    failed = [r for r in results if r["failures"]]
+    for r in sorted(results, key=lambda r: (not r["failures"], r["scenarios"][0])):
+        mark = "FAIL" if r["failures"] else "ok  "
+        ms = r.get("ms", "-")
+        buf = r.get("buffers", "-")
+        print(f"{mark} {str(ms):>9}ms {str(buf):>7}buf  {r['scenarios'][0]:<45} {r['sql'][:90]}")
+        for f in r["failures"]:
+            print(f"       -> {f}" + (f" : {r['error']}" if f == "error" else ""))
+        if verbose and r["failures"] and r.get("plan"):
+            print("       " + r["sql"])
+            print(json.dumps(r["plan"], indent=1)[:4000])
+    print(f"[plan] {len(results)} statements, {len(failed)} failing "
+          f"(seq≥{PLAN_SEQ_MIN_ROWS} rows, >{PLAN_MAX_MS}ms, >{PLAN_MAX_BUFFERS} buffers)")
+    return 1 if failed else 0
+
+
+async def _main(args) -> int:
+    from sqlalchemy import event
+    from app.db import engine
+    from app.migrate import run_migrations
+
+    await run_migrations(engine)
+    if args.seed:
+        await seed(engine, args.scale)
+    event.listen(engine.sync_engine, "before_cursor_execute", _on_execute)
+    try:
+        await run_scenarios()
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", _on_execute)
+    results = await explain_all(engine)
+    await engine.dispose()
+    if args.json:
+        pathlib.Path(args.json).write_text(json.dumps(results, indent=1, default=str), encoding="utf-8")
+    return report(results, args.verbose)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="EXPLAIN ANALYZE des requêtes chaudes")
+    ap.add_argument("--seed", action="store_true", help="vide et remplit la base avant les mesures")
+    ap.add_argument("--scale", type=float, default=1.0, help="multiplicateur de volume (1 ≈ 100k reports)")
+    ap.add_argument("--verbose", action="store_true", help="affiche le plan des requêtes en échec")
+    ap.add_argument("--json", help="écrit tous les résultats (plans compris) dans ce fichier")
+    args = ap.parse_args()
+    _configure_env()
+    sys.exit(asyncio.run(_main(args)))